@@ -1,20 +1,84 @@
+import time
+
+_IMPORT_START = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
-import io
-import zipfile
-from genai_data import parse_ddl_to_schema, generate_multi_table_data, nl_to_sql, edit_dataframe_with_prompt
-from database_utils import get_db_schema_for_llm, run_sql_query, setup_db_with_data
+import os
+from pathlib import Path
+import psycopg2
+from genai_data import nl_to_sql, edit_dataframe_with_prompt, GENERATION_MODE
+from database_utils import get_db_schema_for_llm, run_sql_query, apply_table_changes, setup_db_with_data
+from session_schemas import activate_session_schema, new_session_schema, SessionSchemaLimitError
+from schema_catalog import get_schema_catalog
+import llm_setup
+from table_store import TableStore, TABLE_PREVIEW_ROWS
+from data_export import build_archive, EXPORT_FORMATS
+from data_versions import get_data_version
+from llm_scheduler import get_scheduler_stats
+from db_connector import get_pool_stats
+from table_store import get_process_usage
+import instrumentation
+from job_runner import get_job_runner, JOB_POLL_SECONDS, ACTIVE_STATUSES, SUCCEEDED, CANCELLED, INTERRUPTED, TABLE_DONE
+
+# Only the first run of the script really imports the modules
+llm_setup.record_timing('app_import_ms', time.perf_counter() - _IMPORT_START)
+
+
+@st.cache_resource
+def llm_client_registry():
+    """Model clients shared by every session (built lazily on first use)."""
+    return llm_setup.get_client_registry()
+
+
+llm_client_registry()
+
+
+@st.cache_resource
+def diagnostics_setup():
+    """Registers the diagnostics sections and starts the metrics endpoint (if METRICS_PORT is set), once per process."""
+    instrumentation.register_provider('startup_ms', llm_setup.get_startup_timings)
+    instrumentation.register_provider('llm_scheduler', get_scheduler_stats)
+    instrumentation.register_provider('llm_clients', lambda: llm_setup.get_client_registry().stats())
+    instrumentation.register_provider('db_pool', get_pool_stats)
+    instrumentation.register_provider('table_store', get_process_usage)
+    return instrumentation.start_metrics_server()
+
+
+diagnostics_setup()
 
 
 if 'menu_selection' not in st.session_state:
     st.session_state.menu_selection = "Data Generation"
 if 'generated_tables' not in st.session_state:
-    st.session_state['generated_tables'] = {}
+    # Compacted in memory and spilled to disk beyond the memory budgets
+    st.session_state['generated_tables'] = TableStore()
 if 'selected_table_name' not in st.session_state:
     st.session_state['selected_table_name'] = None
+if 'job_id' not in st.session_state:
+    # A refreshed page finds its generation job again. Whoever has the URL may open it, so
+    # the job's schema is not shared: its results are loaded into the new session's schema
+    restored_job = get_job_runner().get_job(st.query_params.get('job', ''))
+    st.session_state['job_id'] = restored_job['id'] if restored_job else None
+if 'db_schema' not in st.session_state:
+    st.session_state['db_schema'] = new_session_schema()
 
 st.set_page_config(layout="wide")
 
+# Each browser session works in its own PostgreSQL schema
+try:
+    if activate_session_schema(st.session_state['db_schema']) and st.session_state['generated_tables']:
+        st.session_state['generated_tables'] = TableStore()
+        # The job's results were in the dropped schema: it no longer describes the session's data
+        st.session_state['job_id'] = None
+        st.query_params.pop('job', None)
+        st.warning("Your session was idle for too long and its tables were removed. Please generate the data again.")
+except SessionSchemaLimitError as e:
+    st.error(str(e))
+    st.stop()
+except Exception as e:
+    print(f"Could not activate the session schema: {e}", flush=True)
+
 with st.sidebar:
     st.subheader("Data Assistant")
     st.markdown("")
@@ -25,6 +89,31 @@ with st.sidebar:
     if st.button("Talk to your data", use_container_width=True, key='btn_talk_data'):
         st.session_state.menu_selection = "Talk to your data"
 
+    with st.expander("Startup timings"):
+        timings = llm_setup.get_startup_timings()
+        if timings:
+            st.dataframe(pd.DataFrame([{'Step': name, 'ms': ms} for name, ms in timings.items()]),
+                         use_container_width=True, hide_index=True)
+        else:
+            st.caption("No timings recorded yet.")
+
+    if instrumentation.DIAGNOSTICS_PANEL_ENABLED:
+        with st.expander("Diagnostics"):
+            diagnostics = instrumentation.get_diagnostics()
+            stages = diagnostics.pop('stages')
+            if stages:
+                st.dataframe(
+                    pd.DataFrame.from_dict(stages, orient='index')[
+                        ['count', 'errors', 'p50_ms', 'p95_ms', 'max_ms', 'rows', 'bytes', 'input_tokens', 'output_tokens']
+                    ],
+                    use_container_width=True
+                )
+            else:
+                st.caption("No stage recorded yet.")
+            for section, values in diagnostics.items():
+                st.caption(section)
+                st.json(values, expanded=False)
+
 
 if st.session_state.menu_selection == "Data Generation":
 
@@ -53,42 +142,161 @@ if st.session_state.menu_selection == "Data Generation":
             st.text("Temperature (Creativity)")
             temperature = st.slider("Temperature", min_value=0.0, max_value=1.0, value=0.5, step=0.01, label_visibility="collapsed")
             
+        with col_rows:
+            st.text("Rows per Table")
+            num_rows = st.number_input("Rows per Table", min_value=1, value=5, label_visibility="collapsed")
+
         with col_max_token:
             st.text("Max Tokens")
             max_tokens = st.number_input("Max Tokens", min_value=1, value=2048, label_visibility="collapsed")
+
+        col_mode, col_seed = st.columns([2, 1])
+
+        with col_mode:
+            st.text("Generation Engine")
+            generation_mode = st.selectbox(
+                "Generation Engine",
+                options=['llm', 'hybrid'],
+                index=1 if GENERATION_MODE == 'hybrid' else 0,
+                format_func=lambda m: "LLM writes every row" if m == 'llm' else "Hybrid: LLM column specs + fast local sampling",
+                label_visibility="collapsed"
+            )
+
+        with col_seed:
+            st.text("Seed (hybrid)")
+            seed = st.number_input("Seed", min_value=0, value=42, step=1, label_visibility="collapsed")
             
-        
-        if st.button("Generate", use_container_width=True):
+
+        def sync_job_results(job):
+            """Adds the tables the job saved since the last poll to the session. Returns True if any was added."""
+            loaded = st.session_state.setdefault('job_loaded', {})
+            tables = st.session_state['generated_tables']
+            added = False
+            for table in job['tables']:
+                if table['path'] and loaded.get(table['table_name']) != table['path']:
+                    tables[table['table_name']] = get_job_runner().store.load_table_data(table['path'])
+                    loaded[table['table_name']] = table['path']
+                    added = True
+            st.session_state['generation_stats'] = {
+                table['table_name']: {'status': table['status'], 'seconds': table['seconds'],
+                                      'rows': table['rows_done'], 'error': table['error']}
+                for table in job['tables']
+            }
+            st.session_state['load_stats'] = job['load_stats']
+            if job['params'].get('schemas'):
+                st.session_state['schemas'] = job['params']['schemas']
+            if added and st.session_state['selected_table_name'] not in tables:
+                st.session_state['selected_table_name'] = next(iter(tables))
+            return added
+
+        def job_status_panel():
+            """Shows the progress of the generation job of the session, polled while it runs."""
+            runner = get_job_runner()
+            job_id = st.session_state.get('job_id')
+            job = runner.get_job(job_id) if job_id else None
+            if job is None:
+                return
+            # Results appear table by table: the whole page is refreshed when one is added
+            if sync_job_results(job) or (job['status'] not in ACTIVE_STATUSES and st.session_state.get('job_active')):
+                st.session_state['job_active'] = job['status'] in ACTIVE_STATUSES
+                st.rerun()
+
+            if job['status'] in ACTIVE_STATUSES:
+                stage = {'parsing': "Parsing DDL", 'generating': "Generating data with Gemini",
+                         'loading': "Inserting into PostgreSQL"}.get(job['stage'], "Waiting for a worker")
+                st.caption(f"{stage}...")
+                for table in job['tables']:
+                    st.progress(
+                        min(1.0, table['rows_done'] / max(1, table['rows_target'])),
+                        text=f"**{table['table_name']}**: {table['rows_done']}/{table['rows_target']} rows ({table['status']})"
+                    )
+                # Only the session the job loads into may stop it
+                if job['db_schema'] == st.session_state['db_schema']:
+                    if st.button("Cancel", use_container_width=True, key='cancel_job'):
+                        runner.cancel(job_id)
+                return
+
+            if job['status'] == SUCCEEDED:
+                st.success(f"Generation completed for {len(job['tables'])} table(s) and **data inserted into PostgreSQL**.")
+            elif job['status'] == CANCELLED:
+                st.info("Generation was cancelled. Use 'Resume' to continue it.")
+            elif job['status'] == INTERRUPTED:
+                st.warning("Generation was interrupted by a restart of the application. Use 'Resume' to continue it.")
+            else:
+                st.error(f"{job['error']} Check the application log.")
+
+            incomplete = [t['table_name'] for t in job['tables'] if t['status'] != TABLE_DONE]
+            if incomplete and job['status'] == SUCCEEDED:
+                st.warning(f"Generation failed or is incomplete for: {', '.join(incomplete)}. Use 'Resume' to generate the missing rows.")
+            if (incomplete or job['status'] != SUCCEEDED) and job['params'].get('schemas'):
+                if st.button("Resume", use_container_width=True, key='resume_job'):
+                    # The resumed job loads into the schema of the session resuming it
+                    runner.resume(job_id, st.session_state['db_schema'])
+                    st.session_state['job_active'] = True
+                    st.rerun()
+
+        def load_job_into_session(job):
+            """Loads the results of a job restored from the URL (which ran in another schema) into the session schema."""
+            loaded_key = (job['id'], job['updated'])
+            if job['status'] != SUCCEEDED or job['db_schema'] == st.session_state['db_schema'] \
+                    or st.session_state.get('job_copied') == loaded_key or not st.session_state['generated_tables']:
+                return
+            tables = st.session_state['generated_tables']
+            with st.spinner("Inserting the tables of the job into PostgreSQL..."):
+                setup_result = setup_db_with_data({name: tables[name] for name in tables}, job['params']['schemas'])
+            st.session_state['job_copied'] = loaded_key
+            if "Error" in setup_result:
+                st.error(setup_result)
+
+        job = get_job_runner().get_job(st.session_state['job_id']) if st.session_state.get('job_id') else None
+        if job is not None:
+            load_job_into_session(job)
+        job_active = job is not None and job['status'] in ACTIVE_STATUSES
+        st.session_state['job_active'] = job_active
+
+        own_job_active = job_active and job['db_schema'] == st.session_state['db_schema']
+        if st.button("Generate", use_container_width=True, disabled=own_job_active):
             
             if uploaded_file is not None:
-                with st.spinner('1. Parsing DDL, 2. Generating data with Gemini, and 3. Inserting into PostgreSQL...'):
-                    
-                    ddl_string = uploaded_file.read().decode('utf-8')
-                    schemas = parse_ddl_to_schema(ddl_string)
-                    
-                    if not schemas:
-                        st.error("No CREATE TABLE commands were found in the DDL file. Please check the format.")
-                    else:
-                        model_name = 'gemini-2.5-flash'
-                        st.session_state['generated_tables'] = generate_multi_table_data(
-                            schemas=schemas,
-                            temp=temperature,
-                            model=model_name,
-                            extra_prompt=prompt,
-                            max_tokens=max_tokens
-                        )
-                        
-                        setup_result = setup_db_with_data(st.session_state['generated_tables'])
-                        
-                        if "Error" in setup_result:
-                            st.error(f"Error configuring database: {setup_result}. Check the application log.")
-                        else:
-                            st.session_state['selected_table_name'] = list(schemas.keys())[0]
-                            st.success(f"Generation completed for {len(schemas)} table(s) and **data inserted into PostgreSQL**.")
+                # Parsed, generated and loaded by a background job: the page stays responsive
+                params = {
+                    'ddl': uploaded_file.read().decode('utf-8'),
+                    'num_rows': int(num_rows),
+                    'temp': temperature,
+                    'model': 'gemini-2.5-flash',
+                    'extra_prompt': prompt,
+                    'max_tokens': int(max_tokens),
+                    'mode': generation_mode,
+                    'seed': int(seed)
+                }
+                job_id = get_job_runner().submit(st.session_state['db_schema'], params)
+                st.session_state['job_id'] = job_id
+                st.session_state['generated_tables'] = TableStore()
+                st.session_state['job_loaded'] = {}
+                st.session_state['generation_stats'] = {}
+                st.session_state['load_stats'] = {}
+                # Lets a refreshed page find the job again
+                st.query_params['job'] = job_id
+                st.rerun()
             
             else:
                 st.error("Please upload a DDL file.")
 
+        st.fragment(job_status_panel, run_every=JOB_POLL_SECONDS if job_active else None)()
+
+        if st.session_state.get('generation_stats'):
+            with st.expander("Generation timings"):
+                st.dataframe(
+                    pd.DataFrame.from_dict(st.session_state['generation_stats'], orient='index'),
+                    use_container_width=True
+                )
+                if st.session_state.get('load_stats'):
+                    st.caption("PostgreSQL load")
+                    st.dataframe(
+                        pd.DataFrame.from_dict(st.session_state['load_stats'], orient='index'),
+                        use_container_width=True
+                    )
+
 
     with st.container(border=True):
         
@@ -108,27 +316,41 @@ if st.session_state.menu_selection == "Data Generation":
             )
             st.session_state['selected_table_name'] = selected_name
 
-            @st.cache_data
-            def create_zip_archive(tables_dict):
-                zip_io = io.BytesIO()
-                with zipfile.ZipFile(zip_io, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for name, df in tables_dict.items():
-                        csv_data = df.to_csv(index=False).encode('utf-8')
-                        zipf.writestr(f"{name}_data.csv", csv_data)
-                zip_io.seek(0)
-                return zip_io
-
-            zip_bytes = create_zip_archive(st.session_state['generated_tables'])
-            
-            col_download.download_button(
-                label="Download ZIP",
-                data=zip_bytes,
-                file_name="generated_data.zip",
-                mime="application/zip",
-                use_container_width=True
+            tables = st.session_state['generated_tables']
+
+            # Exported straight from PostgreSQL on request, and reused until the data changes
+            export_format = col_download.selectbox(
+                "Export format", EXPORT_FORMATS, key='export_format', label_visibility="collapsed",
+                format_func=str.upper
             )
+            if col_download.button("Prepare download", use_container_width=True):
+                try:
+                    with st.spinner("Exporting tables..."):
+                        st.session_state['export_archive'] = build_archive(export_format)
+                except (ConnectionError, psycopg2.Error, OSError) as e:
+                    st.session_state['export_archive'] = None
+                    st.error(f"Export failed: {e}")
+
+            archive = st.session_state.get('export_archive')
+            if archive and archive['version'] == get_data_version() and os.path.exists(archive['path']):
+                # The archive is only read when the button is clicked, not on every rerun
+                col_download.download_button(
+                    label=f"Download ZIP ({archive['bytes'] / 1024 ** 2:.1f} MB)",
+                    data=Path(archive['path']).read_bytes,
+                    file_name="generated_data.zip",
+                    mime="application/zip",
+                    use_container_width=True
+                )
 
-            current_df = st.session_state['generated_tables'][selected_name]
+            # Only a window of rows is held and edited at a time
+            total_rows = tables.row_count(selected_name)
+            window_start = 0
+            if total_rows > TABLE_PREVIEW_ROWS:
+                window_start = st.number_input(
+                    f"First row (of {total_rows})", min_value=0, max_value=total_rows - 1,
+                    value=0, step=TABLE_PREVIEW_ROWS, key='preview_window_start'
+                )
+            current_df = tables.window(selected_name, window_start)
             
             edited_df = st.data_editor(current_df, use_container_width=True, num_rows="dynamic", key="data_editor")
 
@@ -144,28 +366,70 @@ if st.session_state.menu_selection == "Data Generation":
             if col_btn_subtmit.button("Submit Edit", use_container_width=True):
                 if instructions:
                     with st.spinner("Modifying data..."):
-                        current_df = edited_df
+                        current_df = tables.replace_window(selected_name, window_start, edited_df)
 
                         modified_df = edit_dataframe_with_prompt(current_df, instructions)
 
                         if 'Error' in modified_df.columns:
                             st.error(modified_df['Error'].iloc[0])
                         else:
-                            st.session_state['generated_tables'][selected_name] = modified_df
-                            setup_db_with_data({selected_name: modified_df})
-                            st.toast("Updated data!")
-                            st.rerun()
+                            stored_df = tables[selected_name]
+                            tables[selected_name] = modified_df
+                            save_result = apply_table_changes(selected_name, stored_df, modified_df,
+                                                              schemas=st.session_state.get('schemas'))
+                            if "Error" in save_result:
+                                st.error(save_result)
+                            else:
+                                st.toast("Updated data!")
+                                st.rerun()
 
                 else:
-                    st.session_state['generated_tables'][selected_name] = edited_df
-                    setup_db_with_data({selected_name: edited_df})
-                    st.toast("Data updated manually.")
+                    stored_df = tables[selected_name]
+                    edited_table = tables.replace_window(selected_name, window_start, edited_df)
+                    tables[selected_name] = edited_table
+                    save_result = apply_table_changes(selected_name, stored_df, edited_table,
+                                                      schemas=st.session_state.get('schemas'))
+                    if "Error" in save_result:
+                        st.error(save_result)
+                    else:
+                        st.toast("Data updated manually.")
         
         else:
             st.info("Upload a DDL file and click 'Generate' to view the data.")
             st.dataframe(pd.DataFrame({'ID': [], 'Name': []}), use_container_width=True, hide_index=True)
 
 
+def load_more_rows():
+    """Appends the next page of the active result pager to the last chat answer."""
+    pager = st.session_state.get('result_pager')
+    if pager is None:
+        return
+    page = pager.next_page()
+    if 'Error' in page.columns:
+        st.session_state.messages.append({"role": "assistant", "content": page['Error'].iloc[0]})
+    elif not page.empty:
+        last_message = st.session_state.messages[-1]
+        last_message["content"] = pd.concat([last_message["content"], page], ignore_index=True)
+    if pager.exhausted:
+        if pager.expired:
+            st.toast("The rest of the result was released after being idle. Ask again to see more rows.")
+        elif pager.truncated:
+            st.toast(f"The result was truncated to {pager.rows_fetched} rows.")
+        st.session_state['result_pager'] = None
+
+
+def render_pager_status(container, key):
+    """Shows the row count of the last result and a button to fetch the next page."""
+    pager = st.session_state.get('result_pager')
+    if pager is None:
+        return
+    if pager.expired:
+        container.caption(f"Showing the first {pager.rows_fetched} rows. Ask again to see more rows.")
+        return
+    container.caption(f"Showing the first {pager.rows_fetched} rows. More rows are available.")
+    container.button("Load more rows", key=key, on_click=load_more_rows)
+
+
 if st.session_state.menu_selection == "Talk to your data":
     
     st.subheader("Generate your query")
@@ -175,16 +439,29 @@ if st.session_state.menu_selection == "Talk to your data":
     else:
         if "messages" not in st.session_state:
             st.session_state.messages = []
+        if 'result_pager' not in st.session_state:
+            st.session_state['result_pager'] = None
 
-        for message in st.session_state.messages:
+        for i, message in enumerate(st.session_state.messages):
             with st.chat_message(message["role"]):
                 if isinstance(message["content"], pd.DataFrame):
                     st.dataframe(message["content"], use_container_width=True)
+                    if i == len(st.session_state.messages) - 1:
+                        render_pager_status(st, key='btn_load_more_history')
                 else:
                     st.markdown(message["content"])
 
         if question := st.chat_input("Ex: What is the name and price of the most expensive product?"):
             
+            if st.session_state['result_pager'] is not None:
+                st.session_state['result_pager'].close()
+                st.session_state['result_pager'] = None
+
+            # Earlier answers keep only their first rows
+            for message in st.session_state.messages:
+                if isinstance(message["content"], pd.DataFrame) and len(message["content"]) > TABLE_PREVIEW_ROWS:
+                    message["content"] = message["content"].head(TABLE_PREVIEW_ROWS)
+
             st.session_state.messages.append({"role": "user", "content": question})
             with st.chat_message("user"):
                 st.markdown(question)
@@ -192,7 +469,13 @@ if st.session_state.menu_selection == "Talk to your data":
             with st.chat_message("assistant"):
                 with st.spinner("Translating to SQL and querying PostgreSQL..."):
                     
-                    db_schema_ddl = get_db_schema_for_llm(st.session_state['generated_tables'])
+                    # The catalog of the tables actually in PostgreSQL, read again only after they change
+                    try:
+                        db_schema_ddl = get_schema_catalog().ddl
+                    except (ConnectionError, psycopg2.Error):
+                        db_schema_ddl = ""
+                    if not db_schema_ddl:
+                        db_schema_ddl = get_db_schema_for_llm(st.session_state['generated_tables'], st.session_state.get('schemas'))
                     
                     sql_query = nl_to_sql(question, db_schema_ddl, temp=0.0)
                     
@@ -202,7 +485,8 @@ if st.session_state.menu_selection == "Talk to your data":
                         response_container.success("Successful SQL translation:")
                         response_container.code(sql_query, language='sql')
                         
-                        result_df = run_sql_query(sql_query)
+                        pager = run_sql_query(sql_query, stream=True)
+                        result_df = pager.next_page()
                         
                         if 'Error' in result_df.columns:
                             error_message = result_df['Error'].iloc[0]
@@ -213,6 +497,11 @@ if st.session_state.menu_selection == "Talk to your data":
                             response_container.subheader("Query Result")
                             response_container.dataframe(result_df, use_container_width=True, hide_index=True)
                             st.session_state.messages.append({"role": "assistant", "content": result_df})
+                            if not pager.exhausted:
+                                st.session_state['result_pager'] = pager
+                                render_pager_status(response_container, key='btn_load_more_answer')
+                            elif pager.truncated:
+                                response_container.warning(f"The result was truncated to {pager.rows_fetched} rows.")
                     else:
                         response_container.error(f"Error in translation: {sql_query}")
                         st.session_state.messages.append({"role": "assistant", "content": sql_query})
\ No newline at end of file
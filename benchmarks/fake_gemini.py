@@ -0,0 +1,242 @@
+# benchmarks/fake_gemini.py
+
+import re
+import json
+import time
+import random
+import threading
+from dataclasses import dataclass
+
+# Parses the "name (TYPE, Nullable: X[, Primary key])" column descriptions of the generation prompts
+COLUMN_PATTERN = re.compile(r'(\w+) \(([^,()]+(?:\([^)]*\))?[^,]*), Nullable: (True|False)(, Primary key)?\)')
+
+
+@dataclass
+class FakeGeminiConfig:
+    """
+    Behaviour of the fake model. Latency is `latency` seconds before the first chunk,
+    then the output streams at `tokens_per_second` (0: instantly). `failure_rate` of
+    the calls fail with a retryable 503. `text_bytes` sets the length of generated
+    text values, and so the output size. Calls are reproducible for a given `seed`.
+    """
+    latency: float = 0.05
+    tokens_per_second: float = 0.0
+    failure_rate: float = 0.0
+    text_bytes: int = 24
+    seed: int = 0
+
+
+class FakeServiceUnavailable(Exception):
+    code = 503
+
+
+class _Tokens:
+    def __init__(self, count):
+        self.total_tokens = count
+
+
+class _FinishReason:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Candidate:
+    def __init__(self, finish_reason):
+        self.finish_reason = _FinishReason(finish_reason)
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Response:
+    """Mimics a GenerateContentResponse, streamed (iterable) or not."""
+
+    def __init__(self, text, finish_reason, prompt_tokens, config, stream):
+        self.text = text
+        self.usage_metadata = _Usage(prompt_tokens, count_tokens(text))
+        self._finish_reason = finish_reason
+        self._config = config
+        # Like the SDK, a stream only has its candidates once it was consumed
+        self.candidates = [] if stream else [_Candidate(finish_reason)]
+        if not stream:
+            time.sleep(self._config.latency + self._transfer_seconds(text))
+
+    def _transfer_seconds(self, text):
+        return count_tokens(text) / self._config.tokens_per_second if self._config.tokens_per_second > 0 else 0.0
+
+    def __iter__(self):
+        time.sleep(self._config.latency)
+        chunk_chars = 256
+        for i in range(0, len(self.text), chunk_chars):
+            chunk = self.text[i:i + chunk_chars]
+            time.sleep(self._transfer_seconds(chunk))
+            yield _Chunk(chunk)
+        self.candidates = [_Candidate(self._finish_reason)]
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _value(column_name, sql_type, n, text_bytes):
+    sql_type = sql_type.upper()
+    if any(t in sql_type for t in ('INT', 'SERIAL')):
+        return n
+    if any(t in sql_type for t in ('NUMERIC', 'DECIMAL', 'FLOAT', 'DOUBLE', 'REAL')):
+        return round(n * 1.25 % 1000, 2)
+    if 'BOOL' in sql_type:
+        return n % 2 == 0
+    if 'TIMESTAMP' in sql_type:
+        return f"2024-01-{1 + n % 28:02d}T{n % 24:02d}:00:00"
+    if 'DATE' in sql_type:
+        return f"2024-{1 + n % 12:02d}-{1 + n % 28:02d}"
+    limit = re.search(r'\((\d+)\)', sql_type)
+    text = f"{column_name}_{n}_".ljust(text_bytes, 'x')
+    return text[:int(limit.group(1))] if limit else text
+
+
+class FakeGenerativeModel:
+    """
+    Deterministic stand-in for genai.GenerativeModel that answers the prompts of this
+    app: rows (generate_data), column specs (generate_spec), SQL (nl_to_sql) and edit
+    plans, with the latency, throughput and failures of `config`.
+    """
+
+    config = FakeGeminiConfig()
+    _random = random.Random(0)
+    _lock = threading.Lock()
+    calls = 0
+
+    def __init__(self, model_name='fake', system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction or ''
+
+    @classmethod
+    def configure(cls, config):
+        cls.config = config
+        cls._random = random.Random(config.seed)
+        cls.calls = 0
+
+    def count_tokens(self, contents):
+        return _Tokens(count_tokens(str(contents)))
+
+    def generate_content(self, contents, generation_config=None, safety_settings=None, stream=False):
+        with self._lock:
+            type(self).calls += 1
+            failed = self._random.random() < self.config.failure_rate
+        if failed:
+            time.sleep(self.config.latency)
+            raise FakeServiceUnavailable("503 The model is overloaded (fake).")
+
+        prompt = str(contents)
+        if 'Generate' in prompt and 'rows of realistic data' in prompt:
+            text = self._rows(prompt)
+        elif 'Describe how to generate realistic data' in prompt:
+            text = self._spec(prompt)
+        elif prompt.startswith('User question') or 'SQL' in self.system_instruction:
+            text = self._sql(prompt)
+        else:
+            text = '{"operations": []}'
+
+        finish_reason = 'STOP'
+        max_tokens = getattr(generation_config, 'max_output_tokens', None)
+        if max_tokens and count_tokens(text) > max_tokens:
+            text, finish_reason = text[:4 * max_tokens], 'MAX_TOKENS'
+        prompt_tokens = count_tokens(prompt + self.system_instruction)
+        return _Response(text, finish_reason, prompt_tokens, self.config, stream)
+
+    @staticmethod
+    def _columns(prompt):
+        return [(m.group(1), m.group(2), bool(m.group(4))) for m in COLUMN_PATTERN.finditer(prompt)]
+
+    def _rows(self, prompt):
+        row_count = int(re.search(r'Generate (\d+) rows', prompt).group(1))
+        taken = re.search(r'must be greater than (-?\d+)', prompt)
+        start = int(taken.group(1)) + 1 if taken else 1
+        # Foreign keys take the first value listed for the parent
+        foreign_values = {
+            m.group(1): json.loads(m.group(2))
+            for m in re.finditer(r'Column (\w+) must only take values that exist in [\w.]+: (\[.*\])', prompt)
+        }
+        columns = self._columns(prompt)
+        rows = []
+        for n in range(start, start + row_count):
+            row = {}
+            for name, sql_type, _ in columns:
+                values = foreign_values.get(name)
+                row[name] = values[n % len(values)] if values else _value(name, sql_type, n, self.config.text_bytes)
+            rows.append(row)
+        return json.dumps(rows)
+
+    def _spec(self, prompt):
+        specs = {}
+        for name, sql_type, primary_key in self._columns(prompt):
+            sql_type = sql_type.upper()
+            if primary_key:
+                specs[name] = {"generator": "sequence", "start": 1, "step": 1}
+            elif any(t in sql_type for t in ('INT', 'SERIAL')):
+                specs[name] = {"generator": "integer", "min": 0, "max": 100000}
+            elif any(t in sql_type for t in ('NUMERIC', 'DECIMAL', 'FLOAT', 'DOUBLE', 'REAL')):
+                specs[name] = {"generator": "float", "min": 0, "max": 1000, "decimals": 2}
+            elif 'BOOL' in sql_type:
+                specs[name] = {"generator": "boolean", "true_rate": 0.5}
+            elif 'DATE' in sql_type or 'TIMESTAMP' in sql_type:
+                specs[name] = {"generator": "date", "start": "2023-01-01", "end": "2024-12-31"}
+            else:
+                words = [f"{name}{i}".ljust(max(1, self.config.text_bytes // 4), 'x') for i in range(50)]
+                specs[name] = {"generator": "text", "words": words, "min_words": 2, "max_words": 4}
+        return json.dumps({"columns": specs})
+
+    def _sql(self, prompt):
+        # The benchmark questions name the table to read: "... rows of the table t_12"
+        table = re.search(r'table (\w+)', prompt) or re.search(r'CREATE TABLE "?(\w+)', self.system_instruction)
+        return f"SELECT * FROM {table.group(1) if table else 'information_schema.tables'} LIMIT 100"
+
+
+class _NullObservation:
+    """No-op Langfuse trace, span and generation."""
+
+    def span(self, **kwargs):
+        return self
+
+    def generation(self, **kwargs):
+        return self
+
+    def trace(self, **kwargs):
+        return self
+
+    def end(self, **kwargs):
+        return self
+
+    def update(self, **kwargs):
+        return self
+
+    def flush(self):
+        pass
+
+
+def install(config=None):
+    """
+    Replaces genai.GenerativeModel with FakeGenerativeModel and Langfuse with a no-op
+    client for the rest of the process, and drops the model clients already built.
+    """
+    import google.generativeai as genai
+    import llm_setup
+
+    FakeGenerativeModel.configure(config or FakeGeminiConfig())
+    genai.GenerativeModel = FakeGenerativeModel
+    llm_setup.configure()
+    with llm_setup._setup_lock:
+        llm_setup._langfuse_client = _NullObservation()
+        llm_setup._langfuse_ready = True
+    llm_setup._registry = None
+    return FakeGenerativeModel
@@ -0,0 +1,273 @@
+# benchmarks/run.py
+"""
+Offline benchmarks of the generation, load and query paths, against a fake Gemini
+backend (see fake_gemini.py) and a local PostgreSQL (the DB_* variables of .env).
+
+    python -m benchmarks.run --tables 1,10,100,500 --rows 100,10000 --output results.json
+
+Every case runs in a schema of its own, dropped afterwards. The results are written
+as JSON: one entry per case with a stable 'name', so two runs can be compared.
+"""
+
+import os
+
+# Measure the code, not the caches or the rate limits (set them explicitly to override)
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("QUERY_CACHE_ENABLED", "false")
+os.environ.setdefault("LLM_RPM", "0")
+os.environ.setdefault("LLM_TPM", "0")
+
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from benchmarks.fake_gemini import FakeGeminiConfig, install
+from db_connector import execute_query, use_schema, QueryPager
+from genai_data import parse_ddl_to_schema, generate_multi_table_data, nl_to_sql
+from database_utils import setup_db_with_data, run_sql_query
+from schema_catalog import get_schema_catalog
+from llm_scheduler import get_scheduler_stats
+from instrumentation import get_stage_metrics
+
+
+def synthetic_ddl(table_count):
+    """DDL of `table_count` tables, each referencing the one at half its index (a tree of depth log2(n))."""
+    statements = []
+    for i in range(table_count):
+        parent = f",\n    parent_id INT REFERENCES t_{i // 2}(id)" if i else ""
+        statements.append(
+            f"CREATE TABLE t_{i} (\n    id INT PRIMARY KEY,\n    name VARCHAR(50) NOT NULL,\n    amount NUMERIC(10,2),\n"
+            f"    created DATE,\n    active BOOLEAN{parent}\n);"
+        )
+    return "\n\n".join(statements)
+
+
+def synthetic_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': np.arange(1, rows + 1),
+        'name': [f"name_{i}" for i in rng.integers(0, 10000, rows)],
+        'amount': rng.uniform(0, 1000, rows).round(2),
+        'created': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D'),
+        'active': rng.random(rows) < 0.5,
+    })
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    return {
+        'p50': round(statistics.median(ordered), 4),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+        'max': round(ordered[-1], 4),
+    }
+
+
+@contextmanager
+def bench_schema():
+    """Runs the block in a new PostgreSQL schema, dropped afterwards."""
+    schema = f"bench_{uuid.uuid4().hex[:8]}"
+    execute_query(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(schema)))
+    try:
+        with use_schema(schema):
+            yield schema
+    finally:
+        execute_query(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+
+
+@contextmanager
+def measure(metrics, memory=True):
+    """Adds 'seconds' and, with `memory`, the Python 'peak_memory_mb' of the block to `metrics`."""
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics['seconds'] = round(time.perf_counter() - start, 4)
+        if memory:
+            metrics['peak_memory_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 2)
+            tracemalloc.stop()
+
+
+def bench_generate(table_count, rows, mode, memory):
+    """End-to-end Generate: parse the DDL, generate every table and load it into PostgreSQL."""
+    metrics = {}
+    with bench_schema(), measure(metrics, memory):
+        start = time.perf_counter()
+        schemas = parse_ddl_to_schema(synthetic_ddl(table_count))
+        metrics['parse_seconds'] = round(time.perf_counter() - start, 4)
+
+        start = time.perf_counter()
+        generation_stats = {}
+        tables = generate_multi_table_data(schemas, num_rows=rows, max_tokens=8192, generation_stats=generation_stats,
+                                           mode=mode, seed=0)
+        metrics['generate_seconds'] = round(time.perf_counter() - start, 4)
+
+        start = time.perf_counter()
+        setup_result = setup_db_with_data(tables, schemas)
+        metrics['load_seconds'] = round(time.perf_counter() - start, 4)
+
+    generated_rows = sum(stats['rows'] for stats in generation_stats.values())
+    metrics['rows'] = generated_rows
+    metrics['rows_per_second'] = round(generated_rows / metrics['seconds'], 1) if metrics['seconds'] else None
+    metrics['failed_tables'] = sum(1 for stats in generation_stats.values() if stats['error'])
+    metrics['error'] = setup_result if "Error" in setup_result else None
+    return metrics
+
+
+def bench_copy_load(rows, memory):
+    """COPY load of one table (setup_db_with_data, staging + swap)."""
+    df = synthetic_frame(rows)
+    schemas = parse_ddl_to_schema(synthetic_ddl(1))
+    metrics, load_stats = {}, {}
+    with bench_schema(), measure(metrics, memory):
+        setup_result = setup_db_with_data({'t_0': df}, schemas, load_stats=load_stats)
+    if 't_0' in load_stats:
+        metrics.update(rows=load_stats['t_0']['rows'], bytes=load_stats['t_0']['bytes'],
+                       rows_per_second=load_stats['t_0']['rows_per_sec'])
+    metrics['error'] = setup_result if "Error" in setup_result else None
+    return metrics
+
+
+def bench_nl_to_sql(table_count, repeats, memory):
+    """NL-to-SQL round trips (schema pruning, model call, guard and validation) on a loaded schema."""
+    schemas = parse_ddl_to_schema(synthetic_ddl(table_count))
+    metrics, samples, failures = {}, [], 0
+    with bench_schema():
+        setup_db_with_data({name: synthetic_frame(10, seed=i) for i, name in enumerate(schemas)}, schemas)
+        ddl = get_schema_catalog().ddl
+        with measure(metrics, memory):
+            for i in range(repeats):
+                question = f"Show the rows of the table t_{i % table_count} (run {i})"
+                start = time.perf_counter()
+                sql_query = nl_to_sql(question, ddl)
+                samples.append(time.perf_counter() - start)
+                failures += sql_query.startswith("Error")
+    metrics.update({f'round_trip_{k}_seconds': v for k, v in percentiles(samples).items()})
+    metrics['failures'] = failures
+    return metrics
+
+
+def bench_fetch(rows, page_size, memory):
+    """Fetching a large result: run_sql_query (guarded, capped) and paging through it with QueryPager."""
+    metrics = {}
+    with bench_schema():
+        setup_db_with_data({'t_0': synthetic_frame(rows)}, parse_ddl_to_schema(synthetic_ddl(1)))
+        with measure(metrics, memory):
+            start = time.perf_counter()
+            df = run_sql_query("SELECT * FROM t_0")
+            metrics['query_seconds'] = round(time.perf_counter() - start, 4)
+            metrics['query_rows'] = len(df)
+
+            start = time.perf_counter()
+            pager, fetched = QueryPager("SELECT * FROM t_0", page_size=page_size, max_rows=rows), 0
+            while not pager.exhausted:
+                fetched += len(pager.next_page())
+            metrics['paged_seconds'] = round(time.perf_counter() - start, 4)
+            metrics['paged_rows'] = fetched
+    metrics['rows_per_second'] = round(metrics['paged_rows'] / metrics['paged_seconds'], 1) if metrics['paged_seconds'] else None
+    return metrics
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _int_list(text):
+    return [int(v) for v in text.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--benchmarks", default="generate,copy_load,nl_to_sql,fetch",
+                        help="comma-separated benchmarks to run")
+    parser.add_argument("--tables", type=_int_list, default=[1, 10, 100], help="schema sizes (table counts)")
+    parser.add_argument("--rows", type=_int_list, default=[100, 10000], help="rows per table")
+    parser.add_argument("--modes", default="hybrid", help="generation modes: llm, hybrid")
+    parser.add_argument("--load-rows", type=_int_list, default=[100000, 1000000], help="rows of the COPY load benchmark")
+    parser.add_argument("--fetch-rows", type=_int_list, default=[50000, 500000], help="rows of the fetch benchmark")
+    parser.add_argument("--page-size", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=20, help="NL-to-SQL round trips per schema size")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency before the first chunk (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="fake model output throughput (0: instant)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of fake calls failing with a 503")
+    parser.add_argument("--text-bytes", type=int, default=24, help="length of generated text values")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows the benchmarks down)")
+    parser.add_argument("--output", help="JSON file to write (default: stdout)")
+    args = parser.parse_args(argv)
+
+    fake_config = FakeGeminiConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                   failure_rate=args.failure_rate, text_bytes=args.text_bytes, seed=args.seed)
+    fake_model = install(fake_config)
+    memory = not args.no_memory
+    selected = set(args.benchmarks.split(","))
+
+    cases = []
+    if 'generate' in selected:
+        for mode in args.modes.split(","):
+            for table_count in args.tables:
+                for rows in args.rows:
+                    cases.append((f"generate/{mode}/tables={table_count}/rows={rows}",
+                                  {'tables': table_count, 'rows': rows, 'mode': mode},
+                                  lambda t=table_count, r=rows, m=mode: bench_generate(t, r, m, memory)))
+    if 'copy_load' in selected:
+        for rows in args.load_rows:
+            cases.append((f"copy_load/rows={rows}", {'rows': rows}, lambda r=rows: bench_copy_load(r, memory)))
+    if 'nl_to_sql' in selected:
+        for table_count in args.tables:
+            cases.append((f"nl_to_sql/tables={table_count}", {'tables': table_count, 'repeats': args.repeats},
+                          lambda t=table_count: bench_nl_to_sql(t, args.repeats, memory)))
+    if 'fetch' in selected:
+        for rows in args.fetch_rows:
+            cases.append((f"fetch/rows={rows}", {'rows': rows, 'page_size': args.page_size},
+                          lambda r=rows: bench_fetch(r, args.page_size, memory)))
+
+    results = []
+    for name, params, run in cases:
+        print(f"Running {name}...", file=sys.stderr, flush=True)
+        calls_before = fake_model.calls
+        try:
+            metrics = run()
+        except Exception as e:
+            metrics = {'error': f"{type(e).__name__}: {e}"}
+        metrics['model_calls'] = fake_model.calls - calls_before
+        results.append({'name': name, 'params': params, 'metrics': metrics})
+
+    report = {
+        'meta': {
+            'revision': _git_revision(),
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'fake_model': vars(fake_config),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'scheduler': get_scheduler_stats(),
+            'stages': get_stage_metrics(),
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# data_export.py
+
+import os
+import re
+import time
+import uuid
+import shutil
+import zipfile
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from psycopg2 import sql
+from db_connector import pooled_connection, get_current_schema
+from data_versions import get_data_version
+from schema_catalog import get_schema_catalog
+
+EXPORT_MAX_WORKERS = int(os.getenv("EXPORT_MAX_WORKERS", "4"))
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "exports"))
+EXPORT_FORMATS = ('csv', 'parquet')
+# Bytes read from the COPY stream (and from the CSV when converting to Parquet) at a time
+EXPORT_BLOCK_SIZE = 1024 * 1024
+
+# PostgreSQL types (as in the schema catalog) that Parquet columns keep; others are exported as text
+_ARROW_TYPES = {
+    'SMALLINT': pa.int16(),
+    'INTEGER': pa.int32(),
+    'BIGINT': pa.int64(),
+    'REAL': pa.float32(),
+    'DOUBLE PRECISION': pa.float64(),
+    'BOOLEAN': pa.bool_(),
+    'DATE': pa.date32(),
+    'TIMESTAMP WITHOUT TIME ZONE': pa.timestamp('us'),
+}
+
+_lock = threading.Lock()
+# (schema, format) -> the last archive built, reused while the data version is unchanged
+_archives = {}
+
+
+def _arrow_type(sql_type):
+    numeric = re.match(r'^NUMERIC\((\d+),\s*(\d+)\)$', sql_type)
+    if numeric:
+        return pa.decimal128(int(numeric.group(1)), int(numeric.group(2)))
+    if sql_type == 'NUMERIC':
+        return pa.float64()
+    return _ARROW_TYPES.get(sql_type, pa.string())
+
+
+def _copy_table_csv(table_name, path):
+    """Streams a table to a CSV file with COPY ... TO STDOUT. Returns the number of rows."""
+    query = sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER true)").format(sql.Identifier(table_name))
+    with pooled_connection() as conn, conn.cursor() as cur, open(path, 'wb') as file:
+        cur.copy_expert(query, file, size=EXPORT_BLOCK_SIZE)
+        rows = cur.rowcount
+        conn.commit()
+    return rows
+
+
+def _csv_to_parquet(csv_path, parquet_path, columns):
+    """
+    Converts an exported CSV into Parquet block by block, with the column types of the
+    catalog. In COPY's CSV, NULL is an unquoted empty field and an empty string is "".
+    """
+    convert_options = pa_csv.ConvertOptions(
+        column_types={c['name']: _arrow_type(c['sql_type']) for c in columns},
+        null_values=[''],
+        strings_can_be_null=True,
+        quoted_strings_can_be_null=False,
+        true_values=['t'],
+        false_values=['f'],
+    )
+    reader = pa_csv.open_csv(
+        csv_path,
+        read_options=pa_csv.ReadOptions(block_size=EXPORT_BLOCK_SIZE),
+        convert_options=convert_options
+    )
+    with pq.ParquetWriter(parquet_path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+
+
+def _export_table(table_name, columns, fmt, work_dir):
+    start = time.perf_counter()
+    csv_path = os.path.join(work_dir, f"{table_name}_data.csv")
+    rows = _copy_table_csv(table_name, csv_path)
+    path = csv_path
+    if fmt == 'parquet':
+        path = os.path.join(work_dir, f"{table_name}_data.parquet")
+        _csv_to_parquet(csv_path, path, columns)
+        os.remove(csv_path)
+    return {'path': path, 'rows': rows, 'bytes': os.path.getsize(path), 'seconds': round(time.perf_counter() - start, 3)}
+
+
+def build_archive(fmt='csv', table_names=None, max_workers=EXPORT_MAX_WORKERS):
+    """
+    Exports the tables of the current session schema (all of them by default) into a
+    ZIP file on disk, one CSV or Parquet member per table, and returns
+    {'path', 'bytes', 'seconds', 'tables': {name: {'rows', 'bytes', 'seconds'}}}.
+
+    Each table is streamed out of PostgreSQL with COPY into a temporary file, in
+    parallel, then copied into the archive, so memory use does not depend on the size
+    of the data. The archive is reused until a table of the schema changes.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    schema = get_current_schema()
+    version = get_data_version()
+    catalog = get_schema_catalog()
+    table_names = [name for name in (table_names or catalog.tables) if name in catalog.tables]
+    key = (schema, fmt)
+
+    with _lock:
+        cached = _archives.get(key)
+        if cached and cached['version'] == version and cached['table_names'] == table_names \
+                and os.path.exists(cached['path']):
+            return cached
+
+    start = time.perf_counter()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=EXPORT_DIR)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(table_names) or 1))) as executor:
+            # Each worker runs in a copy of the caller's context, so it uses the session schema
+            futures = {
+                name: executor.submit(contextvars.copy_context().run, _export_table,
+                                      name, catalog.tables[name]['columns'], fmt, work_dir)
+                for name in table_names
+            }
+            tables = {name: future.result() for name, future in futures.items()}
+
+        path = os.path.join(EXPORT_DIR, f"export_{uuid.uuid4().hex}.zip")
+        # Parquet is already compressed
+        compression = zipfile.ZIP_DEFLATED if fmt == 'csv' else zipfile.ZIP_STORED
+        with zipfile.ZipFile(path, 'w', compression) as zipf:
+            for name in table_names:
+                zipf.write(tables[name]['path'], os.path.basename(tables[name]['path']))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for stats in tables.values():
+        del stats['path']
+    archive = {
+        'path': path,
+        'bytes': os.path.getsize(path),
+        'seconds': round(time.perf_counter() - start, 3),
+        'tables': tables,
+        'version': version,
+        'table_names': table_names,
+    }
+    # A table changed during the export: the archive is returned but not reused
+    if get_data_version() == version:
+        with _lock:
+            previous = _archives.get(key)
+            _archives[key] = archive
+        if previous and previous['path'] != path:
+            _remove(previous['path'])
+    return archive
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def forget_archives(schema):
+    """Deletes the archives built for a schema that no longer exists."""
+    with _lock:
+        archives = [_archives.pop(key) for key in list(_archives) if key[0] == schema]
+    for archive in archives:
+        _remove(archive['path'])
@@ -0,0 +1,54 @@
+# data_versions.py
+
+import threading
+from db_connector import get_current_schema
+
+_lock = threading.Lock()
+# Tables are versioned per session schema: the same name in two sessions is two tables
+_table_versions = {}
+_data_versions = {}
+# Versions come from one global sequence, so they are never reused, even for a schema
+# that is dropped and created again
+_sequence = 0
+
+
+def bump_table_version(table_name):
+    """
+    Marks a table of the current schema as modified. Must be called whenever the app
+    drops, reloads or edits a table, so that anything cached from its previous
+    contents is ignored. Returns the new version of the table.
+    """
+    global _sequence
+    schema = get_current_schema()
+    with _lock:
+        _sequence += 1
+        _table_versions[(schema, table_name.lower())] = _sequence
+        _data_versions[schema] = _sequence
+        return _sequence
+
+
+def get_table_version(table_name):
+    """Returns the current version of a table (0 if the app never modified it)."""
+    with _lock:
+        return _table_versions.get((get_current_schema(), table_name.lower()), 0)
+
+
+def get_table_versions():
+    """Returns a snapshot of {table_name: version} for every table of the current schema modified by the app."""
+    schema = get_current_schema()
+    with _lock:
+        return {table: version for (table_schema, table), version in _table_versions.items() if table_schema == schema}
+
+
+def get_data_version():
+    """Returns a counter that changes whenever any table of the current schema is modified."""
+    with _lock:
+        return _data_versions.get(get_current_schema(), 0)
+
+
+def forget_schema(schema):
+    """Drops the versions kept for a schema that no longer exists."""
+    with _lock:
+        for key in [key for key in _table_versions if key[0] == schema]:
+            del _table_versions[key]
+        _data_versions.pop(schema, None)
@@ -1,30 +1,99 @@
 # database_utils.py
 
 import pandas as pd
+import numpy as np
 import csv
-from db_connector import execute_query
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+import random
+import contextvars
+import psycopg2
+import psycopg2.errors
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from db_connector import execute_query, pooled_connection, QueryPager, DataFramePager, DB_STREAM_PAGE_SIZE, DB_MAX_RESULT_ROWS
+from data_versions import bump_table_version
+from query_cache import get_query_cache, QUERY_CACHE_MAX_ROWS
+from ddl_parser import get_primary_key, get_foreign_keys, get_unique_keys
+from session_schemas import check_storage_budget
+from sql_guard import guard_query, SqlGuardError, SQL_GUARD_ENABLED, SQL_STATEMENT_TIMEOUT_MS
+from instrumentation import stage, instrumented, current_stage
 
+BULK_LOAD_MAX_WORKERS = int(os.getenv("BULK_LOAD_MAX_WORKERS", "4"))
+BULK_LOAD_CHUNK_ROWS = int(os.getenv("BULK_LOAD_CHUNK_ROWS", "50000"))
+# Swapping loaded tables into place: lock wait of the final attempt, and NOWAIT retries before it
+SWAP_LOCK_TIMEOUT_MS = int(os.getenv("SWAP_LOCK_TIMEOUT_MS", "2000"))
+SWAP_RETRIES = int(os.getenv("SWAP_RETRIES", "20"))
+SWAP_RETRY_DELAY = 0.02
+SWAP_RETRY_MAX_DELAY = 1.0
+COPY_NULL = "\\N"
+# Characters that have to be backslash-escaped in the COPY text format
+COPY_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+COPY_READ_SIZE = 1024 * 1024
 
-def get_db_schema_for_llm(generated_tables):
+POSTGRES_TYPE_ALIASES = {
+    'DATETIME': 'TIMESTAMP',
+    'TINYINT': 'SMALLINT',
+    'MEDIUMINT': 'INTEGER',
+    'INT': 'INTEGER',
+    'INTEGER': 'INTEGER',
+    'BIGINT': 'BIGINT',
+    'SMALLINT': 'SMALLINT',
+    # Generated rows carry their own key values, so no sequence is attached
+    'SERIAL': 'INTEGER',
+    'BIGSERIAL': 'BIGINT',
+    'SMALLSERIAL': 'SMALLINT',
+    'TINYTEXT': 'TEXT',
+    'MEDIUMTEXT': 'TEXT',
+    'LONGTEXT': 'TEXT',
+    'STRING': 'TEXT',
+    'ENUM': 'TEXT',
+    'SET': 'TEXT',
+    'YEAR': 'INTEGER',
+    'BLOB': 'BYTEA',
+    'LONGBLOB': 'BYTEA',
+}
+BOOLEAN_LABELS = {
+    'true': True, 't': True, 'yes': True, 'y': True, '1': True, '1.0': True,
+    'false': False, 'f': False, 'no': False, 'n': False, '0': False, '0.0': False,
+}
+
+
+def _inferred_sql_type(dtype):
+    """Maps a pandas dtype to the column type used for tables without a parsed schema."""
+    if "int" in str(dtype):
+        return "INTEGER"
+    if "float" in str(dtype):
+        return "NUMERIC"
+    if "datetime" in str(dtype):
+        return "TIMESTAMP"
+    return "VARCHAR"
+
+
+def get_db_schema_for_llm(generated_tables, schemas=None):
     """
     Generates a simplified DDL string (CREATE TABLE) from the DataFrames.
     This is the input for the LLM in the NL -> SQL phase.
+    Tables with a parsed schema in `schemas` are described with their real types and constraints.
     """
+    schemas = schemas or {}
     ddl_schema = ""
     for table_name, df in generated_tables.items():
         if 'Error' in df.columns:
             continue
+
+        if table_name in schemas:
+            ddl_schema += build_create_table_sql(schemas[table_name], include_constraints=True) + "\n\n"
+            continue
             
         columns_ddl = []
         for col_name, dtype in df.dtypes.items():
-            sql_type = "VARCHAR"
-            if "int" in str(dtype):
-                sql_type = "INTEGER"
-            elif "float" in str(dtype):
-                sql_type = "NUMERIC"
-            elif "datetime" in str(dtype):
-                sql_type = "TIMESTAMP"
-            
+            sql_type = _inferred_sql_type(dtype)
             pk_constraint = " PRIMARY KEY" if col_name.lower() == 'id' and not columns_ddl else ""
             
             columns_ddl.append(f"  {col_name} {sql_type}{pk_constraint}")
@@ -35,63 +104,906 @@ def get_db_schema_for_llm(generated_tables):
         
     return ddl_schema
 
-def run_sql_query(sql_query):
+def postgres_type(sql_type):
+    """Translates a column type from the uploaded DDL (possibly MySQL-flavoured) into a PostgreSQL type."""
+    sql_type = re.sub(r'\b(?:UNSIGNED|ZEROFILL|SIGNED)\b', '', sql_type.upper()).strip()
+    base = re.sub(r'\(.*?\)', '', sql_type).split()[0]
+    args = re.search(r'\(.*?\)', sql_type)
+
+    if base in POSTGRES_TYPE_ALIASES:
+        return POSTGRES_TYPE_ALIASES[base]
+    if base == 'DOUBLE' and 'PRECISION' not in sql_type:
+        return 'DOUBLE PRECISION'
+    if base in ('NVARCHAR', 'NCHAR'):
+        return base[1:] + (args.group(0) if args else '')
+    return sql_type
+
+
+def _type_family(pg_type):
+    """Groups a PostgreSQL type into the families handled by coerce_to_schema()."""
+    pg_type = pg_type.upper()
+    if pg_type.startswith(('SMALLINT', 'INTEGER', 'BIGINT', 'INT')):
+        return 'integer'
+    if pg_type.startswith(('NUMERIC', 'DECIMAL', 'REAL', 'DOUBLE', 'FLOAT')):
+        return 'float'
+    if pg_type.startswith('BOOL'):
+        return 'boolean'
+    if pg_type.startswith('TIMESTAMP'):
+        return 'timestamptz' if 'WITH TIME ZONE' in pg_type or pg_type.startswith('TIMESTAMPTZ') else 'timestamp'
+    if pg_type.startswith('DATE'):
+        return 'date'
+    if pg_type.startswith('JSON'):
+        return 'json'
+    if pg_type.startswith(('VARCHAR', 'CHAR', 'TEXT')):
+        return 'text'
+    return None
+
+
+def _to_boolean(series):
+    labels = series.map(lambda v: str(v).strip().lower(), na_action='ignore')
+    return labels.map(BOOLEAN_LABELS).astype('boolean')
+
+
+def _to_datetime(series, utc=False):
+    try:
+        return pd.to_datetime(series, errors='coerce', format='mixed', utc=utc)
+    except (ValueError, TypeError):
+        # Mixed offsets cannot be held in one naive column
+        return pd.to_datetime(series, errors='coerce', format='mixed', utc=True)
+
+
+def coerce_to_schema(df, schema):
+    """
+    Converts the generated columns to the types of the parsed table schema before COPY.
+
+    Columns are matched by name and returned in schema order; columns that are not in
+    the schema are dropped. Values that cannot be converted (e.g. "n/a" in an INTEGER
+    column) become NULL instead of failing the whole load. Text is cut to the declared
+    length of VARCHAR(n)/CHAR(n) columns.
+    """
+    by_name = {str(c).lower(): c for c in df.columns}
+    coerced = {}
+    for column in schema['columns']:
+        source = by_name.get(column['name'])
+        if source is None:
+            continue
+        series = df[source]
+        pg_type = postgres_type(column.get('sql_type', column['type']))
+        family = _type_family(pg_type)
+
+        if family == 'integer':
+            if series.dtype == bool or series.dtype == object:
+                series = series.map(lambda v: int(v) if isinstance(v, bool) else v, na_action='ignore')
+            series = pd.to_numeric(series, errors='coerce').round().astype('Int64')
+        elif family == 'float':
+            series = pd.to_numeric(series, errors='coerce')
+            scale = re.search(r'\(\s*\d+\s*,\s*(\d+)\s*\)', pg_type)
+            if scale:
+                series = series.round(int(scale.group(1)))
+        elif family == 'boolean':
+            series = _to_boolean(series)
+        elif family == 'date':
+            series = _to_datetime(series).dt.strftime('%Y-%m-%d')
+        elif family in ('timestamp', 'timestamptz'):
+            series = _to_datetime(series, utc=family == 'timestamptz')
+        elif family == 'json':
+            series = series.map(lambda v: v if isinstance(v, str) else json.dumps(v, default=str), na_action='ignore')
+        elif family == 'text':
+            length = re.search(r'\(\s*(\d+)\s*\)', pg_type)
+            if length:
+                series = series.map(lambda v: str(v)[:int(length.group(1))], na_action='ignore')
+
+        coerced[column['name']] = series
+    return pd.DataFrame(coerced, index=df.index)
+
+
+def build_create_table_sql(schema, include_constraints=False):
+    """
+    Builds the CREATE TABLE statement of a parsed table schema with PostgreSQL types.
+    Keys, foreign keys and indexes are left out unless `include_constraints` is set, so
+    they can be built after the bulk load.
+    """
+    columns_ddl = []
+    for column in schema['columns']:
+        column_ddl = f"  {column['name']} {postgres_type(column.get('sql_type', column['type']))}"
+        if not column['nullable']:
+            column_ddl += " NOT NULL"
+        columns_ddl.append(column_ddl)
+
+    if include_constraints:
+        primary_key = get_primary_key(schema)
+        if primary_key:
+            columns_ddl.append(f"  PRIMARY KEY ({', '.join(primary_key)})")
+        for unique_key in get_unique_keys(schema):
+            columns_ddl.append(f"  UNIQUE ({', '.join(unique_key)})")
+        for fk in get_foreign_keys(schema):
+            columns_ddl.append(
+                f"  FOREIGN KEY ({', '.join(fk['columns'])}) REFERENCES {fk['ref_table']} ({', '.join(fk['ref_columns'])})"
+            )
+
+    return f"CREATE TABLE {schema['table_name']} (\n" + ",\n".join(columns_ddl) + "\n);"
+
+
+def _short_identifier(name, max_bytes=63):
+    """
+    Cuts `name` to at most `max_bytes` bytes (PostgreSQL identifiers are limited to 63).
+    A cut name ends with a hash of the full name, so different names stay different.
+    """
+    encoded = name.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return name
+    digest = hashlib.sha1(encoded).hexdigest()[:8]
+    return encoded[:max_bytes - 9].decode('utf-8', errors='ignore') + '_' + digest
+
+
+def _relation_name(table_name, columns, suffix, taken):
+    """PostgreSQL-style name of a key or index (e.g. orders_customer_id_fkey), unique among `taken`."""
+    base = "_".join([table_name, *columns, suffix])
+    name = _short_identifier(base)
+    counter = 0
+    while name in taken:
+        counter += 1
+        name = _short_identifier(f"{base}{counter}")
+    taken.add(name)
+    return name
+
+
+def _post_load_statements(table_name, schema, names=None, token=None, renames=None):
+    """
+    Returns the (label, statement) pairs that rebuild the keys and indexes of a table
+    after its data is loaded, grouped by phase: 'keys', 'foreign_keys' and 'indexes'.
+    Foreign keys are added NOT VALID, so existing rows are not re-checked.
+
+    `names` maps table names to the physical (staging) tables the statements run on.
+    With a `token` every key and index is created under a temporary name built from
+    it, and `renames` is filled with {temporary name: final name}, so everything can
+    be built before the staging tables replace the live ones.
+    """
+    names = names or {}
+    renames = {} if renames is None else renames
+    taken = set(renames.values())
+    table = sql.Identifier(names.get(table_name, table_name))
+
+    def column_list(columns):
+        return sql.SQL(", ").join(map(sql.Identifier, columns))
+
+    def relation(final_name):
+        if not token:
+            return sql.Identifier(final_name)
+        temporary_name = _staging_table_name(final_name, token)
+        renames[temporary_name] = final_name
+        return sql.Identifier(temporary_name)
+
+    phases = {'keys': [], 'foreign_keys': [], 'indexes': []}
+    primary_key = get_primary_key(schema)
+    indexed_prefixes = []
+    if primary_key:
+        phases['keys'].append((
+            f"{table_name} primary key",
+            sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY ({})").format(
+                table, relation(_relation_name(table_name, [], 'pkey', taken)), column_list(primary_key)
+            )
+        ))
+        indexed_prefixes.append(primary_key)
+
+    for unique_key in get_unique_keys(schema):
+        phases['keys'].append((
+            f"{table_name} unique ({', '.join(unique_key)})",
+            sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} UNIQUE ({})").format(
+                table, relation(_relation_name(table_name, unique_key, 'key', taken)), column_list(unique_key)
+            )
+        ))
+        indexed_prefixes.append(unique_key)
+
+    for index in schema.get('indexes', []):
+        if index['name']:
+            index_name = index['name']
+            taken.add(index_name)
+        else:
+            index_name = _relation_name(table_name, re.findall(r'[a-z_]\w*', index['columns'].lower()), 'idx', taken)
+        statement = sql.SQL("CREATE {}INDEX {} ON {} {}({}){}").format(
+            sql.SQL("UNIQUE " if index['unique'] else ""),
+            relation(index_name),
+            table,
+            sql.SQL(f"USING {index['method']} ") if index['method'] else sql.SQL(""),
+            sql.SQL(index['columns']),
+            sql.SQL(f" WHERE {index['where']}") if index['where'] else sql.SQL("")
+        )
+        phases['indexes'].append((f"{table_name} index {index['name'] or index['columns']}", statement))
+        if not index['where']:
+            indexed_prefixes.append([c.strip(' `"').lower() for c in index['columns'].split(',')])
+
+    for fk in get_foreign_keys(schema):
+        phases['foreign_keys'].append((
+            f"{table_name} foreign key ({', '.join(fk['columns'])})",
+            sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {} ({}) NOT VALID").format(
+                table, relation(_relation_name(table_name, fk['columns'], 'fkey', taken)), column_list(fk['columns']),
+                sql.Identifier(names.get(fk['ref_table'], fk['ref_table'])), column_list(fk['ref_columns'])
+            )
+        ))
+        # PostgreSQL does not index the referencing side; joins on it need one
+        if not any(prefix[:len(fk['columns'])] == fk['columns'] for prefix in indexed_prefixes):
+            phases['indexes'].append((
+                f"{table_name} index ({', '.join(fk['columns'])})",
+                sql.SQL("CREATE INDEX {} ON {} ({})").format(
+                    relation(_relation_name(table_name, fk['columns'], 'idx', taken)), table, column_list(fk['columns'])
+                )
+            ))
+            indexed_prefixes.append(fk['columns'])
+
+    return phases
+
+
+def _run_statements(statements):
+    """Runs (label, statement) pairs on one pooled connection, committing each. Returns the failed labels."""
+    failures = []
+    with pooled_connection() as conn, conn.cursor() as cur:
+        for label, statement in statements:
+            try:
+                cur.execute(statement)
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"Could not create {label}: {e}", flush=True)
+                failures.append(label)
+    return failures
+
+
+@instrumented('db.constraints')
+def _build_keys_and_indexes(loaded_schemas, names=None, token=None, max_workers=BULK_LOAD_MAX_WORKERS,
+                            renames=None):
+    """
+    Creates the keys, foreign keys and indexes of the loaded tables, then ANALYZEs them.
+
+    Phases run in order (keys before the foreign keys that need them, then indexes),
+    and within a phase the tables are processed in parallel on separate connections.
+    Each statement commits on its own, so one failure (e.g. duplicated key values in
+    the generated data) does not undo the others. Returns the labels of the failures.
+    `renames` is filled as in _post_load_statements.
+    """
+    names = names or {}
+    statements = {table_name: _post_load_statements(table_name, schema, names, token, renames)
+                  for table_name, schema in loaded_schemas.items()}
+    for table_name in loaded_schemas:
+        statements[table_name]['indexes'].append((
+            f"{table_name} analyze", sql.SQL("ANALYZE {}").format(sql.Identifier(names.get(table_name, table_name)))
+        ))
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(loaded_schemas)))) as executor:
+        for phase in ('keys', 'foreign_keys', 'indexes'):
+            # Each worker runs in a copy of the caller's context, so it uses the session schema
+            futures = [
+                executor.submit(contextvars.copy_context().run, _run_statements, phases[phase])
+                for phases in statements.values() if phases[phase]
+            ]
+            for future in futures:
+                failures.extend(future.result())
+    return failures
+
+
+class _CachingQueryPager(QueryPager):
+    """QueryPager that stores the complete result in the query cache once it is exhausted."""
+
+    def __init__(self, query, cache_key, **kwargs):
+        super().__init__(query, **kwargs)
+        self._cache_key = cache_key
+        self._pages = []
+
+    def next_page(self):
+        page = super().next_page()
+        if self._pages is not None:
+            if 'Error' in page.columns or self.rows_fetched > QUERY_CACHE_MAX_ROWS:
+                self._pages = None
+            else:
+                self._pages.append(page)
+                if self.exhausted and not self.truncated:
+                    get_query_cache().put(self._cache_key, pd.concat(self._pages, ignore_index=True))
+                    self._pages = None
+        return page
+
+
+@instrumented('db.query')
+def run_sql_query(sql_query, stream=False, page_size=None, max_rows=None, guard=SQL_GUARD_ENABLED):
     """
     Executes the SQL query translated by the LLM in the actual PostgreSQL database.
+    Results are served from the query cache while the tables they read are unchanged.
+
+    With `guard`, the query first goes through sql_guard.guard_query(): it must be
+    read-only and fit the EXPLAIN budgets, it gets a LIMIT when it has none, and it
+    runs in a read-only transaction with a statement timeout. A rejection is returned
+    like any other error, with its reasons.
     
     Args:
         sql_query (str): The SQL query generated by Gemini.
+        stream (bool): If True, return a lazy QueryPager backed by a server-side
+            cursor instead of loading every row at once.
+        page_size (int): Rows per page in streaming mode (DB_STREAM_PAGE_SIZE by default).
+        max_rows (int): Hard cap on the rows fetched in streaming mode (DB_MAX_RESULT_ROWS by default).
+        guard (bool): Check and limit the query with sql_guard (SQL_GUARD_ENABLED by default).
         
     Returns:
         pd.DataFrame: DataFrame with the results from the DB or an error message.
+        QueryPager: When stream is True. Call next_page() to fetch each page.
     """
 
-    return execute_query(sql_query, fetch_results=True)
+    cache = get_query_cache()
+    cache_key = cache.make_key(sql_query)
+    cached_df = cache.get(cache_key)
+
+    page_size = page_size or DB_STREAM_PAGE_SIZE
+    max_rows = DB_MAX_RESULT_ROWS if max_rows is None else max_rows
+    query_stage = current_stage()
+    query_stage.record(cached=cached_df is not None, stream=stream)
+    if cached_df is not None:
+        query_stage.record(rows=len(cached_df))
+        return DataFramePager(cached_df, page_size=page_size, max_rows=max_rows) if stream else cached_df
 
+    limits = {}
+    if guard:
+        try:
+            with stage('sql.guard'):
+                sql_query, _ = guard_query(sql_query, limit=max_rows + 1)
+        except SqlGuardError as e:
+            query_stage.fail(e)
+            error_df = pd.DataFrame({'Error': [str(e)]})
+            return DataFramePager(error_df, page_size=page_size) if stream else error_df
+        except ConnectionError as e:
+            query_stage.fail(e)
+            error_df = pd.DataFrame({'Error': [f"{e}"]})
+            return DataFramePager(error_df, page_size=page_size) if stream else error_df
+        limits = {'read_only': True, 'statement_timeout_ms': SQL_STATEMENT_TIMEOUT_MS}
+
+    if stream:
+        # The pages are fetched later, each as a 'db.fetch_page' stage
+        return _CachingQueryPager(sql_query, cache_key, page_size=page_size, max_rows=max_rows, **limits)
 
-from db_connector import execute_query
+    result_df = execute_query(sql_query, fetch_results=True, **limits)
+    if 'Error' in result_df.columns:
+        query_stage.fail(result_df['Error'].iloc[0])
+    else:
+        query_stage.record(rows=len(result_df))
+    cache.put(cache_key, result_df)
+    return result_df
 
 
-def setup_db_with_data(generated_tables):
+class _CopyChunkStream:
     """
-    Creates the tables and populates them with the generated data in PostgreSQL.
-    Returns a success message or the first error.
+    File-like object that renders a DataFrame in the COPY text format, `chunk_rows` rows
+    at a time, so the whole table is never held as one text buffer. NULLs are written as
+    \\N and backslashes, tabs and newlines in text values are escaped, so a text value
+    of \\N or an empty string is kept apart from NULL. `transform` is applied to each
+    chunk (e.g. coerce_to_schema) before it is rendered.
     """
-    for table_name, df in generated_tables.items():
-        if 'Error' in df.columns:
-            continue
-            
-        drop_query = f"DROP TABLE IF EXISTS {table_name} CASCADE;"
-        execute_query(drop_query, fetch_results=False)
-        
-        ddl_schema = get_db_schema_for_llm({table_name: df})
-        if ddl_schema:
-            result_df = execute_query(ddl_schema, fetch_results=False)
-            if 'Error' in result_df.columns:
-                return result_df['Error'].iloc[0]
-                
-        from io import StringIO
-        buffer = StringIO()
-
-        df.to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_NONNUMERIC)
-        buffer.seek(0)
-        
-        conn = None
+
+    def __init__(self, df, chunk_rows=BULK_LOAD_CHUNK_ROWS, transform=None):
+        self._df = df
+        self._chunk_rows = max(1, chunk_rows)
+        self._transform = transform
+        self._position = 0
+        self._buffer = ""
+        self._offset = 0
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        # Returns at most the rest of the current chunk; COPY keeps reading until ""
+        while self._offset >= len(self._buffer):
+            if self._position >= len(self._df):
+                return ""
+            chunk = self._df.iloc[self._position:self._position + self._chunk_rows]
+            self._position += self._chunk_rows
+            if self._transform is not None:
+                chunk = self._transform(chunk)
+            self._buffer = _to_copy_text(chunk)
+            self._offset = 0
+        end = len(self._buffer) if size is None or size < 0 else self._offset + size
+        data = self._buffer[self._offset:end]
+        self._offset += len(data)
+        self.bytes_read += len(data.encode("utf-8"))
+        return data
+
+
+def _to_copy_text(df):
+    """Renders DataFrame rows in the tab-separated COPY text format."""
+    escaped = df.copy(deep=False)
+    for column, series in df.items():
+        if not (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series)):
+            escaped[column] = series.map(lambda v: str(v).translate(COPY_TEXT_ESCAPES), na_action='ignore')
+    # Nothing left to quote once the text is escaped: the newline quotechar never occurs
+    return escaped.to_csv(sep='\t', index=False, header=False, na_rep=COPY_NULL,
+                          quoting=csv.QUOTE_NONE, quotechar='\n')
+
+
+def _staging_table_name(table_name, token):
+    """Temporary name of a table, key or index during a load, within the 63-byte identifier limit."""
+    return f"{_short_identifier(table_name, 40)}__load_{token}"
+
+
+def _load_staging_table(table_name, staging_name, df, schema=None, chunk_rows=BULK_LOAD_CHUNK_ROWS):
+    """
+    Creates `staging_name` and streams the rows of one table into it with COPY, on its
+    own pooled connection. With a parsed `schema` the table gets the original column
+    types and each chunk is coerced to them. Returns the load stats; raises on error.
+
+    NOT NULL is only set after the load on the columns that got a value in every row.
+    A NOT NULL column the generated data lacks, or that has NULLs after coercion, is
+    left nullable and listed in the 'relaxed_not_null' stat instead of failing the load.
+    """
+    start = time.perf_counter()
+    relaxed = []
+    with stage('db.copy', table=table_name) as copy_stage, pooled_connection() as conn, conn.cursor() as cur:
+        transform = None
+        if schema is not None:
+            typed_schema = dict(schema, table_name=staging_name,
+                                columns=[dict(c, nullable=True) for c in schema['columns']])
+            try:
+                with stage('db.create_table', table=table_name):
+                    cur.execute(build_create_table_sql(typed_schema))
+                df_columns = {str(n).lower() for n in df.columns}
+                columns = [c['name'] for c in schema['columns'] if c['name'] in df_columns]
+                required = [c['name'] for c in schema['columns'] if not c['nullable'] and c['name'] in df_columns]
+                relaxed = [c['name'] for c in schema['columns'] if not c['nullable'] and c['name'] not in df_columns]
+                null_columns = set()
+
+                def transform(chunk):
+                    coerced = coerce_to_schema(chunk, schema)
+                    null_columns.update(c for c in required if coerced[c].isna().any())
+                    return coerced
+            except psycopg2.Error as e:
+                # e.g. a type PostgreSQL does not know: fall back to the inferred types
+                conn.rollback()
+                print(f"Typed CREATE TABLE failed for {table_name}: {e}", flush=True)
+                schema = None
+
+        if schema is None:
+            with stage('db.create_table', table=table_name, typed=False):
+                cur.execute(get_db_schema_for_llm({staging_name: df}))
+            columns = [str(c).lower() for c in df.columns]
+
+        stream = _CopyChunkStream(df, chunk_rows, transform)
+        copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT text, NULL {})").format(
+            sql.Identifier(staging_name),
+            sql.SQL(", ").join(map(sql.Identifier, columns)),
+            sql.Literal(COPY_NULL)
+        )
+        cur.copy_expert(copy_query, stream, size=COPY_READ_SIZE)
+        if schema is not None:
+            relaxed += [c for c in required if c in null_columns]
+            enforced = [c for c in required if c not in null_columns]
+            if enforced:
+                cur.execute(sql.SQL("ALTER TABLE {} {}").format(
+                    sql.Identifier(staging_name),
+                    sql.SQL(", ").join(sql.SQL("ALTER COLUMN {} SET NOT NULL").format(sql.Identifier(c)) for c in enforced)
+                ))
+        conn.commit()
+        copy_stage.record(rows=len(df), bytes=stream.bytes_read, typed=schema is not None)
+
+    seconds = time.perf_counter() - start
+    return {
+        'rows': len(df),
+        'bytes': stream.bytes_read,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(len(df) / seconds) if seconds > 0 else None,
+        'typed': schema is not None,
+        'relaxed_not_null': relaxed
+    }
+
+
+@instrumented('db.swap')
+def _publish_staging_tables(staged, relation_renames=None, lock_timeout_ms=SWAP_LOCK_TIMEOUT_MS,
+                            retries=SWAP_RETRIES):
+    """
+    Replaces every table with its loaded staging table in a single short transaction,
+    so readers see either all the old tables or all the new ones. Indexes and
+    constraints built on the staging tables take their final names.
+
+    The swap only touches the catalog, but it needs an ACCESS EXCLUSIVE lock on the live
+    tables. A lock request that waits would queue every newly arriving reader behind
+    it (and can deadlock with a reader joining the same tables), so the locks are taken
+    with NOWAIT and the attempt is retried with jittered backoff while readers are
+    active. Only the last attempt waits, for at most `lock_timeout_ms`.
+    """
+    relation_renames = relation_renames or {}
+    for attempt in range(retries + 1):
+        last_attempt = attempt >= retries
         try:
-            from db_connector import get_db_connection
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.copy_from(
-                buffer,
-                table_name,
-                sep=",",
-                columns=df.columns
-            )
+            with pooled_connection() as conn, conn.cursor() as cur:
+                cur.execute("SET LOCAL lock_timeout = %s", (f"{int(lock_timeout_ms)}ms",))
+                cur.execute("SELECT t FROM unnest(%s::text[]) AS t WHERE to_regclass(t) IS NOT NULL", (list(staged),))
+                live_tables = [row[0] for row in cur.fetchall()]
+                if live_tables:
+                    cur.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE{}").format(
+                        sql.SQL(", ").join(map(sql.Identifier, live_tables)),
+                        sql.SQL("" if last_attempt else " NOWAIT")
+                    ))
+                referencing = _referencing_foreign_keys(cur, staged)
+                for table_name, staging_name in staged.items():
+                    cur.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(sql.Identifier(table_name)))
+                    cur.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                        sql.Identifier(staging_name), sql.Identifier(table_name)
+                    ))
+                    _rename_staging_relations(cur, table_name, staging_name, relation_renames)
+                _restore_foreign_keys(cur, referencing)
+                conn.commit()
+                return
+        except (psycopg2.errors.LockNotAvailable, psycopg2.errors.DeadlockDetected):
+            if last_attempt:
+                raise
+            time.sleep(min(SWAP_RETRY_MAX_DELAY, SWAP_RETRY_DELAY * (2 ** attempt)) * (0.5 + random.random()))
+
+
+def _referencing_foreign_keys(cur, staged):
+    """
+    Returns (table, constraint_name, definition) of the foreign keys that other tables
+    hold on the tables being replaced, which DROP TABLE ... CASCADE would remove.
+    """
+    cur.execute(
+        """
+        SELECT c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        WHERE c.contype = 'f'
+          AND c.confrelid IN (SELECT to_regclass(t) FROM unnest(%s::text[]) AS t)
+          AND c.conrelid NOT IN (SELECT to_regclass(t) FROM unnest(%s::text[]) AS t WHERE to_regclass(t) IS NOT NULL)
+        """,
+        (list(staged), list(staged))
+    )
+    return cur.fetchall()
+
+
+def _restore_foreign_keys(cur, foreign_keys):
+    """
+    Re-adds foreign keys dropped by the swap, NOT VALID so existing rows are not
+    re-checked. One that no longer fits the new table (e.g. its key column is gone)
+    is reported and skipped without failing the swap.
+    """
+    for table, constraint_name, definition in foreign_keys:
+        if not definition.endswith("NOT VALID"):
+            definition += " NOT VALID"
+        cur.execute("SAVEPOINT restore_foreign_key")
+        try:
+            cur.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {}").format(
+                sql.SQL(table), sql.Identifier(constraint_name), sql.SQL(definition)
+            ))
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT restore_foreign_key")
+            print(f"Could not restore foreign key {constraint_name} on {table}: {e}", flush=True)
+        cur.execute("RELEASE SAVEPOINT restore_foreign_key")
+
+
+def _rename_staging_relations(cur, table_name, staging_name, relation_renames):
+    """
+    Gives the constraints and indexes created on a staging table their final names:
+    the ones in `relation_renames` ({temporary name: final name}, see
+    _post_load_statements), and any other one named after the staging table.
+    """
+    def final_name(name):
+        if name in relation_renames:
+            return relation_renames[name]
+        if name.startswith(staging_name):
+            return _short_identifier(table_name + name[len(staging_name):])
+        return None
+
+    cur.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype NOT IN ('p', 'u', 'x')",
+        (table_name,)
+    )
+    for (constraint_name,) in cur.fetchall():
+        if final_name(constraint_name):
+            cur.execute(sql.SQL("ALTER TABLE {} RENAME CONSTRAINT {} TO {}").format(
+                sql.Identifier(table_name), sql.Identifier(constraint_name),
+                sql.Identifier(final_name(constraint_name))
+            ))
+
+    # Renaming the index of a primary key or unique constraint renames the constraint too
+    cur.execute(
+        "SELECT relname FROM pg_class WHERE oid IN "
+        "(SELECT indexrelid FROM pg_index WHERE indrelid = to_regclass(%s))",
+        (table_name,)
+    )
+    for (index_name,) in cur.fetchall():
+        if final_name(index_name):
+            cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                sql.Identifier(index_name), sql.Identifier(final_name(index_name))
+            ))
+
+
+def _drop_staging_tables(staging_names):
+    try:
+        with pooled_connection() as conn, conn.cursor() as cur:
+            for staging_name in staging_names:
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(staging_name)))
             conn.commit()
-        except Exception as e:
-            if conn: conn.rollback()
-            return f"Error inserting into {table_name}: {e}"
+    except Exception as e:
+        print(f"Could not drop the staging tables {', '.join(staging_names)}: {e}", flush=True)
+
+
+@instrumented('db.load')
+def setup_db_with_data(generated_tables, schemas=None, load_stats=None, max_workers=BULK_LOAD_MAX_WORKERS):
+    """
+    Creates the tables and populates them with the generated data in PostgreSQL.
+
+    Every table is first streamed with COPY into a staging table, with up to `max_workers`
+    tables loading in parallel on separate pooled connections. Tables with a parsed
+    schema in `schemas` (see parse_ddl_to_schema) are created with their original types,
+    and their primary keys, unique and foreign keys and indexes are built on the staging
+    tables once all the data is loaded, which is faster than maintaining them row by row.
+
+    Only when every load succeeds are the staging tables renamed over the live ones in
+    one short transaction (see _publish_staging_tables); on any failure the existing
+    tables are left untouched. Concurrent readers keep querying the old data during the
+    whole load and never see a missing or half-loaded table.
+    `load_stats` is optionally filled with the per-table 'rows', 'bytes', 'seconds' and
+    'rows_per_sec' of the load. Returns a success message or the first error.
+    """
+    schemas = schemas or {}
+    tables = {name: df for name, df in generated_tables.items() if 'Error' not in df.columns}
+    if not tables:
+        return "Tables and data inserted successfully into PostgreSQL."
+
+    load_stage = current_stage()
+    load_stage.record(tables=len(tables))
+    try:
+        budget_error = check_storage_budget()
+    except (ConnectionError, psycopg2.Error) as e:
+        load_stage.fail(e)
+        return f"Error connecting to the DB: {e}"
+    if budget_error:
+        load_stage.fail(budget_error)
+        return f"Error: {budget_error}"
+
+    token = uuid.uuid4().hex[:8]
+    staged = {name: _staging_table_name(name, token) for name in tables}
+    error_message = None
+    failures = []
+    relaxed = []
+    published = False
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tables)))) as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, _load_staging_table, name, staged[name], df,
+                                schemas.get(name)): name
+                for name, df in tables.items()
+            }
+            for future in as_completed(futures):
+                table_name = futures[future]
+                try:
+                    stats = future.result()
+                except Exception as e:
+                    error_message = error_message or f"Error inserting into {table_name}: {e}"
+                    continue
+                load_stage.record(rows=stats['rows'], bytes=stats['bytes'])
+                relaxed.extend(f"{table_name}.{column}" for column in stats['relaxed_not_null'])
+                if load_stats is not None:
+                    load_stats[table_name] = stats
+
+        if error_message:
+            load_stage.fail(error_message)
+            return error_message
+
+        # Keys and indexes are built while the tables are still private to this load
+        loaded_schemas = {name: schemas[name] for name in tables if name in schemas}
+        relation_renames = {}
+        if loaded_schemas:
+            failures = _build_keys_and_indexes(loaded_schemas, staged, token, max_workers, relation_renames)
+
+        # Bumped before and after the swap so no cached result spans the rewrite
+        for table_name in tables:
+            bump_table_version(table_name)
+        try:
+            _publish_staging_tables(staged, relation_renames)
+            published = True
         finally:
-            if conn: cur.close(); conn.close()
+            for table_name in tables:
+                bump_table_version(table_name)
+
+    except Exception as e:
+        load_stage.fail(e)
+        return f"Error inserting into {', '.join(tables)}: {e}"
+    finally:
+        if not published:
+            _drop_staging_tables(list(staged.values()))
+
+    notes = []
+    if failures:
+        notes.append(f"some keys or indexes could not be created: {', '.join(failures)}")
+    if relaxed:
+        notes.append(f"these columns have missing values and were left nullable: {', '.join(sorted(relaxed))}")
+    if notes:
+        return f"Tables and data inserted successfully into PostgreSQL, but {'; '.join(notes)}."
+
+    return "Tables and data inserted successfully into PostgreSQL."
+
+
+def get_table_columns(cur, table_name):
+    """Returns [(column_name, sql_type)] of an existing table, in column order."""
+    cur.execute(
+        """
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+        """,
+        (table_name,)
+    )
+    return cur.fetchall()
+
+
+def get_primary_key_columns(cur, table_name):
+    """Returns the primary key columns of an existing table (empty if it has none)."""
+    cur.execute(
+        """
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = to_regclass(%s) AND i.indisprimary
+        ORDER BY array_position(i.indkey, a.attnum)
+        """,
+        (table_name,)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _native(value):
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _to_db_rows(df, columns):
+    """Converts DataFrame rows into tuples of plain Python values (NaN/NaT -> None)."""
+    values = df[columns].astype(object).where(df[columns].notna(), None)
+    return [tuple(_native(v) for v in row) for row in values.itertuples(index=False, name=None)]
+
+
+def compute_table_changes(old_df, new_df, key_columns):
+    """
+    Computes the row-level delta between two versions of a table keyed by `key_columns`.
+    Returns (inserted_df, updated_df, deleted_keys_df). Raises ValueError when a key
+    is missing or duplicated in either version.
+    """
+    for label, df in (("previous", old_df), ("edited", new_df)):
+        if df[key_columns].isna().any().any():
+            raise ValueError(f"The {label} data has rows without a value for {', '.join(key_columns)}.")
+        if df.duplicated(subset=key_columns).any():
+            raise ValueError(f"The {label} data has duplicated values for {', '.join(key_columns)}.")
+
+    old_indexed = old_df.set_index(key_columns, drop=False)
+    new_indexed = new_df.set_index(key_columns, drop=False)
+
+    inserted = new_indexed[~new_indexed.index.isin(old_indexed.index)]
+    deleted = old_indexed[~old_indexed.index.isin(new_indexed.index)][key_columns]
+
+    common = new_indexed.index[new_indexed.index.isin(old_indexed.index)]
+    value_columns = [c for c in new_df.columns if c not in key_columns]
+    if len(common) and value_columns:
+        before = old_indexed.loc[common, value_columns].astype(object)
+        after = new_indexed.loc[common, value_columns].astype(object)
+        changed = (before != after) & ~(before.isna() & after.isna())
+        updated = new_indexed.loc[common][changed.any(axis=1).to_numpy()]
+    else:
+        updated = new_indexed.iloc[0:0]
+
+    return inserted.reset_index(drop=True), updated.reset_index(drop=True), deleted.reset_index(drop=True)
+
+
+def _schema_for_frame(schema, df):
+    """
+    Adapts a parsed table schema to the columns of an edited DataFrame: dropped columns
+    are removed with the constraints and indexes that use them, and new columns are
+    added as nullable with the type inferred from their data.
+    """
+    df_columns = {str(c).lower(): dtype for c, dtype in df.dtypes.items()}
+    kept = [c for c in schema['columns'] if c['name'] in df_columns]
+    removed = {c['name'] for c in schema['columns']} - set(df_columns)
+    known = {c['name'] for c in kept}
+    added = [
+        {'name': name, 'type': _inferred_sql_type(dtype), 'sql_type': _inferred_sql_type(dtype),
+         'nullable': True, 'primary_key': False, 'unique': False}
+        for name, dtype in df_columns.items() if name not in known
+    ]
+
+    def uses_removed(text):
+        return any(re.search(rf'\b{re.escape(name)}\b', text, re.IGNORECASE) for name in removed)
+
+    return dict(
+        schema,
+        columns=kept + added,
+        constraints=[c for c in schema['constraints'] if not uses_removed(c)],
+        indexes=[i for i in schema.get('indexes', []) if not uses_removed(f"{i['columns']} {i.get('where') or ''}")]
+    )
+
+
+@instrumented('db.apply_changes')
+def apply_table_changes(table_name, old_df, new_df, key_columns=None, schemas=None):
+    """
+    Persists an edit of a table by applying only the changed rows.
+
+    The delta between `old_df` (what is stored in PostgreSQL) and `new_df` is keyed by
+    the table's primary key (or `key_columns` / an 'id' column when it has none) and
+    applied as batched INSERT / UPDATE / DELETE statements in one transaction, so the
+    cost scales with the size of the edit. Falls back to a full reload when the columns
+    changed or no usable key exists; the parsed schema of the table in `schemas` is then
+    used so the reloaded table keeps its column types, keys and indexes.
+    Returns a success message or an error.
+    """
+    bump_table_version(table_name)
+    try:
+        with pooled_connection() as conn, conn.cursor() as cur:
+            table_columns = get_table_columns(cur, table_name)
+            column_types = dict(table_columns)
+            key_columns = key_columns or get_primary_key_columns(cur, table_name)
+            if not key_columns and 'id' in new_df.columns:
+                key_columns = ['id']
+
+            same_columns = set(column_types) == set(new_df.columns) == set(old_df.columns)
+            usable_key = bool(key_columns) and not old_df.duplicated(subset=key_columns).any()
+            needs_reload = not table_columns or not same_columns or not usable_key
+            if needs_reload:
+                conn.rollback()
+            else:
+                message = _apply_changes(conn, cur, table_name, old_df, new_df, table_columns, key_columns)
+
+        if needs_reload:
+            reload_schemas = {}
+            if schemas and table_name in schemas:
+                reload_schemas[table_name] = _schema_for_frame(schemas[table_name], new_df)
+            return setup_db_with_data({table_name: new_df}, reload_schemas)
+        return message
+
+    except Exception as e:
+        current_stage().fail(e)
+        return f"Error applying changes to {table_name}: {e}"
+    finally:
+        bump_table_version(table_name)
+
+
+def _apply_changes(conn, cur, table_name, old_df, new_df, table_columns, key_columns):
+    """Applies the delta between old_df and new_df in the current transaction and commits it."""
+    column_types = dict(table_columns)
+    inserted, updated, deleted = compute_table_changes(old_df, new_df, key_columns)
+    columns = [c for c, _ in table_columns]
+    value_columns = [c for c in columns if c not in key_columns]
+    table = sql.Identifier(table_name)
+
+    def template(cols):
+        return sql.SQL("({})").format(sql.SQL(", ").join(
+            sql.SQL("%s::{}").format(sql.SQL(column_types[c])) for c in cols
+        )).as_string(conn)
+
+    def key_match(alias):
+        return sql.SQL(" AND ").join(
+            sql.SQL("t.{0} = {1}.{0}").format(sql.Identifier(k), sql.Identifier(alias)) for k in key_columns
+        )
+
+    if not deleted.empty:
+        query = sql.SQL("DELETE FROM {} AS t USING (VALUES %s) AS d ({}) WHERE {}").format(
+            table, sql.SQL(", ").join(map(sql.Identifier, key_columns)), key_match('d')
+        )
+        execute_values(cur, query.as_string(conn), _to_db_rows(deleted, key_columns),
+                       template=template(key_columns), page_size=1000)
+
+    if not updated.empty and value_columns:
+        query = sql.SQL("UPDATE {} AS t SET {} FROM (VALUES %s) AS v ({}) WHERE {}").format(
+            table,
+            sql.SQL(", ").join(sql.SQL("{0} = v.{0}").format(sql.Identifier(c)) for c in value_columns),
+            sql.SQL(", ").join(map(sql.Identifier, key_columns + value_columns)),
+            key_match('v')
+        )
+        execute_values(cur, query.as_string(conn), _to_db_rows(updated, key_columns + value_columns),
+                       template=template(key_columns + value_columns), page_size=1000)
+
+    if not inserted.empty:
+        query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+            table, sql.SQL(", ").join(map(sql.Identifier, columns))
+        )
+        execute_values(cur, query.as_string(conn), _to_db_rows(inserted, columns),
+                       template=template(columns), page_size=1000)
 
-    return "Tables and data inserted successfully into PostgreSQL."
\ No newline at end of file
+    conn.commit()
+    return (f"Changes applied to {table_name}: {len(inserted)} inserted, "
+            f"{len(updated)} updated, {len(deleted)} deleted.")
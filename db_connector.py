@@ -1,9 +1,18 @@
 # db_connector.py
 
 import os
+import threading
+import time
+import uuid
+import weakref
+import contextvars
+from contextlib import contextmanager
 import pandas as pd
 import psycopg2
+import psycopg2.errors
+from psycopg2 import extensions, sql
 from dotenv import load_dotenv
+from instrumentation import stage
 
 load_dotenv()
 
@@ -13,11 +22,25 @@ DB_PASS = os.getenv("DB_PASS")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
+# Connection pool settings
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "5"))
+
+# Streaming (server-side cursor) settings
+DB_STREAM_PAGE_SIZE = int(os.getenv("DB_STREAM_PAGE_SIZE", "500"))
+DB_MAX_RESULT_ROWS = int(os.getenv("DB_MAX_RESULT_ROWS", "50000"))
+# Seconds after which an unused pager is closed and its connection returned to the pool; 0 disables it
+DB_PAGER_IDLE_TIMEOUT = float(os.getenv("DB_PAGER_IDLE_TIMEOUT", "60"))
+
 
 def get_db_connection():
     """
     Establishes and returns a psycopg2 connection object (conn).
     The caller is responsible for handling and closing this connection.
+    Prefer pooled_connection() unless a dedicated connection is required.
     """
     try:
         conn = psycopg2.connect(
@@ -32,48 +55,587 @@ def get_db_connection():
         raise ConnectionError(f"Error connecting to the DB: {e}")
 
 
-def execute_query(query, fetch_results=False):
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Connections are health-checked on checkout when they have been idle for
+    more than `check_after` seconds, and idle connections above `min_size`
+    are closed once they have been unused for `max_idle` seconds.
+    Raises ConnectionError when no connection is available within `timeout`.
+    """
+
+    def __init__(self, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, timeout=DB_POOL_TIMEOUT,
+                 max_idle=DB_POOL_MAX_IDLE, check_after=DB_POOL_CHECK_AFTER, connect=get_db_connection):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._connect = connect
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._checkout_seconds_total = 0.0
+        self._checkout_seconds_max = 0.0
+
+    def fill(self):
+        """Opens connections until `min_size` is reached. Failures are ignored."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._new_connection()
+            except ConnectionError:
+                self._release_slot()
+                return
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def getconn(self):
+        """Checks out a healthy connection, waiting up to `timeout` seconds."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        conn, last_used = None, None
+        expired = []
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise ConnectionError("The connection pool is closed.")
+
+                expired += self._pop_expired_locked()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise ConnectionError(
+                        f"Timed out after {self.timeout}s waiting for a DB connection "
+                        f"(pool max size {self.max_size})."
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+        self._close_all(expired)
+
+        if conn is not None and not self._is_healthy(conn, last_used):
+            self._close_all([conn])
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._new_connection()
+            except ConnectionError:
+                self._release_slot()
+                raise
+
+        elapsed = time.monotonic() - start
+        with self._cond:
+            self._in_use += 1
+            self._checkouts += 1
+            self._waits += int(waited)
+            self._checkout_seconds_total += elapsed
+            self._checkout_seconds_max = max(self._checkout_seconds_max, elapsed)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        if not discard:
+            discard = not self._reset(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._size -= 1
+                self._discarded += int(discard)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if discard or self._closed:
+            self._close_all([conn])
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out a connection and always returns it."""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = conn.closed != 0
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self):
+        """Returns a snapshot of the pool metrics."""
+        with self._cond:
+            return {
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'discarded': self._discarded,
+                'checkout_ms_avg': (1000 * self._checkout_seconds_total / self._checkouts) if self._checkouts else 0.0,
+                'checkout_ms_max': 1000 * self._checkout_seconds_max,
+            }
+
+    def closeall(self):
+        """Closes every idle connection; checked-out ones are closed on return."""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._size -= len(idle)
+            self._idle = []
+            self._cond.notify_all()
+        self._close_all(idle)
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _pop_expired_locked(self):
+        now = time.monotonic()
+        expired = []
+        keep = []
+        # Oldest connections sit at the front of the list (LIFO checkout)
+        for conn, last_used in self._idle:
+            if now - last_used > self.max_idle and self._size - len(expired) > self.min_size:
+                expired.append(conn)
+            else:
+                keep.append((conn, last_used))
+        if expired:
+            self._idle = keep
+            self._size -= len(expired)
+        return expired
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _reset(conn):
+        if conn.closed:
+            return False
+        try:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_all(self, conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool()
+                pool.fill()
+                _pool = pool
+    return _pool
+
+
+# PostgreSQL schema of the current user session (see session_schemas.py). Worker
+# threads do not inherit it: submit their work through contextvars.copy_context().run.
+_current_schema = contextvars.ContextVar('db_schema', default=None)
+_search_paths = weakref.WeakKeyDictionary()
+_search_paths_lock = threading.Lock()
+# Errors of a statement that ran in a schema (or on a table) that does not exist
+MISSING_SCHEMA_ERRORS = (psycopg2.errors.InvalidSchemaName, psycopg2.errors.UndefinedTable)
+_missing_schema_handler = None
+
+
+def get_current_schema():
+    """Returns the schema that unqualified table names resolve to, or None for the server default."""
+    return _current_schema.get()
+
+
+def set_current_schema(schema):
+    """Makes `schema` the search_path of every pooled connection used from the current context."""
+    _current_schema.set(schema)
+
+
+def set_missing_schema_handler(handler):
+    """
+    Registers `handler(schema)`, called when a statement fails with one of the
+    MISSING_SCHEMA_ERRORS in that schema (e.g. to recreate a dropped session schema).
+    """
+    global _missing_schema_handler
+    _missing_schema_handler = handler
+
+
+def _report_missing_schema(schema):
+    if schema and _missing_schema_handler is not None:
+        try:
+            _missing_schema_handler(schema)
+        except Exception as e:
+            print(f"Could not recover the schema {schema}: {e}", flush=True)
+
+
+@contextmanager
+def use_schema(schema):
+    """Temporarily switches the current schema for the duration of the block."""
+    token = _current_schema.set(schema)
+    try:
+        yield
+    finally:
+        _current_schema.reset(token)
+
+
+def _apply_search_path(conn, schema):
+    """Points the search_path of a pooled connection at `schema`, only when it changed."""
+    with _search_paths_lock:
+        if _search_paths.get(conn) == schema:
+            return
+    with conn.cursor() as cur:
+        if schema:
+            # Only the session schema: unqualified names must never reach another namespace
+            cur.execute(sql.SQL("SET search_path TO {}").format(sql.Identifier(schema)))
+        else:
+            cur.execute("RESET search_path")
+    conn.commit()
+    with _search_paths_lock:
+        _search_paths[conn] = schema
+
+
+@contextmanager
+def pooled_connection(schema=None):
+    """
+    Checks out a connection from the process-wide pool for the duration of the block,
+    with its search_path set to `schema` (the current session schema by default).
+    Uncommitted work is rolled back when the connection is returned.
     """
-    Executes an SQL query in PostgreSQL.
+    schema = schema or get_current_schema()
+    try:
+        with get_pool().connection() as conn:
+            _apply_search_path(conn, schema)
+            yield conn
+    except MISSING_SCHEMA_ERRORS:
+        # Reported once the connection is back in the pool: the handler needs one
+        _report_missing_schema(schema)
+        raise
+
+
+def get_pool_stats():
+    """Returns the metrics of the process-wide pool (in use, waits, checkout latency...)."""
+    return get_pool().stats()
+
+
+def configure_transaction(cur, read_only=False, statement_timeout_ms=None):
+    """
+    Makes the transaction starting on the cursor's connection read-only and/or bounds
+    the run time of each of its statements. Must be the first thing run in the transaction.
+    """
+    if read_only:
+        cur.execute("SET TRANSACTION READ ONLY")
+    if statement_timeout_ms:
+        cur.execute("SET LOCAL statement_timeout = %s", (int(statement_timeout_ms),))
+
+
+def execute_query(query, fetch_results=False, read_only=False, statement_timeout_ms=None):
+    """
+    Executes an SQL query in PostgreSQL using a pooled connection.
     Returns a DataFrame if fetch_results is True (for SELECT), or None/Error.
-    (YOUR EXISTING CODE)
+    With `read_only` and `statement_timeout_ms`, the query runs in a read-only
+    transaction and is cancelled after that many milliseconds.
     """
-    conn = None
     df = pd.DataFrame()
-    
+
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(query)
-        
-        if fetch_results:
-            column_names = [desc[0] for desc in cur.description]
-            records = cur.fetchall()
-            df = pd.DataFrame(records, columns=column_names)
-        else:
-            conn.commit()
-            
+        with stage('db.execute', fetch=fetch_results) as execute_stage, pooled_connection() as conn, conn.cursor() as cur:
+            configure_transaction(cur, read_only, statement_timeout_ms)
+            cur.execute(query)
+
+            if fetch_results:
+                column_names = [desc[0] for desc in cur.description]
+                records = cur.fetchall()
+                execute_stage.record(rows=len(records))
+                with stage('df.build', rows=len(records)):
+                    df = pd.DataFrame(records, columns=column_names)
+            else:
+                conn.commit()
+
     except ConnectionError as e:
         error_message = f"{e}"
         df = pd.DataFrame({'Error': [error_message]})
-        
+
     except psycopg2.Error as e:
         error_message = f"DB Error: Could not execute the query. {e}"
         df = pd.DataFrame({'Error': [error_message]})
-        if conn:
-            conn.rollback()
-            
+
     except Exception as e:
         error_message = f"General Error: {e}"
         df = pd.DataFrame({'Error': [error_message]})
-        
-    finally:
-        if conn:
+
+    return df
+
+
+class QueryPager:
+    """
+    Lazily pages through the results of a SELECT using a named server-side cursor.
+
+    The query runs on the first call to next_page(). Each page is a DataFrame of at
+    most `page_size` rows, and no more than `max_rows` rows are ever fetched; when
+    the cap is hit while rows remain, `truncated` is set. Errors are returned as a
+    DataFrame with an 'Error' column, like execute_query(). `read_only` and
+    `statement_timeout_ms` are applied to its transaction (see execute_query()).
+
+    The cursor is declared WITH HOLD and its transaction committed right away, so no
+    snapshot or table lock is kept between pages. The commit materializes the result,
+    so the query is wrapped in a LIMIT of `max_rows` + 1 rows (one more than is ever
+    fetched, to tell that it was truncated), whatever LIMIT it has or lacks. The
+    pooled connection is held until the results are exhausted, close() is called, or
+    the pager has been unused for DB_PAGER_IDLE_TIMEOUT seconds; it is then `expired`
+    and serves no more rows.
+    """
+
+    def __init__(self, query, page_size=DB_STREAM_PAGE_SIZE, max_rows=DB_MAX_RESULT_ROWS,
+                 read_only=False, statement_timeout_ms=None):
+        self.query = query
+        self.read_only = read_only
+        self.statement_timeout_ms = statement_timeout_ms
+        # Pages may be fetched later from a context (e.g. a UI callback) without the session schema
+        self.schema = get_current_schema()
+        self.page_size = max(1, int(page_size))
+        self.max_rows = max(1, int(max_rows))
+        self.columns = None
+        self.rows_fetched = 0
+        self.exhausted = False
+        self.truncated = False
+        self.expired = False
+        self._conn = None
+        self._cur = None
+        self._last_used = time.monotonic()
+        # Taken by next_page(), close() and the idle reaper
+        self._lock = threading.RLock()
+
+    def next_page(self):
+        """Fetches the next page of rows. Returns an empty DataFrame once exhausted."""
+        with self._lock:
+            self._last_used = time.monotonic()
+            if self.exhausted:
+                return pd.DataFrame(columns=self.columns or [])
+            return self._fetch_page()
+
+    def _fetch_page(self):
+        try:
+            # Pages are fetched one UI callback at a time: kept in the metrics, not exported as traces
+            with stage('db.fetch_page', export=False) as page_stage:
+                if self._cur is None:
+                    self._open()
+
+                remaining = self.max_rows - self.rows_fetched
+                records = self._cur.fetchmany(min(self.page_size, remaining)) if remaining > 0 else []
+                if self.columns is None:
+                    self.columns = [desc[0] for desc in self._cur.description]
+                # Each FETCH opens a transaction of its own
+                self._conn.commit()
+                self.rows_fetched += len(records)
+                page_stage.record(rows=len(records))
+
+                if self.rows_fetched >= self.max_rows:
+                    self.truncated = self._cur.fetchone() is not None
+                    self.close()
+                elif len(records) < self.page_size:
+                    self.close()
+
+                return pd.DataFrame(records, columns=self.columns)
+
+        except ConnectionError as e:
+            self.close()
+            return pd.DataFrame({'Error': [f"{e}"]})
+
+        except psycopg2.Error as e:
+            self.close()
+            if isinstance(e, MISSING_SCHEMA_ERRORS):
+                _report_missing_schema(self.schema)
+            return pd.DataFrame({'Error': [f"DB Error: Could not execute the query. {e}"]})
+
+        except Exception as e:
+            self.close()
+            return pd.DataFrame({'Error': [f"General Error: {e}"]})
+
+    def __iter__(self):
+        try:
+            while not self.exhausted:
+                page = self.next_page()
+                if 'Error' in page.columns or not page.empty:
+                    yield page
+        finally:
+            self.close()
+
+    def close(self):
+        """Releases the server-side cursor and returns the connection to the pool."""
+        with self._lock:
+            self.exhausted = True
+            conn, cur = self._conn, self._cur
+            self._conn, self._cur = None, None
+        if cur is not None:
             try:
+                if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INERROR:
+                    conn.rollback()
                 cur.close()
-                conn.close()
-            except:
+                # A held cursor outlives rollbacks: its CLOSE is committed
+                conn.commit()
+            except psycopg2.Error:
                 pass
-            
-    return df
\ No newline at end of file
+        if conn is not None:
+            get_pool().putconn(conn)
+
+    def close_if_idle(self, timeout):
+        """Closes the pager, marking it `expired`, when it has been unused for `timeout` seconds."""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._conn is not None and time.monotonic() - self._last_used > timeout:
+                self.expired = True
+                self.close()
+        finally:
+            self._lock.release()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _open(self):
+        self._conn = get_pool().getconn()
+        _apply_search_path(self._conn, self.schema)
+        with self._conn.cursor() as cur:
+            configure_transaction(cur, self.read_only, self.statement_timeout_ms)
+        self._cur = self._conn.cursor(name=f"pager_{uuid.uuid4().hex}", withhold=True)
+        self._cur.itersize = self.page_size
+        query = self.query if isinstance(self.query, str) else self.query.as_string(self._conn)
+        self._cur.execute(f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) AS paged_query LIMIT {self.max_rows + 1}")
+        # The result is materialized at commit and the transaction's locks released
+        self._conn.commit()
+        _track_pager(self)
+
+
+_pager_lock = threading.Lock()
+_open_pagers = weakref.WeakSet()
+_pager_reaper = None
+
+
+def _track_pager(pager):
+    """Registers an open pager with the thread that closes the idle ones (started on first use)."""
+    global _pager_reaper
+    if DB_PAGER_IDLE_TIMEOUT <= 0:
+        return
+    with _pager_lock:
+        _open_pagers.add(pager)
+        if _pager_reaper is None:
+            _pager_reaper = threading.Thread(target=_reap_idle_pagers, name="pager-reaper", daemon=True)
+            _pager_reaper.start()
+
+
+def _reap_idle_pagers():
+    while True:
+        time.sleep(max(1.0, DB_PAGER_IDLE_TIMEOUT / 4))
+        with _pager_lock:
+            pagers = list(_open_pagers)
+        for pager in pagers:
+            pager.close_if_idle(DB_PAGER_IDLE_TIMEOUT)
+
+
+class DataFramePager:
+    """Serves an in-memory DataFrame with the same paging interface as QueryPager."""
+
+    def __init__(self, df, page_size=DB_STREAM_PAGE_SIZE, max_rows=DB_MAX_RESULT_ROWS):
+        max_rows = max(1, int(max_rows))
+        self.page_size = max(1, int(page_size))
+        self.max_rows = max_rows
+        self.columns = list(df.columns)
+        self.rows_fetched = 0
+        self.truncated = len(df) > max_rows
+        self.exhausted = False
+        self.expired = False
+        self._df = df.iloc[:max_rows]
+
+    def next_page(self):
+        page = self._df.iloc[self.rows_fetched:self.rows_fetched + self.page_size].reset_index(drop=True)
+        self.rows_fetched += len(page)
+        if self.rows_fetched >= len(self._df):
+            self.close()
+        return page
+
+    def __iter__(self):
+        while not self.exhausted:
+            page = self.next_page()
+            if not page.empty:
+                yield page
+
+    def close(self):
+        self.exhausted = True
+
+
+def stream_query(query, page_size=DB_STREAM_PAGE_SIZE, max_rows=DB_MAX_RESULT_ROWS):
+    """
+    Executes a SELECT with a server-side cursor and yields DataFrame chunks of up
+    to `page_size` rows, stopping after `max_rows` rows. An error is yielded as a
+    single DataFrame with an 'Error' column.
+    """
+    yield from QueryPager(query, page_size=page_size, max_rows=max_rows)
@@ -0,0 +1,194 @@
+# ddl_parser.py
+
+import re
+from instrumentation import instrumented
+
+TABLE_PATTERN = re.compile(
+    r'CREATE(?:\s+OR\s+REPLACE)?\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?:[`"]?\w+[`"]?\.)?[`"]?(\w+)[`"]?\s*\((.*?)\)\s*[^;()]*;',
+    re.IGNORECASE | re.DOTALL
+)
+INDEX_PATTERN = re.compile(
+    r'CREATE\s+(UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(?:[`"]?(\w+)[`"]?\s+)?'
+    r'ON\s+(?:ONLY\s+)?(?:[`"]?\w+[`"]?\.)?[`"]?(\w+)[`"]?\s*(?:USING\s+(\w+)\s*)?\((.*?)\)\s*(?:WHERE\s+([^;]*?))?\s*;',
+    re.IGNORECASE | re.DOTALL
+)
+INLINE_INDEX_PATTERN = re.compile(r'^(UNIQUE\s+)?(?:INDEX|KEY)\s+[`"]?(\w*)[`"]?\s*\((.*)\)$', re.IGNORECASE | re.DOTALL)
+FOREIGN_KEY_PATTERN = re.compile(
+    r'FOREIGN\s+KEY\s*\(([^)]*)\)\s*REFERENCES\s+[`"]?(\w+)[`"]?\s*(?:\(([^)]*)\))?',
+    re.IGNORECASE
+)
+PRIMARY_KEY_PATTERN = re.compile(r'PRIMARY\s+KEY\s*\(([^)]*)\)', re.IGNORECASE)
+UNIQUE_PATTERN = re.compile(r'^(?:CONSTRAINT\s+\S+\s+)?UNIQUE(?:\s+KEY)?(?:\s+[`"]?\w+[`"]?)?\s*\(([^)]*)\)', re.IGNORECASE)
+INLINE_REFERENCES_PATTERN = re.compile(r'\bREFERENCES\s+[`"]?(\w+)[`"]?\s*(?:\(([^)]*)\))?', re.IGNORECASE)
+# Keywords that end the type in a column definition
+COLUMN_CONSTRAINT_PATTERN = re.compile(
+    r'\s(?:NOT\s+NULL|NULL|PRIMARY\s+KEY|REFERENCES|DEFAULT|UNIQUE|CHECK|CONSTRAINT|GENERATED|COLLATE|'
+    r'AUTO_INCREMENT|AUTOINCREMENT|COMMENT)\b',
+    re.IGNORECASE
+)
+
+
+def split_top_level(text, separator=','):
+    """Splits `text` on `separator`, ignoring separators inside parentheses or quotes (e.g. NUMERIC(10,2))."""
+    parts = []
+    depth = 0
+    quote = None
+    current = []
+    for char in text:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"', '`'):
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(0, depth - 1)
+        elif char == separator and depth == 0:
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def split_create_tables(ddl_string):
+    """Returns {table_name: CREATE TABLE statement} for the tables of a DDL string, in order."""
+    return {match.group(1).lower(): match.group(0).strip() for match in TABLE_PATTERN.finditer(ddl_string)}
+
+
+def _column_list(text):
+    return [c.strip(' `"').lower() for c in split_top_level(text or '')]
+
+
+@instrumented('ddl.parse')
+def parse_ddl_to_schema(ddl_string):
+    """
+    Parses a SQL DDL string (CREATE TABLE) into a dictionary of table schemas.
+
+    Each column keeps its simplified 'type' (e.g. NUMERIC) and its full 'sql_type'
+    (e.g. NUMERIC(10,2)). Inline REFERENCES are added to the table constraints, and
+    CREATE INDEX statements (or inline INDEX/KEY definitions) are listed in 'indexes'.
+    """
+    schemas = {}
+    table_matches = TABLE_PATTERN.finditer(ddl_string)
+
+    for match in table_matches:
+        table_name = match.group(1).lower()
+        columns_part = match.group(2).strip()
+
+        schema = {'table_name': table_name, 'columns': [], 'constraints': [], 'indexes': []}
+        column_definitions = split_top_level(columns_part)
+
+        for col_def in column_definitions:
+            col_def_upper = col_def.upper()
+
+            if col_def_upper.startswith(('PRIMARY KEY', 'FOREIGN KEY', 'UNIQUE', 'CONSTRAINT', 'CHECK')):
+                schema['constraints'].append(col_def.strip())
+                continue
+
+            index_match = INLINE_INDEX_PATTERN.match(col_def)
+            if index_match:
+                schema['indexes'].append({
+                    'name': index_match.group(2).lower() or None,
+                    'unique': bool(index_match.group(1)),
+                    'method': None,
+                    'columns': index_match.group(3).strip(),
+                    'where': None
+                })
+                continue
+
+            col_def_parts = col_def.split(None, 1)
+            if len(col_def_parts) >= 2:
+                col_name = col_def_parts[0].strip('`"').lower()
+                definition = " " + col_def_parts[1]
+                constraint_match = COLUMN_CONSTRAINT_PATTERN.search(definition)
+                sql_type = definition[:constraint_match.start() if constraint_match else None].strip().upper()
+                if not sql_type:
+                    continue
+                col_type_simplified = re.sub(r'\(.*?\)', '', sql_type).split()[0]
+                is_nullable = 'NOT NULL' not in col_def_upper
+                is_primary_key = 'PRIMARY KEY' in col_def_upper
+
+                schema['columns'].append({
+                    'name': col_name,
+                    'type': col_type_simplified,
+                    'sql_type': sql_type,
+                    'nullable': is_nullable and not is_primary_key,
+                    'primary_key': is_primary_key,
+                    'unique': bool(re.search(r'\bUNIQUE\b', col_def_upper)) and not is_primary_key
+                })
+
+                references = INLINE_REFERENCES_PATTERN.search(col_def)
+                if references:
+                    ref_columns = f" ({references.group(2)})" if references.group(2) else ""
+                    schema['constraints'].append(
+                        f"FOREIGN KEY ({col_name}) REFERENCES {references.group(1).lower()}{ref_columns}"
+                    )
+
+        schemas[table_name] = schema
+
+    for match in INDEX_PATTERN.finditer(ddl_string):
+        table_name = match.group(3).lower()
+        if table_name in schemas:
+            schemas[table_name]['indexes'].append({
+                'name': (match.group(2) or '').lower() or None,
+                'unique': bool(match.group(1)),
+                'method': match.group(4).lower() if match.group(4) else None,
+                'columns': match.group(5).strip(),
+                'where': match.group(6).strip() if match.group(6) else None
+            })
+    return schemas
+
+
+def get_foreign_keys(schema):
+    """
+    Extracts the FOREIGN KEY constraints of a parsed table schema.
+    Returns a list of dicts with 'columns', 'ref_table' and 'ref_columns'.
+    """
+    foreign_keys = []
+    for constraint in schema['constraints']:
+        match = FOREIGN_KEY_PATTERN.search(constraint)
+        if not match:
+            continue
+        columns = _column_list(match.group(1))
+        ref_columns = _column_list(match.group(3))
+        foreign_keys.append({
+            'columns': columns,
+            'ref_table': match.group(2).lower(),
+            'ref_columns': ref_columns or columns
+        })
+    return foreign_keys
+
+
+def get_primary_key(schema):
+    """Returns the primary key columns of a parsed table schema (may be empty)."""
+    for constraint in schema['constraints']:
+        match = PRIMARY_KEY_PATTERN.search(constraint)
+        if match:
+            return _column_list(match.group(1))
+    return [c['name'] for c in schema['columns'] if c.get('primary_key')]
+
+
+def get_unique_keys(schema):
+    """Returns the column lists of the UNIQUE constraints of a parsed table schema."""
+    unique_keys = [[c['name']] for c in schema['columns'] if c.get('unique')]
+    for constraint in schema['constraints']:
+        match = UNIQUE_PATTERN.search(constraint)
+        if match:
+            unique_keys.append(_column_list(match.group(1)))
+    return unique_keys
+
+
+def build_table_dependencies(schemas):
+    """
+    Builds the dependency DAG of the schemas: each table maps to the set of
+    tables it references through FOREIGN KEY constraints (self-references and
+    tables outside the DDL are ignored).
+    """
+    dependencies = {}
+    for table_name, schema in schemas.items():
+        parents = {fk['ref_table'] for fk in get_foreign_keys(schema)}
+        dependencies[table_name] = {p for p in parents if p in schemas and p != table_name}
+    return dependencies
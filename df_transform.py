@@ -0,0 +1,370 @@
+# df_transform.py
+
+import ast
+import numpy as np
+import pandas as pd
+
+MAX_EXPRESSION_LENGTH = 500
+MAX_OPERATIONS = 20
+MAX_INSERT_ROWS = 1000
+# '**' only takes a constant exponent up to this size, and integer results are capped,
+# so a plan cannot hang or exhaust memory while it is dry-run or applied
+MAX_EXPONENT = 64
+MAX_INTEGER_BITS = 64
+
+PLAN_GRAMMAR = """
+Return ONLY a JSON object {"operations": [...]} where each operation is one of:
+  {"op": "update", "column": C, "value": EXPR, "where": EXPR?, "order_by": C?, "descending": BOOL?, "limit": INT?}
+  {"op": "delete", "where": EXPR?, "order_by": C?, "descending": BOOL?, "limit": INT?}
+  {"op": "add_column", "column": C, "value": EXPR}
+  {"op": "drop_column", "column": C}
+  {"op": "rename_column", "column": C, "new_name": NAME}
+  {"op": "insert", "rows": [{column: value, ...}, ...]}
+"where" selects the rows an operation applies to. With "order_by" and "limit", only the
+first `limit` selected rows in that order are affected (e.g. the 3 most expensive).
+
+EXPR is a single expression over the row's columns, evaluated for every row:
+  - columns by name (price) or col("column name") for names that are not identifiers
+  - literals: numbers, 'strings', True, False, None, lists like ['a', 'b']
+  - operators: + - * / // % ** (with a constant exponent), ==, !=, <, <=, >, >=, in, not in, and, or, not,
+    and conditional expressions: A if CONDITION else B
+  - functions: lower(x), upper(x), title(x), strip(x), length(x), concat(a, b, ...),
+    replace(x, old, new), contains(x, s), startswith(x, s), endswith(x, s),
+    round(x, digits), abs(x), floor(x), ceil(x), clip(x, low, high), coalesce(a, b),
+    is_null(x), not_null(x), to_number(x), to_date(x), year(x), month(x), day(x),
+    add_days(x, n), row_number()
+"""
+
+
+def _as_series(value, index):
+    if isinstance(value, pd.Series):
+        return value
+    return pd.Series([value] * len(index), index=index, dtype=object if value is None else None)
+
+
+def _str(value, index):
+    return _as_series(value, index).astype("string")
+
+
+class _ExpressionEvaluator:
+    """Evaluates a whitelisted expression AST against a DataFrame, one vectorized operation per node."""
+
+    BINARY_OPERATORS = {
+        ast.Add: lambda a, b: a + b,
+        ast.Sub: lambda a, b: a - b,
+        ast.Mult: lambda a, b: a * b,
+        ast.Div: lambda a, b: a / b,
+        ast.FloorDiv: lambda a, b: a // b,
+        ast.Mod: lambda a, b: a % b,
+        ast.Pow: lambda a, b: a ** b,
+    }
+    COMPARE_OPERATORS = {
+        ast.Eq: lambda a, b: a == b,
+        ast.NotEq: lambda a, b: a != b,
+        ast.Lt: lambda a, b: a < b,
+        ast.LtE: lambda a, b: a <= b,
+        ast.Gt: lambda a, b: a > b,
+        ast.GtE: lambda a, b: a >= b,
+    }
+
+    def __init__(self, df):
+        self.df = df
+        self.index = df.index
+        self.functions = {
+            'lower': lambda x: _str(x, self.index).str.lower(),
+            'upper': lambda x: _str(x, self.index).str.upper(),
+            'title': lambda x: _str(x, self.index).str.title(),
+            'strip': lambda x: _str(x, self.index).str.strip(),
+            'length': lambda x: _str(x, self.index).str.len(),
+            'concat': lambda *xs: self._concat(xs),
+            'replace': lambda x, old, new: _str(x, self.index).str.replace(str(old), str(new), regex=False),
+            'contains': lambda x, s: _str(x, self.index).str.contains(str(s), case=False, regex=False),
+            'startswith': lambda x, s: _str(x, self.index).str.startswith(str(s)),
+            'endswith': lambda x, s: _str(x, self.index).str.endswith(str(s)),
+            'round': lambda x, digits=0: self._number(x).round(int(digits)),
+            'abs': lambda x: self._number(x).abs(),
+            'floor': lambda x: np.floor(self._number(x)),
+            'ceil': lambda x: np.ceil(self._number(x)),
+            'clip': lambda x, low=None, high=None: self._number(x).clip(low, high),
+            'coalesce': lambda a, b: _as_series(a, self.index).where(_as_series(a, self.index).notna(), b),
+            'is_null': lambda x: _as_series(x, self.index).isna(),
+            'not_null': lambda x: _as_series(x, self.index).notna(),
+            'to_number': lambda x: self._number(x),
+            'to_date': lambda x: pd.to_datetime(_as_series(x, self.index), errors='coerce'),
+            'year': lambda x: self._date(x).dt.year,
+            'month': lambda x: self._date(x).dt.month,
+            'day': lambda x: self._date(x).dt.day,
+            'add_days': lambda x, n: self._date(x) + pd.to_timedelta(self._number(n), unit='D'),
+            'row_number': lambda: pd.Series(np.arange(1, len(self.index) + 1), index=self.index),
+            'col': self._column,
+        }
+
+    def evaluate(self, node):
+        method = getattr(self, f"_eval_{type(node).__name__}", None)
+        if method is None:
+            raise ValueError(f"'{type(node).__name__}' is not allowed in expressions.")
+        return method(node)
+
+    def _eval_Expression(self, node):
+        return self.evaluate(node.body)
+
+    def _eval_Constant(self, node):
+        if not isinstance(node.value, (int, float, str, bool, type(None))):
+            raise ValueError(f"Constant {node.value!r} is not allowed.")
+        return node.value
+
+    def _eval_List(self, node):
+        return [self.evaluate(e) for e in node.elts]
+
+    _eval_Tuple = _eval_List
+
+    def _eval_Name(self, node):
+        return self._column(node.id)
+
+    def _eval_BinOp(self, node):
+        operator = self.BINARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            raise ValueError(f"Operator '{type(node.op).__name__}' is not allowed.")
+        left, right = self.evaluate(node.left), self.evaluate(node.right)
+        if isinstance(node.op, ast.Add) and (self._is_text(left) or self._is_text(right)):
+            return self._concat((left, right))
+        if isinstance(node.op, ast.Pow):
+            self._check_power(left, right)
+        if isinstance(node.op, ast.Mult) and (self._is_sequence(left) or self._is_sequence(right)):
+            raise ValueError("Repeating text or lists with '*' is not allowed.")
+        try:
+            result = operator(left, right)
+        except (OverflowError, ZeroDivisionError) as e:
+            raise ValueError(f"Invalid arithmetic: {e}")
+        if isinstance(result, int) and result.bit_length() > MAX_INTEGER_BITS:
+            raise ValueError(f"Integer results are limited to {MAX_INTEGER_BITS} bits.")
+        return result
+
+    @staticmethod
+    def _check_power(base, exponent):
+        if isinstance(exponent, bool) or not isinstance(exponent, (int, float)) or abs(exponent) > MAX_EXPONENT:
+            raise ValueError(f"'**' needs a constant exponent between -{MAX_EXPONENT} and {MAX_EXPONENT}.")
+        if isinstance(base, int) and isinstance(exponent, int) and base.bit_length() * exponent > MAX_INTEGER_BITS:
+            raise ValueError(f"Integer results are limited to {MAX_INTEGER_BITS} bits.")
+
+    def _eval_UnaryOp(self, node):
+        operand = self.evaluate(node.operand)
+        if isinstance(node.op, ast.USub):
+            return -operand
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if isinstance(node.op, ast.Not):
+            return ~self._mask(operand) if isinstance(operand, pd.Series) else not operand
+        raise ValueError(f"Operator '{type(node.op).__name__}' is not allowed.")
+
+    def _eval_BoolOp(self, node):
+        masks = [self._mask(self.evaluate(v)) for v in node.values]
+        result = masks[0]
+        for mask in masks[1:]:
+            result = (result & mask) if isinstance(node.op, ast.And) else (result | mask)
+        return result
+
+    def _eval_Compare(self, node):
+        result = None
+        left = self.evaluate(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = self.evaluate(comparator)
+            if isinstance(op, (ast.In, ast.NotIn)):
+                if not isinstance(right, list):
+                    raise ValueError("'in' needs a list of values, e.g. x in ['a', 'b'].")
+                mask = _as_series(left, self.index).isin(right)
+                mask = ~mask if isinstance(op, ast.NotIn) else mask
+            else:
+                operator = self.COMPARE_OPERATORS.get(type(op))
+                if operator is None:
+                    raise ValueError(f"Comparison '{type(op).__name__}' is not allowed.")
+                mask = self._mask(operator(_as_series(left, self.index), right))
+            result = mask if result is None else result & mask
+            left = right
+        return result
+
+    def _eval_IfExp(self, node):
+        condition = self._mask(self.evaluate(node.test))
+        body = _as_series(self.evaluate(node.body), self.index)
+        orelse = _as_series(self.evaluate(node.orelse), self.index)
+        return body.where(condition, orelse)
+
+    def _eval_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in self.functions:
+            name = node.func.id if isinstance(node.func, ast.Name) else type(node.func).__name__
+            raise ValueError(f"Function '{name}' is not allowed.")
+        if node.keywords:
+            raise ValueError("Keyword arguments are not allowed in expressions.")
+        if node.func.id == 'col':
+            if len(node.args) != 1 or not isinstance(node.args[0], ast.Constant) or not isinstance(node.args[0].value, str):
+                raise ValueError("col() takes a single column name in quotes.")
+            return self._column(node.args[0].value)
+        args = [self.evaluate(a) for a in node.args]
+        try:
+            return self.functions[node.func.id](*args)
+        except TypeError as e:
+            raise ValueError(f"Invalid arguments for {node.func.id}(): {e}")
+
+    def _column(self, name):
+        if name not in self.df.columns:
+            raise ValueError(f"Unknown column '{name}'.")
+        return self.df[name]
+
+    def _number(self, value):
+        return pd.to_numeric(_as_series(value, self.index), errors='coerce')
+
+    def _date(self, value):
+        series = _as_series(value, self.index)
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return series
+        return pd.to_datetime(series, errors='coerce')
+
+    def _concat(self, values):
+        result = _str(values[0], self.index).fillna("")
+        for value in values[1:]:
+            result = result + _str(value, self.index).fillna("")
+        return result
+
+    @staticmethod
+    def _is_text(value):
+        if isinstance(value, str):
+            return True
+        return isinstance(value, pd.Series) and (pd.api.types.is_string_dtype(value) or value.dtype == object)
+
+    @staticmethod
+    def _is_sequence(value):
+        if isinstance(value, (str, list)):
+            return True
+        # The empty columns of the dry run cannot repeat anything (and have no known type)
+        return isinstance(value, pd.Series) and not value.empty and pd.api.types.is_string_dtype(value)
+
+    def _mask(self, value):
+        if isinstance(value, pd.Series):
+            return value.fillna(False).astype(bool)
+        return pd.Series(bool(value), index=self.index)
+
+
+def parse_expression(expression):
+    """Parses an expression of the plan grammar. Raises ValueError if it is not valid."""
+    if expression is None or isinstance(expression, (bool, int, float)):
+        text = repr(expression)
+    elif isinstance(expression, str):
+        text = expression
+    else:
+        raise ValueError(f"Expressions must be strings, got {type(expression).__name__}.")
+    if len(text) > MAX_EXPRESSION_LENGTH:
+        raise ValueError("Expression is too long.")
+    try:
+        return ast.parse(text, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid expression '{text}': {e.msg}")
+
+
+def evaluate_expression(df, expression):
+    """Evaluates an expression of the plan grammar against a DataFrame."""
+    return _ExpressionEvaluator(df).evaluate(parse_expression(expression))
+
+
+def _require(operation, *fields):
+    for field in fields:
+        if field not in operation:
+            raise ValueError(f"Operation '{operation.get('op')}' is missing '{field}'.")
+
+
+def validate_plan(plan, df):
+    """
+    Checks that a plan only uses known operations, columns and whitelisted expressions.
+    Expressions are dry-run against an empty frame with the same columns.
+    Returns the list of operations or raises ValueError.
+    """
+    if not isinstance(plan, dict) or not isinstance(plan.get('operations'), list):
+        raise ValueError("The plan must be an object with an 'operations' list.")
+    operations = plan['operations']
+    if not operations:
+        raise ValueError("The plan does not contain any operation.")
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError(f"The plan has more than {MAX_OPERATIONS} operations.")
+
+    probe = df.head(0).copy()
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise ValueError("Each operation must be an object.")
+        op = operation.get('op')
+        evaluator = _ExpressionEvaluator(probe)
+
+        if op in ('update', 'delete'):
+            if op == 'update':
+                _require(operation, 'column', 'value')
+                evaluator._column(operation['column'])
+                evaluator.evaluate(parse_expression(operation['value']))
+            if operation.get('where') is not None:
+                evaluator.evaluate(parse_expression(operation['where']))
+            if operation.get('order_by') is not None:
+                evaluator._column(operation['order_by'])
+            if operation.get('limit') is not None and (not isinstance(operation['limit'], int) or operation['limit'] < 0):
+                raise ValueError("'limit' must be a non-negative integer.")
+        elif op == 'add_column':
+            _require(operation, 'column', 'value')
+            evaluator.evaluate(parse_expression(operation['value']))
+            probe[operation['column']] = pd.Series(dtype=object)
+        elif op == 'drop_column':
+            _require(operation, 'column')
+            evaluator._column(operation['column'])
+            probe = probe.drop(columns=[operation['column']])
+        elif op == 'rename_column':
+            _require(operation, 'column', 'new_name')
+            evaluator._column(operation['column'])
+            probe = probe.rename(columns={operation['column']: str(operation['new_name'])})
+        elif op == 'insert':
+            _require(operation, 'rows')
+            rows = operation['rows']
+            if not isinstance(rows, list) or len(rows) > MAX_INSERT_ROWS or not all(isinstance(r, dict) for r in rows):
+                raise ValueError(f"'rows' must be a list of at most {MAX_INSERT_ROWS} objects.")
+            unknown = {c for r in rows for c in r} - set(probe.columns)
+            if unknown:
+                raise ValueError(f"Unknown column(s) in inserted rows: {', '.join(sorted(unknown))}.")
+        else:
+            raise ValueError(f"Unknown operation '{op}'.")
+    return operations
+
+
+def _selected_index(df, operation):
+    index = df.index
+    if operation.get('where') is not None:
+        index = index[evaluate_expression(df, operation['where']).to_numpy()]
+    if operation.get('order_by') is not None:
+        order = df.loc[index, operation['order_by']].sort_values(
+            ascending=not operation.get('descending', False), na_position='last', kind='stable'
+        )
+        index = order.index
+    if operation.get('limit') is not None:
+        index = index[:operation['limit']]
+    return index
+
+
+def apply_plan(df, plan):
+    """
+    Validates a transformation plan and applies it to a copy of the DataFrame.
+    Every operation runs vectorized over the whole frame, whatever its size.
+    """
+    operations = validate_plan(plan, df)
+    result = df.copy()
+
+    for operation in operations:
+        op = operation['op']
+        if op == 'update':
+            selected = result.index.isin(_selected_index(result, operation))
+            value = _as_series(evaluate_expression(result, operation['value']), result.index)
+            result[operation['column']] = result[operation['column']].where(~selected, value)
+        elif op == 'delete':
+            result = result.drop(index=_selected_index(result, operation))
+        elif op == 'add_column':
+            result[operation['column']] = _as_series(evaluate_expression(result, operation['value']), result.index)
+        elif op == 'drop_column':
+            result = result.drop(columns=[operation['column']])
+        elif op == 'rename_column':
+            result = result.rename(columns={operation['column']: str(operation['new_name'])})
+        elif op == 'insert' and operation['rows']:
+            result = pd.concat([result, pd.DataFrame(operation['rows'], columns=result.columns)], ignore_index=True)
+
+    return result.reset_index(drop=True)
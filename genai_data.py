@@ -1,130 +1,698 @@
-import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import pandas as pd
 import json
+import os
 import re
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import llm_setup
-import langfuse
+from json_stream import JsonArrayStreamDecoder, ColumnarRowBuffer
+from llm_cache import get_llm_cache, make_cache_key
+from df_transform import PLAN_GRAMMAR, apply_plan
+from ddl_parser import parse_ddl_to_schema, get_foreign_keys, get_primary_key, build_table_dependencies, split_create_tables
+from synthetic_sampler import SPEC_GRAMMAR, validate_table_spec, sample_table, table_seed
+from schema_index import prune_schema_ddl
+from sql_guard import validate_query
+from llm_scheduler import get_scheduler
+from instrumentation import stage, instrumented, current_stage, record_stage
+
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "4"))
+MAX_CONTEXT_KEYS = int(os.getenv("MAX_CONTEXT_KEYS", "100"))
+GENERATION_BATCH_RETRIES = int(os.getenv("GENERATION_BATCH_RETRIES", "2"))
+# Share of max_tokens a batch is sized to use, leaving room for estimation errors
+BATCH_TOKEN_HEADROOM = 0.7
+BATCH_SAMPLE_ROWS = 5
+# Seconds between progress callbacks and rows shown in the live preview
+PROGRESS_INTERVAL = 0.5
+PREVIEW_ROWS = 20
+# Output tokens assumed for the rate limiter when a call does not set max_output_tokens
+DEFAULT_OUTPUT_TOKENS_ESTIMATE = 1024
+# 'llm': every row is written by the model; 'hybrid': the model writes a per-column spec
+# and the rows are sampled locally
+GENERATION_MODE = os.getenv("GENERATION_MODE", "llm")
+
+# Quick Modifications: 'rows' (round-trip the table), 'plan' (local transformation plan) or 'auto'
+EDIT_MODE = os.getenv("EDIT_MODE", "auto")
+EDIT_ROWS_MAX_ROWS = int(os.getenv("EDIT_ROWS_MAX_ROWS", "200"))
+EDIT_PLAN_SAMPLE_ROWS = 5
+
+# Synthetic rows may legitimately look like anything (names, reviews...)
+GENERATION_SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
+
+# Follow-up turns allowed to fix a translated query that fails validation
+NL_TO_SQL_MAX_REPAIRS = int(os.getenv("NL_TO_SQL_MAX_REPAIRS", "2"))
+NL_TO_SQL_MODEL = 'gemini-2.5-flash'
+
+
+# Error of the tables left unfinished when a generation is cancelled
+GENERATION_CANCELLED = "Generation was cancelled."
+
+
+class MaxTokensError(ValueError):
+    """Raised when a response is cut off by the max_output_tokens limit."""
+
+
+def _parent_key_context(schema, generated_data):
+    """Lists the key values already generated for the parents of a table."""
+    lines = []
+    for fk in get_foreign_keys(schema):
+        parent_df = generated_data.get(fk['ref_table'])
+        if parent_df is None or 'Error' in parent_df.columns:
+            continue
+        for column, ref_column in zip(fk['columns'], fk['ref_columns']):
+            if ref_column not in parent_df.columns:
+                continue
+            values = parent_df[ref_column].dropna().unique()[:MAX_CONTEXT_KEYS].tolist()
+            if values:
+                lines.append(
+                    f"Column {column} must only take values that exist in {fk['ref_table']}.{ref_column}: "
+                    f"{json.dumps(values, default=str)}"
+                )
+    if not lines:
+        return ""
+    return "Foreign key values:\n        " + "\n        ".join(lines)
+
+
+def _sample_row(schema):
+    """Builds a placeholder row with typical value sizes, used to estimate tokens per row."""
+    row = {}
+    for column in schema['columns']:
+        col_type = column['type']
+        if any(t in col_type for t in ('INT', 'SERIAL')):
+            row[column['name']] = 123456
+        elif any(t in col_type for t in ('NUMERIC', 'DECIMAL', 'FLOAT', 'DOUBLE', 'REAL', 'MONEY')):
+            row[column['name']] = 12345.67
+        elif 'BOOL' in col_type:
+            row[column['name']] = True
+        elif 'TIMESTAMP' in col_type or 'DATETIME' in col_type:
+            row[column['name']] = "2024-01-01T12:00:00"
+        elif 'DATE' in col_type:
+            row[column['name']] = "2024-01-01"
+        else:
+            row[column['name']] = "Lorem ipsum dolor sit amet"
+    return row
+
+
+def _count_tokens(model_client, text):
+    """Counts the tokens of `text` with the API, through the scheduler like any other Gemini request."""
+    try:
+        result, _ = get_scheduler().execute(lambda: model_client.count_tokens(text), 'count_tokens')
+        return result.total_tokens
+    except Exception:
+        # Rough fallback of ~4 characters per token
+        return max(1, len(text) // 4)
+
+
+def _estimate_batch_size(model_client, rows, max_tokens):
+    """Returns how many rows fit in one response given the average tokens of `rows`."""
+    tokens_per_row = _count_tokens(model_client, json.dumps(rows, default=str)) / max(1, len(rows))
+    return max(1, int(max_tokens * BATCH_TOKEN_HEADROOM / max(1.0, tokens_per_row)))
+
+
+def _existing_keys_text(primary_key, seen_keys):
+    """Tells the model which primary key values are already taken."""
+    if not primary_key or not seen_keys:
+        return ""
+    if len(primary_key) == 1:
+        values = [key[0] for key in seen_keys]
+        if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+            return f"Primary key values {max(values)} and below are already used: {primary_key[0]} must be greater than {max(values)}."
+    sample = [list(key) if len(key) > 1 else key[0] for key in list(seen_keys)[-MAX_CONTEXT_KEYS:]]
+    return f"These primary key values ({', '.join(primary_key)}) are already used and must not be repeated: {json.dumps(sample, default=str)}"
+
+
+@instrumented('llm.call')
+def _invoke_model(call_site, model, prompt_text, config, system_instruction=None, safety_settings=None,
+                  on_text=None, use_cache=True, usage=None):
+    """
+    Calls Gemini through the response cache and the shared scheduler (rate limits,
+    retries, priority lanes, in-flight deduplication) and returns (text, finish_reason).
+
+    When on_text is given the response is streamed and each text chunk is passed to it
+    (a cache hit delivers the whole text in one chunk). Only complete ('STOP') responses
+    are cached. With use_cache=False the cache is not read, but the response is stored.
+    When a `usage` dict is given, it is filled with the token counts of the call.
+    """
+    llm_stage = current_stage()
+    llm_stage.record(call_site=call_site, model=model)
+    cache = get_llm_cache()
+    cache_key = None
+    if cache.enabled_for(call_site):
+        cache_key = make_cache_key(model, system_instruction, prompt_text, config, safety_settings)
+        cached = cache.get(cache_key, call_site) if use_cache else None
+        if cached is not None:
+            if on_text is not None:
+                on_text(cached['text'])
+            if usage is not None:
+                usage.update({'input': 0, 'output': 0, 'total': 0, 'cached': True})
+            llm_stage.record(bytes=len(cached['text']), cached=True, finish_reason=cached['finish_reason'])
+            return cached['text'], cached['finish_reason']
+
+    scheduler = get_scheduler()
+    estimated_tokens = (len(prompt_text) + len(system_instruction or '')) // 4 + (
+        getattr(config, 'max_output_tokens', None) or DEFAULT_OUTPUT_TOKENS_ESTIMATE
+    )
+    delivered = []
+
+    def call():
+        model_client = llm_setup.get_model(model, system_instruction)
+        start = time.perf_counter()
+        llm_response = model_client.generate_content(
+            contents=prompt_text,
+            generation_config=config,
+            safety_settings=safety_settings,
+            stream=on_text is not None
+        )
+
+        if on_text is None:
+            if not llm_response.candidates:
+                raise ValueError("The API response does not contain valid content. It may have been blocked for an unspecified reason.")
+            finish_reason = llm_response.candidates[0].finish_reason.name
+            text = llm_response.text
+        else:
+            parts = []
+            for chunk in llm_response:
+                try:
+                    chunk_text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. the final finish_reason chunk)
+                    continue
+                delivered.append(True)
+                on_text(chunk_text)
+                parts.append(chunk_text)
 
-def parse_ddl_to_schema(ddl_string):
+            if not llm_response.candidates:
+                raise ValueError("The API response does not contain valid content. It may have been blocked for an unspecified reason.")
+            finish_reason = llm_response.candidates[0].finish_reason.name
+            text = "".join(parts)
+
+        metadata = getattr(llm_response, 'usage_metadata', None)
+        call_usage = {
+            'input': getattr(metadata, 'prompt_token_count', 0) or 0,
+            'output': getattr(metadata, 'candidates_token_count', 0) or 0,
+            'total': getattr(metadata, 'total_token_count', 0) or 0,
+            'cached': False
+        }
+        if call_usage['total']:
+            scheduler.report_tokens(estimated_tokens, call_usage['total'])
+        llm_setup.record_timing('first_request_ms', time.perf_counter() - start)
+        return text, finish_reason, call_usage
+
+    # Identical requests already in flight share their response (same contract as the cache)
+    coalesce_key = None
+    if use_cache:
+        coalesce_key = cache_key or make_cache_key(model, system_instruction, prompt_text, config, safety_settings)
+    # A stream is not retried once part of it reached the caller
+    (text, finish_reason, call_usage), coalesced = scheduler.execute(
+        call, call_site, estimated_tokens, coalesce_key=coalesce_key, can_retry=lambda: not delivered
+    )
+    if coalesced:
+        if on_text is not None:
+            on_text(text)
+        call_usage = {'input': 0, 'output': 0, 'total': 0, 'cached': True}
+    if usage is not None:
+        usage.update(call_usage)
+    llm_stage.record(input_tokens=call_usage['input'], output_tokens=call_usage['output'], bytes=len(text),
+                     cached=call_usage['cached'], finish_reason=finish_reason)
+
+    if cache_key and finish_reason == "STOP" and not coalesced:
+        cache.put(cache_key, text, finish_reason)
+    return text, finish_reason
+
+
+def _stream_json_array(call_site, model, prompt_text, config, on_items, system_instruction=None, safety_settings=None,
+                       use_cache=True):
+    """
+    Streams a response that holds a JSON array and passes each batch of decoded
+    elements to on_items(items) as soon as they are complete.
+    Returns the finish reason of the response (e.g. 'STOP' or 'MAX_TOKENS').
+    """
+    decoder = JsonArrayStreamDecoder()
+    # Decoding is interleaved with the stream: its time is summed into one 'json.decode' stage
+    decoded = {'seconds': 0.0, 'rows': 0, 'bytes': 0}
+
+    def feed(text):
+        start = time.perf_counter()
+        items = decoder.feed(text)
+        decoded['seconds'] += time.perf_counter() - start
+        decoded['rows'] += len(items)
+        decoded['bytes'] += len(text)
+        if items:
+            on_items(items)
+
+    _, finish_reason = _invoke_model(
+        call_site, model, prompt_text, config,
+        system_instruction=system_instruction,
+        safety_settings=safety_settings,
+        on_text=feed,
+        use_cache=use_cache
+    )
+
+    if finish_reason == "STOP":
+        decoder.close()
+    record_stage('json.decode', decoded['seconds'], rows=decoded['rows'], bytes=decoded['bytes'])
+    return finish_reason
+
+
+def _stream_rows(model, table_name, schema, row_count, temp, extra_prompt, max_tokens, context_data, on_rows, use_cache=True):
     """
-    Parses a SQL DDL string (CREATE TABLE) into a dictionary of table schemas.
+    Streams one batch of rows from the model into on_rows(rows).
+    Raises ValueError on truncated or blocked responses; rows already streamed are kept.
     """
-    schemas = {}
-    table_pattern = re.compile(r'CREATE(?:\s+OR\s+REPLACE)?\s+TABLE\s+`?(\w+)`?\s*\((.*?)\);', re.IGNORECASE | re.DOTALL)
-    table_matches = table_pattern.finditer(ddl_string)
+    column_descriptions = [f"{c['name']} ({c.get('sql_type', c['type'])}, Nullable: {c['nullable']})" for c in schema['columns']]
+    constraints_text = "Constraints: " + "; ".join(schema['constraints'])
 
-    for match in table_matches:
-        table_name = match.group(1).lower()
-        columns_part = match.group(2).strip()
+    prompt_text = f"""
+    Generate {row_count} rows of realistic data for the table "{table_name}".
+    Schema:
+    Columns: {'; '.join(column_descriptions)}.
+    {constraints_text}.
+    {context_data}
+    
+    Additional Instructions: {extra_prompt}
+    
+    IMPORTANT: Return the data ONLY as a valid JSON array of objects, where keys match column names.
+    """
 
-        schema = {'table_name': table_name, 'columns': [], 'constraints': []}
-        column_definitions = [col.strip() for col in columns_part.split(',') if col.strip()]
+    config = llm_setup.generation_config(
+        temperature=temp,
+        max_output_tokens=max_tokens,
+        response_mime_type="application/json"
+    )
+
+    finish_reason = _stream_json_array(
+        'generate_data', model, prompt_text, config, on_rows,
+        safety_settings=GENERATION_SAFETY_SETTINGS,
+        use_cache=use_cache
+    )
 
-        for col_def in column_definitions:
-            col_def_upper = col_def.upper()
+    if finish_reason == "MAX_TOKENS":
+        raise MaxTokensError(f"The model reached the 'Max Tokens' limit ({max_tokens}) and could not complete the response. Please increase the limit in the interface.")
+    
+    if finish_reason == "SAFETY":
+        raise ValueError(f"The response for the table '{table_name}' was blocked by the API's safety filters.")
 
-            if col_def_upper.startswith(('PRIMARY KEY', 'FOREIGN KEY', 'UNIQUE', 'CONSTRAINT')):
-                schema['constraints'].append(col_def.strip())
+    if finish_reason != "STOP":
+        raise ValueError(f"Data generation stopped for an unexpected reason: {finish_reason}")
+
+
+def _row_key(row, primary_key):
+    key = tuple(row.get(c) for c in primary_key)
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        return json.dumps(key, default=str)
+
+
+def _generate_table_data(table_name, schema, num_rows, temp, model, extra_prompt, max_tokens, context_data="",
+                         existing_rows=None, buffer=None, cancel_event=None):
+    """
+    Generates the rows of a single table in batches sized to fit in `max_tokens`.
+
+    Responses are streamed and each row is decoded into `buffer` (a ColumnarRowBuffer)
+    as soon as it is complete, so a preview can be read while the table is generated.
+    Rows are deduplicated on the primary key. A failed batch is retried (halving its
+    size when the response is truncated) up to GENERATION_BATCH_RETRIES times.
+    Generation resumes from `existing_rows` when given. If a batch keeps failing, or
+    `cancel_event` is set, the rows generated so far are returned with the error in
+    df.attrs['generation_error']; with no rows at all an 'Error' DataFrame is returned.
+    """
+    buffer = buffer if buffer is not None else ColumnarRowBuffer()
+    primary_key = [c for c in get_primary_key(schema) if c]
+    seen_keys = set()
+
+    if existing_rows is not None and not existing_rows.empty and 'Error' not in existing_rows.columns:
+        if len(existing_rows) >= num_rows:
+            return existing_rows
+        for row in existing_rows.to_dict(orient='records'):
+            if primary_key:
+                seen_keys.add(_row_key(row, primary_key))
+            buffer.append(row)
+
+    batch_rows = []
+
+    def accept_rows(items):
+        for row in items:
+            if not isinstance(row, dict) or len(buffer) >= num_rows:
+                continue
+            if primary_key:
+                key = _row_key(row, primary_key)
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+            buffer.append(row)
+            if len(batch_rows) < BATCH_SAMPLE_ROWS:
+                batch_rows.append(row)
+
+    error_message = None
+    try:
+        model_client = llm_setup.get_model(model)
+        sample_rows = buffer.to_dataframe(limit=BATCH_SAMPLE_ROWS).to_dict(orient='records')
+        batch_size = _estimate_batch_size(model_client, sample_rows or [_sample_row(schema)], max_tokens)
+        sized_from_output = bool(sample_rows)
+        attempts = 0
+
+        while len(buffer) < num_rows:
+            if cancel_event is not None and cancel_event.is_set():
+                error_message = GENERATION_CANCELLED
+                break
+            row_count = min(batch_size, num_rows - len(buffer))
+            batch_context = "\n    ".join(t for t in (context_data, _existing_keys_text(primary_key, seen_keys)) if t)
+            batch_rows.clear()
+
+            try:
+                # Retries skip the cache so a bad response is not replayed
+                _stream_rows(model, table_name, schema, row_count, temp, extra_prompt, max_tokens, batch_context,
+                             accept_rows, use_cache=attempts == 0)
+            except MaxTokensError:
+                # Rows completed before the cut-off are kept; ask for fewer rows next time
+                if not batch_rows and (batch_size == 1 or attempts >= GENERATION_BATCH_RETRIES):
+                    raise
+                attempts = 0 if batch_rows else attempts + 1
+                batch_size = max(1, batch_size // 2)
+                continue
+            except (ValueError, json.JSONDecodeError):
+                if attempts >= GENERATION_BATCH_RETRIES:
+                    raise
+                attempts += 1
                 continue
 
-            col_def_parts = col_def.split()
-            if len(col_def_parts) >= 2:
-                col_name = col_def_parts[0].strip('`"').lower()
-                col_type = col_def_parts[1].strip(',').upper()
-                col_type_simplified = re.sub(r'\(.*\)', '', col_type).split()[0]
-                is_nullable = 'NOT NULL' not in col_def_upper
+            if not batch_rows:
+                if attempts >= GENERATION_BATCH_RETRIES:
+                    raise ValueError(f"The model kept returning duplicated rows for the table '{table_name}'.")
+                attempts += 1
+                continue
 
-                schema['columns'].append({
-                    'name': col_name,
-                    'type': col_type_simplified,
-                    'nullable': is_nullable
-                })
+            attempts = 0
+            if not sized_from_output:
+                batch_size = _estimate_batch_size(model_client, batch_rows, max_tokens)
+                sized_from_output = True
 
-        schemas[table_name] = schema
-    return schemas
+    except (ValueError, json.JSONDecodeError) as e:
+        error_message = str(e)
+    
+    except Exception as e:
+        error_message = f"Unexpected API failure for {table_name}: {e}"
 
+    if error_message and not len(buffer):
+        return pd.DataFrame({'Error': [error_message]})
 
-def generate_multi_table_data(schemas, num_rows=5, temp=0.5, model='gemini-2.5-flash', extra_prompt="", max_tokens=2048):
-    generated_data = {}
-    for table_name, schema in schemas.items():
-        column_descriptions = [f"{c['name']} ({c['type']}, Nullable: {c['nullable']})" for c in schema['columns']]
-        constraints_text = "Constraints: " + "; ".join(schema['constraints'])
-        context_data = ""
-
-        prompt_text = f"""
-        Generate {num_rows} rows of realistic data for the table "{table_name}".
-        Schema:
-        Columns: {'; '.join(column_descriptions)}.
-        {constraints_text}.
-        {context_data}
-        
-        Additional Instructions: {extra_prompt}
-        
-        IMPORTANT: Return the data ONLY as a valid JSON array of objects, where keys match column names.
-        """
-        
-        llm_response = None
-        llm_output_text = ""
-        
-        try:
-            model_client = genai.GenerativeModel(model)
-            config = genai.types.GenerationConfig(
-                temperature=temp,
-                max_output_tokens=max_tokens,
-                response_mime_type="application/json"
-            )
+    df = buffer.to_dataframe()
+    if error_message:
+        df.attrs['generation_error'] = error_message
+    return df
+
+
+def _generate_table_spec(table_name, schema, temp, model, extra_prompt, max_tokens):
+    """Asks the model for the per-column generation spec of a table (see synthetic_sampler.SPEC_GRAMMAR)."""
+    column_descriptions = [
+        f"{c['name']} ({c.get('sql_type', c['type'])}, Nullable: {c['nullable']}{', Primary key' if c.get('primary_key') else ''})"
+        for c in schema['columns']
+    ]
+    constraints_text = "Constraints: " + "; ".join(schema['constraints'])
 
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    prompt_text = f"""
+    Describe how to generate realistic data for the table "{table_name}".
+    Schema:
+    Columns: {'; '.join(column_descriptions)}.
+    {constraints_text}.
+
+    Additional Instructions: {extra_prompt}
+    {SPEC_GRAMMAR}
+    """
+
+    config = llm_setup.generation_config(
+        temperature=temp,
+        max_output_tokens=max(max_tokens, 8192),
+        response_mime_type="application/json"
+    )
+
+    llm_output_text, finish_reason = _invoke_model('generate_spec', model, prompt_text, config)
+    if finish_reason == "MAX_TOKENS":
+        raise MaxTokensError(f"The generation spec for the table '{table_name}' was cut off by the 'Max Tokens' limit.")
+    if finish_reason != "STOP":
+        raise ValueError(f"Spec generation for the table '{table_name}' stopped for an unexpected reason: {finish_reason}")
+
+    json_match = re.search(r'\{.*\}', llm_output_text, re.DOTALL)
+    if not json_match:
+        raise json.JSONDecodeError("The LLM response did not contain a valid generation spec.", llm_output_text, 0)
+    return json.loads(json_match.group(0))
+
+
+def _sample_table_data(table_name, schema, num_rows, temp, model, extra_prompt, max_tokens, parent_data, seed=None):
+    """
+    Hybrid generation: one model call describes each column (distribution, vocabulary,
+    ranges, null rate) and the rows are then sampled locally with NumPy. Foreign key
+    columns take values from the already generated parent tables in `parent_data`.
+    The sampled rows are reproducible for a given seed (and a cached spec).
+    """
+    try:
+        spec = _generate_table_spec(table_name, schema, temp, model, extra_prompt, max_tokens)
+        foreign_keys = [fk for fk in get_foreign_keys(schema) if fk['ref_table'] in parent_data]
+        fk_columns = {c for fk in foreign_keys for c in fk['columns']}
+        column_specs, warnings = validate_table_spec(spec, schema, fk_columns)
+        with stage('generate.sample', table=table_name, rows=num_rows):
+            df = sample_table(schema, column_specs, num_rows, table_seed(seed, table_name), foreign_keys, parent_data)
+        primary_key = [c for c in get_primary_key(schema) if c in df.columns]
+        if primary_key and fk_columns & set(primary_key):
+            # Keys drawn from parent tables (e.g. in join tables) may repeat
+            df = df.drop_duplicates(subset=primary_key, ignore_index=True)
+        if warnings:
+            df.attrs['spec_warnings'] = warnings
+        return df
+
+    except (ValueError, json.JSONDecodeError) as e:
+        return pd.DataFrame({'Error': [str(e)]})
+
+    except Exception as e:
+        return pd.DataFrame({'Error': [f"Unexpected API failure for {table_name}: {e}"]})
+
+
+def _timed_generation(generate, table_name, *args):
+    start = time.perf_counter()
+    with stage('generate.table', table=table_name) as table_stage:
+        df = generate(table_name, *args)
+        if 'Error' in df.columns:
+            table_stage.fail(df['Error'].iloc[0])
+        else:
+            table_stage.record(rows=len(df))
+    return df, time.perf_counter() - start
+
+
+@instrumented('generate')
+def generate_multi_table_data(schemas, num_rows=5, temp=0.5, model='gemini-2.5-flash', extra_prompt="", max_tokens=2048,
+                              max_concurrency=GENERATION_MAX_CONCURRENCY, on_table_done=None, generation_stats=None,
+                              resume_from=None, on_progress=None, mode=GENERATION_MODE, seed=None, cancel_event=None):
+    """
+    Generates data for every table, running independent tables concurrently.
+
+    Tables are scheduled following the FOREIGN KEY dependencies: a child table starts
+    as soon as all of its parents have finished, and receives the parents' key values
+    in its prompt. At most `max_concurrency` tables are generated at the same time.
+    A failed table is returned as an 'Error' DataFrame without stopping the others.
+    Each table is requested in batches, so `num_rows` is not bound by `max_tokens`.
+
+    Args:
+        resume_from (dict): Optional {table_name: DataFrame} of rows from an interrupted
+            run. Only the missing rows are generated; complete tables are kept as-is.
+        on_table_done (callable): Optional callback(table_name, df, seconds), called from
+            the calling thread as each table finishes.
+        generation_stats (dict): Optional dict filled with the per-table 'seconds',
+            'rows' and 'error' of the run.
+        on_progress (callable): Optional callback(table_name, rows_done, preview_df), called
+            from the calling thread while rows stream in, with the first PREVIEW_ROWS rows.
+        mode (str): 'llm' to have the model write every row, or 'hybrid' to ask it once per
+            table for a column spec and sample the rows locally (fast for large num_rows).
+        seed (int): Optional seed of the hybrid sampler, for reproducible data.
+        cancel_event (threading.Event): Optional event that cancels the run when set: no
+            other table is started, tables generated by the LLM stop after their current
+            batch, and the unfinished tables end with the GENERATION_CANCELLED error.
+    """
+    if mode not in ('llm', 'hybrid'):
+        raise ValueError(f"Unknown generation mode '{mode}'.")
+    generate_stage = current_stage()
+    generate_stage.record(tables=len(schemas), rows_per_table=num_rows, mode=mode)
+    resume_from = resume_from or {}
+    pending = build_table_dependencies(schemas)
+    generated_data = {}
+    running = {}
+    buffers = {}
+    reported_rows = {}
+
+    def finish(table_name, df, seconds):
+        generated_data[table_name] = df
+        generate_stage.record(rows=0 if 'Error' in df.columns else len(df))
+        if generation_stats is not None:
+            failed = 'Error' in df.columns
+            generation_stats[table_name] = {
+                'seconds': round(seconds, 3),
+                'rows': 0 if failed else len(df),
+                'error': df['Error'].iloc[0] if failed else df.attrs.get('generation_error')
             }
+        if on_table_done is not None:
+            on_table_done(table_name, df, seconds)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        while pending or running:
+            if cancel_event is not None and cancel_event.is_set():
+                for table_name in list(pending):
+                    del pending[table_name]
+                    finish(table_name, pd.DataFrame({'Error': [GENERATION_CANCELLED]}), 0.0)
+                if not running:
+                    break
+
+            ready = [t for t, parents in pending.items() if parents <= generated_data.keys()]
+            if pending and not ready and not running:
+                # Circular references: unblock the table with the fewest missing parents
+                ready = [min(pending, key=lambda t: len(pending[t] - generated_data.keys()))]
+
+            for table_name in ready:
+                del pending[table_name]
+                schema = schemas[table_name]
+                buffers[table_name] = ColumnarRowBuffer()
+                existing_rows = resume_from.get(table_name)
+                if existing_rows is not None and 'Error' not in existing_rows.columns and len(existing_rows) >= num_rows:
+                    # Complete tables of an interrupted run are kept as-is, in both modes
+                    future = executor.submit(contextvars.copy_context().run, _timed_generation,
+                                             lambda table_name, df: df, table_name, existing_rows)
+                elif mode == 'hybrid':
+                    # Sampling is deterministic per seed, so interrupted tables are simply redone
+                    # Each worker runs in a copy of the caller's context, so its stages nest under 'generate'
+                    future = executor.submit(
+                        contextvars.copy_context().run, _timed_generation, _sample_table_data, table_name, schema, num_rows, temp, model, extra_prompt,
+                        max_tokens, dict(generated_data), seed
+                    )
+                else:
+                    context_data = _parent_key_context(schema, generated_data)
+                    future = executor.submit(
+                        contextvars.copy_context().run, _timed_generation, _generate_table_data, table_name, schema, num_rows, temp, model, extra_prompt,
+                        max_tokens, context_data, existing_rows, buffers[table_name], cancel_event
+                    )
+                running[future] = table_name
+
+            timeout = PROGRESS_INTERVAL if on_progress is not None or cancel_event is not None else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if on_progress is not None:
+                for table_name in running.values():
+                    rows_done = len(buffers[table_name])
+                    if rows_done != reported_rows.get(table_name, 0):
+                        reported_rows[table_name] = rows_done
+                        on_progress(table_name, rows_done, buffers[table_name].to_dataframe(limit=PREVIEW_ROWS))
+
+            for future in done:
+                table_name = running.pop(future)
+                del buffers[table_name]
+                try:
+                    df, seconds = future.result()
+                except Exception as e:
+                    df, seconds = pd.DataFrame({'Error': [f"Unexpected API failure for {table_name}: {e}"]}), 0.0
+                finish(table_name, df, seconds)
+
+    return {table_name: generated_data[table_name] for table_name in schemas}
+
+
+def _clean_sql(llm_output_text):
+    sql_query = llm_output_text.strip()
+    if sql_query.startswith('```sql'):
+        sql_query = sql_query.strip('```sql').strip('```').strip()
+    return sql_query
+
+
+def _sql_generation(parent, name, call_site, prompt_text, config, system_instruction, trace_input):
+    """
+    Runs one NL-to-SQL model call as a Langfuse generation of `parent`, recording its
+    latency and token usage. Returns the cleaned SQL.
+    """
+    generation = parent.generation(name=name, model=NL_TO_SQL_MODEL, input=trace_input)
+    usage = {}
+    start = time.perf_counter()
+    try:
+        llm_output_text, _ = _invoke_model(
+            call_site, NL_TO_SQL_MODEL, prompt_text, config,
+            system_instruction=system_instruction, usage=usage
+        )
+    except Exception as e:
+        generation.end(level="ERROR", status_message=str(e),
+                       metadata={"latency_ms": round(1000 * (time.perf_counter() - start), 1)})
+        raise
+    sql_query = _clean_sql(llm_output_text)
+    generation.end(
+        output=sql_query,
+        usage={"input": usage.get('input', 0), "output": usage.get('output', 0), "total": usage.get('total', 0)},
+        metadata={"latency_ms": round(1000 * (time.perf_counter() - start), 1), "cached": usage.get('cached', False)}
+    )
+    return sql_query
 
-            llm_response = model_client.generate_content(
-                contents=prompt_text,
-                generation_config=config,
-                safety_settings=safety_settings
-            )
 
-            if not llm_response.candidates:
-                raise ValueError("The API response does not contain valid content. It may have been blocked for an unspecified reason.")
+def _relevant_ddl(sql_query, schema_ddl):
+    """Returns the DDL of the tables named in the query (all of it when none is recognized)."""
+    statements = split_create_tables(schema_ddl)
+    words = set(re.findall(r'\w+', sql_query.lower()))
+    relevant = [statement for table, statement in statements.items() if table in words]
+    return "\n\n".join(relevant) if relevant else schema_ddl
 
-            finish_reason = llm_response.candidates[0].finish_reason.name
 
-            if finish_reason == "MAX_TOKENS":
-                error_message = f"The model reached the 'Max Tokens' limit ({max_tokens}) and could not complete the response. Please increase the limit in the interface."
-                raise ValueError(error_message)
-            
-            if finish_reason == "SAFETY":
-                error_message = f"The response for the table '{table_name}' was blocked by the API's safety filters."
-                raise ValueError(error_message)
-
-            if finish_reason != "STOP":
-                error_message = f"Data generation stopped for an unexpected reason: {finish_reason}"
-                raise ValueError(error_message)
-            
-            llm_output_text = llm_response.text
-            
-            json_match = re.search(r'\[.*\]', llm_output_text, re.DOTALL)
-            if not json_match:
-                raise json.JSONDecodeError("A valid JSON array was not found in the response.", llm_output_text, 0)
-
-            json_string = json_match.group(0)
-            df = pd.DataFrame(json.loads(json_string))
-            generated_data[table_name] = df
-
-        except (ValueError, json.JSONDecodeError) as e:
-            generated_data[table_name] = pd.DataFrame({'Error': [str(e)]})
-        
-        except Exception as e:
-            generated_data[table_name] = pd.DataFrame({'Error': [f"Unexpected API failure for {table_name}: {e}"]})
+def _validate_and_repair_sql(trace, natural_language_question, sql_query, schema_ddl, config, max_repairs):
+    """
+    Validates the query with EXPLAIN (through sql_guard, without running it) and, while
+    it fails, asks the model to fix it in a short follow-up turn holding only the
+    failing SQL, the error and the DDL of the tables involved. Returns the last query
+    (still invalid if the attempts ran out, so the error is reported when it runs).
+    """
+    table_names = ", ".join(split_create_tables(schema_ddl))
+    repair_instruction = f"""
+    You fix PostgreSQL SELECT queries. You get a question, a query written for it, the error the
+    database reported and the DDL of the tables involved. All tables: {table_names}.
+    The only output must be the corrected SQL query. Do not include explanations, code blocks, or comments.
+    """
+
+    for attempt in range(max_repairs + 1):
+        span = trace.span(name=f"SQL-Validation-{attempt + 1}", input={"sql": sql_query})
+        start = time.perf_counter()
+        try:
+            with stage('sql.validate', attempt=attempt + 1) as validate_stage:
+                problems = validate_query(sql_query)
+                validate_stage.record(problems=len(problems))
+        except ConnectionError as e:
+            # The database is unreachable: the query runs (and fails) as is
+            span.end(level="WARNING", status_message=str(e))
+            return sql_query
+        span.end(output={"problems": problems},
+                 metadata={"latency_ms": round(1000 * (time.perf_counter() - start), 1)},
+                 level="WARNING" if problems else "DEFAULT")
+        if not problems or attempt == max_repairs:
+            return sql_query
 
-    return generated_data
+        prompt_text = (
+            f"Question: {natural_language_question}\n\n"
+            f"Query:\n{sql_query}\n\n"
+            f"Error: {'; '.join(problems)}\n\n"
+            f"DDL:\n{_relevant_ddl(sql_query, schema_ddl)}"
+        )
+        try:
+            sql_query = _sql_generation(
+                trace, f"Gemini-SQL-Repair-{attempt + 1}", 'nl_to_sql_repair', prompt_text, config,
+                repair_instruction, {"sql": sql_query, "error": problems}
+            )
+        except Exception:
+            return sql_query
+    return sql_query
 
 
-def nl_to_sql(natural_language_question, schema_ddl, temp=0.0):
+# Writes its own Langfuse trace (with the prompts), so its stage is not exported again
+@instrumented('nl_to_sql', export=False)
+def nl_to_sql(natural_language_question, schema_ddl, temp=0.0, max_repairs=NL_TO_SQL_MAX_REPAIRS):
+    # On large schemas only the tables relevant to the question (and their join paths) are sent
+    with stage('schema.prune'):
+        schema_ddl = prune_schema_ddl(natural_language_question, schema_ddl)
     system_prompt = f"""
     You are an expert Natural Language to SQL translator. Your only task is to translate the user's
     question into a valid SQL query based strictly on the following DDL schema:
@@ -140,52 +708,114 @@ def nl_to_sql(natural_language_question, schema_ddl, temp=0.0):
 
     prompt_text = f"User question: {natural_language_question}"
 
-    if llm_setup.langfuse_client is None:
+    langfuse_client = llm_setup.get_langfuse_client()
+    if langfuse_client is None:
         raise ValueError("Langfuse is not initialized. Check your environment variables.")
 
-    trace = llm_setup.langfuse_client.trace(name="NL-to-SQL-Trace")
+    trace = langfuse_client.trace(name="NL-to-SQL-Trace")
 
     span = trace.span(
         name="Gemini-SQL-Call",
         input={"question": natural_language_question, "schema": schema_ddl}
     )
 
+    nl_stage = current_stage()
+    config = llm_setup.generation_config(
+        temperature=temp,
+    )
+
+    # The span is ended exactly once, whichever way the translation goes
     try:
-        model_client = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            system_instruction=system_prompt
+        sql_query = _sql_generation(
+            span, "Gemini-SQL-Translation", 'nl_to_sql', prompt_text, config, system_prompt,
+            {"question": natural_language_question}
         )
+    except Exception as e:
+        span.end(output={"error": str(e)}, level="ERROR", status_message=str(e))
+        nl_stage.fail(e)
+        return f"Error: Could not generate SQL. {e}"
 
-        config = genai.types.GenerationConfig(
-            temperature=temp,
-        )
+    if not sql_query.upper().startswith("SELECT"):
+        span.end(output={"sql": sql_query}, level="ERROR", status_message="No SELECT statement")
+        nl_stage.fail("No SELECT statement")
+        return "Error: The LLM response does not appear to be a SELECT command..."
+    span.end(output={"sql": sql_query})
 
-        llm_response = model_client.generate_content(
-            contents=prompt_text,
-            generation_config=config
-        )
+    try:
+        # Failed validations are repaired with short follow-up turns instead of a new full translation
+        return _validate_and_repair_sql(trace, natural_language_question, sql_query, schema_ddl, config, max_repairs)
+    except Exception as e:
+        nl_stage.fail(e)
+        return f"Error: Could not generate SQL. {e}"
 
-        sql_query = llm_response.text.strip()
-        if sql_query.startswith('```sql'):
-            sql_query = sql_query.strip('```sql').strip('```').strip()
-        span.end(output={"sql": sql_query})
 
-        if sql_query.upper().startswith("SELECT"):
-            return sql_query
-        else:
-            span.end(status="ERROR", output={"reason": "No SELECT statement"}, level="ERROR")
-            return "Error: The LLM response does not appear to be a SELECT command..."
+def generate_edit_plan(dataframe, instructions):
+    """
+    Asks the LLM to compile natural language editing instructions into a transformation
+    plan (see df_transform.PLAN_GRAMMAR). Only the column types and a few sample rows are
+    sent, so the cost does not depend on the size of the table.
+    """
+    column_descriptions = [f"{name} ({dtype})" for name, dtype in dataframe.dtypes.astype(str).items()]
+    sample_json = dataframe.head(EDIT_PLAN_SAMPLE_ROWS).to_json(orient='records', date_format='iso')
 
-    except Exception as e:
-        span.end(status="ERROR", output={"error": str(e)}, level="ERROR")
-        return f"Error: Could not generate SQL. {e}"
+    system_prompt = f"""
+    Your only task is to translate a data editing instruction into a transformation plan
+    that will be applied to every row of a table.
+    {PLAN_GRAMMAR}
+    Do not add explanations, comments, or additional text. The output must be valid JSON.
+    """
 
+    prompt_text = f"""
+    Table with {len(dataframe)} rows.
+    Columns: {'; '.join(column_descriptions)}.
+    Sample rows: {sample_json}
 
-def edit_dataframe_with_prompt(dataframe, instructions):
+    User instruction:
+    "{instructions}"
+
+    Transformation plan:
+    """
+
+    config = llm_setup.generation_config(
+        temperature=0.0,
+        response_mime_type="application/json"
+    )
+
+    llm_output_text, finish_reason = _invoke_model(
+        'edit_plan', 'gemini-2.5-flash', prompt_text, config,
+        system_instruction=system_prompt
+    )
+    if finish_reason != "STOP":
+        raise ValueError(f"The transformation plan is incomplete ({finish_reason}).")
+
+    json_match = re.search(r'\{.*\}', llm_output_text, re.DOTALL)
+    if not json_match:
+        raise json.JSONDecodeError("The LLM response did not contain a valid plan.", llm_output_text, 0)
+    return json.loads(json_match.group(0))
+
+
+@instrumented('edit')
+def edit_dataframe_with_prompt(dataframe, instructions, mode=EDIT_MODE):
     """
     Takes a DataFrame and natural language instructions, and uses an LLM
     to return a new DataFrame with the modifications applied.
+
+    Modes:
+        'rows': the whole table is sent to the model, which returns it modified.
+        'plan': the model returns a validated transformation plan that is executed
+            locally and vectorized over the whole table (see df_transform).
+        'auto': 'rows' for tables of up to EDIT_ROWS_MAX_ROWS rows, 'plan' otherwise.
     """
+    if mode == 'auto':
+        mode = 'rows' if len(dataframe) <= EDIT_ROWS_MAX_ROWS else 'plan'
+
+    if mode == 'plan':
+        try:
+            plan = generate_edit_plan(dataframe, instructions)
+            return apply_plan(dataframe, plan)
+        except Exception as e:
+            return pd.DataFrame({'Error': [f"Could not modify with AI: {e}"]})
+
     try:
         data_json = dataframe.to_json(orient='records')
     except Exception as e:
@@ -208,27 +838,23 @@ def edit_dataframe_with_prompt(dataframe, instructions):
     """
 
     try:
-        model_client = genai.GenerativeModel('gemini-2.5-flash', system_instruction=system_prompt)
-        config = genai.types.GenerationConfig(
+        config = llm_setup.generation_config(
             temperature=0.2,
             response_mime_type="application/json"
         )
 
-        llm_response = model_client.generate_content(
-            contents=prompt_text,
-            generation_config=config
+        buffer = ColumnarRowBuffer()
+        finish_reason = _stream_json_array(
+            'edit_data', 'gemini-2.5-flash', prompt_text, config,
+            lambda items: buffer.extend(row for row in items if isinstance(row, dict)),
+            system_instruction=system_prompt
         )
 
-        llm_output_text = llm_response.text.strip()
-        
-        json_match = re.search(r'\[.*\]', llm_output_text, re.DOTALL)
-        
-        if json_match:
-            json_string = json_match.group(0)
-            modified_data = json.loads(json_string)
-            return pd.DataFrame(modified_data)
-        else:
-            raise json.JSONDecodeError("The LLM response did not contain valid JSON.", llm_output_text, 0)
+        # A truncated response would silently drop rows from the table
+        if finish_reason != "STOP":
+            raise ValueError(f"The response stopped before the whole table was returned ({finish_reason}).")
+
+        return buffer.to_dataframe()
 
     except Exception as e:
         return pd.DataFrame({'Error': [f"Could not modify with AI: {e}"]})
\ No newline at end of file
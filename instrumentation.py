@@ -0,0 +1,445 @@
+# instrumentation.py
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import tempfile
+import threading
+import contextvars
+from collections import deque, Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+INSTRUMENTATION_ENABLED = os.getenv("INSTRUMENTATION_ENABLED", "true").lower() in ("1", "true", "yes")
+# Export the stage trees to Langfuse (when its LANGFUSE_* variables are set)
+INSTRUMENTATION_LANGFUSE = os.getenv("INSTRUMENTATION_LANGFUSE", "true").lower() in ("1", "true", "yes")
+INSTRUMENTATION_FLUSH_SECONDS = float(os.getenv("INSTRUMENTATION_FLUSH_SECONDS", "5"))
+# Stage trees waiting for export; new ones are dropped (and counted) when it is full
+INSTRUMENTATION_QUEUE_SIZE = int(os.getenv("INSTRUMENTATION_QUEUE_SIZE", "1000"))
+# In-process metrics endpoint (/metrics in Prometheus text format, /metrics.json); 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# "Diagnostics" expander in the app sidebar
+DIAGNOSTICS_PANEL_ENABLED = os.getenv("DIAGNOSTICS_PANEL_ENABLED", "true").lower() in ("1", "true", "yes")
+# Stages run under the sampling profiler, e.g. "generate,db.load"
+PROFILE_STAGES = {s.strip() for s in os.getenv("PROFILE_STAGES", "").split(",") if s.strip()}
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "profiles"))
+# Durations kept per stage for the percentiles
+STAGE_SAMPLES = 1000
+EXPORT_BATCH_SIZE = 50
+PROFILE_MAX_DEPTH = 64
+
+_current_stage = contextvars.ContextVar('instrumentation_stage', default=None)
+
+
+class Stage:
+    """
+    One timed step of the pipeline (e.g. 'llm.call' or 'db.copy'), with the rows,
+    bytes and tokens it handled and its error. Stages started while another one is
+    active (in the same context) become its children.
+    """
+
+    __slots__ = ('name', 'attrs', 'parent', 'children', 'started_at', 'seconds', 'rows', 'bytes',
+                 'input_tokens', 'output_tokens', 'error', 'export', '_start')
+
+    def __init__(self, name, attrs=None, parent=None, export=True):
+        self.name = name
+        self.attrs = attrs or {}
+        self.parent = parent
+        self.children = []
+        self.started_at = datetime.now(timezone.utc)
+        self.seconds = None
+        self.rows = 0
+        self.bytes = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.error = None
+        self.export = export
+        self._start = time.perf_counter()
+
+    def record(self, rows=0, bytes=0, input_tokens=0, output_tokens=0, **attrs):
+        """Adds to the counters of the stage and sets attributes (e.g. table='orders')."""
+        self.rows += int(rows or 0)
+        self.bytes += int(bytes or 0)
+        self.input_tokens += int(input_tokens or 0)
+        self.output_tokens += int(output_tokens or 0)
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        """Marks the stage as failed, for errors returned rather than raised."""
+        self.error = str(error)
+
+
+class _NullStage:
+    """Stands in for a Stage when instrumentation is disabled."""
+
+    def record(self, *args, **kwargs):
+        pass
+
+    def fail(self, error):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class MetricsRegistry:
+    """Per-stage counters and recent durations (for p50/p95), shared by the process."""
+
+    def __init__(self, samples=STAGE_SAMPLES):
+        self._lock = threading.Lock()
+        self._samples = samples
+        self._stages = {}
+
+    def observe(self, stage):
+        with self._lock:
+            metrics = self._stages.get(stage.name)
+            if metrics is None:
+                metrics = self._stages[stage.name] = {
+                    'count': 0, 'errors': 0, 'seconds_total': 0.0, 'rows': 0, 'bytes': 0,
+                    'input_tokens': 0, 'output_tokens': 0, 'durations': deque(maxlen=self._samples),
+                }
+            metrics['count'] += 1
+            metrics['errors'] += stage.error is not None
+            metrics['seconds_total'] += stage.seconds
+            metrics['rows'] += stage.rows
+            metrics['bytes'] += stage.bytes
+            metrics['input_tokens'] += stage.input_tokens
+            metrics['output_tokens'] += stage.output_tokens
+            metrics['durations'].append(stage.seconds)
+
+    def snapshot(self):
+        """Returns {stage: {'count', 'errors', 'p50_ms', 'p95_ms', 'max_ms', 'seconds_total', 'rows', ...}}."""
+        with self._lock:
+            stages = {name: dict(metrics, durations=sorted(metrics['durations'])) for name, metrics in self._stages.items()}
+        snapshot = {}
+        for name, metrics in sorted(stages.items()):
+            durations = metrics.pop('durations')
+            metrics['seconds_total'] = round(metrics['seconds_total'], 4)
+            metrics['p50_ms'] = round(1000 * durations[len(durations) // 2], 2) if durations else 0.0
+            metrics['p95_ms'] = round(1000 * durations[min(len(durations) - 1, int(len(durations) * 0.95))], 2) if durations else 0.0
+            metrics['max_ms'] = round(1000 * durations[-1], 2) if durations else 0.0
+            snapshot[name] = metrics
+        return snapshot
+
+    def prometheus(self):
+        """Renders the stage metrics in the Prometheus text format (a summary per stage)."""
+        lines = [
+            "# TYPE pipeline_stage_seconds summary",
+            "# TYPE pipeline_stage_errors_total counter",
+            "# TYPE pipeline_stage_rows_total counter",
+            "# TYPE pipeline_stage_bytes_total counter",
+            "# TYPE pipeline_stage_tokens_total counter",
+        ]
+        for name, metrics in self.snapshot().items():
+            label = f'stage="{name}"'
+            lines += [
+                f'pipeline_stage_seconds{{{label},quantile="0.5"}} {metrics["p50_ms"] / 1000}',
+                f'pipeline_stage_seconds{{{label},quantile="0.95"}} {metrics["p95_ms"] / 1000}',
+                f'pipeline_stage_seconds_sum{{{label}}} {metrics["seconds_total"]}',
+                f'pipeline_stage_seconds_count{{{label}}} {metrics["count"]}',
+                f'pipeline_stage_errors_total{{{label}}} {metrics["errors"]}',
+                f'pipeline_stage_rows_total{{{label}}} {metrics["rows"]}',
+                f'pipeline_stage_bytes_total{{{label}}} {metrics["bytes"]}',
+                f'pipeline_stage_tokens_total{{{label},direction="input"}} {metrics["input_tokens"]}',
+                f'pipeline_stage_tokens_total{{{label},direction="output"}} {metrics["output_tokens"]}',
+            ]
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+class LangfuseExporter:
+    """
+    Sends finished stage trees to Langfuse from a background thread, in batches, so
+    the pipeline never waits on it: a root stage becomes a trace and its children
+    spans (generations for stages with token usage). When the queue is full, trees
+    are dropped and counted rather than blocking the caller.
+    """
+
+    def __init__(self, max_queue=INSTRUMENTATION_QUEUE_SIZE, flush_seconds=INSTRUMENTATION_FLUSH_SECONDS):
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._flush_seconds = flush_seconds
+        self._thread = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, root):
+        try:
+            self._queue.put_nowait(root)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='langfuse-export', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._flush_seconds
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._export(batch)
+
+    def _export(self, batch):
+        # Imported here: llm_setup pulls in the SDK settings, which the hot paths do not need
+        import llm_setup
+        try:
+            client = llm_setup.get_langfuse_client()
+            if client is None:
+                return
+            for root in batch:
+                trace = client.trace(name=root.name, metadata=_stage_metadata(root), timestamp=root.started_at)
+                _export_stage(trace, root)
+            client.flush()
+            self.exported += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Could not export stages to Langfuse: {e}", flush=True)
+
+    def flush(self, timeout=5.0):
+        """Waits (up to `timeout` seconds) for the queued trees to be exported."""
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'exported': self.exported, 'dropped': self.dropped, 'failed': self.failed}
+
+
+def _stage_metadata(stage):
+    metadata = dict(stage.attrs, seconds=round(stage.seconds or 0.0, 4))
+    for name in ('rows', 'bytes'):
+        if getattr(stage, name):
+            metadata[name] = getattr(stage, name)
+    return metadata
+
+
+def _export_stage(parent, stage):
+    end_time = datetime.fromtimestamp(stage.started_at.timestamp() + (stage.seconds or 0.0), timezone.utc)
+    kwargs = {
+        'name': stage.name, 'start_time': stage.started_at, 'end_time': end_time, 'metadata': _stage_metadata(stage),
+    }
+    if stage.error is not None:
+        kwargs.update(level='ERROR', status_message=stage.error)
+    if stage.input_tokens or stage.output_tokens:
+        observation = parent.generation(
+            model=stage.attrs.get('model'),
+            usage={'input': stage.input_tokens, 'output': stage.output_tokens,
+                   'total': stage.input_tokens + stage.output_tokens},
+            **kwargs
+        )
+    else:
+        observation = parent.span(**kwargs)
+    for child in list(stage.children):
+        _export_stage(observation, child)
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread every `interval_ms` while it runs, and
+    writes them in the folded format of flame graph tools ("thread;module:function;... count").
+    """
+
+    def __init__(self, name, interval_ms=PROFILE_INTERVAL_MS):
+        self.name = name
+        self.interval = max(0.001, interval_ms / 1000)
+        self.samples = Counter()
+        self.path = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'profiler-{name}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stops sampling and writes the profile to PROFILE_DIR. Returns its path."""
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        self.path = os.path.join(PROFILE_DIR, f"{self.name}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.folded")
+        with open(self.path, 'w') as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        with _lock:
+            _profiles.append(self.path)
+        return self.path
+
+
+_lock = threading.Lock()
+_registry = MetricsRegistry()
+_exporter = LangfuseExporter()
+_profiles = deque(maxlen=20)
+_providers = {}
+
+
+@contextmanager
+def profile(name):
+    """Runs the block under the sampling profiler (see SamplingProfiler)."""
+    profiler = SamplingProfiler(name).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+
+
+@contextmanager
+def stage(name, export=True, **attrs):
+    """
+    Times the block as a stage of the pipeline and yields it, so the block can
+    record() rows, bytes and tokens or fail() it. Raised exceptions are recorded as
+    the stage error. Finished root stages are exported to Langfuse with their
+    children unless `export` is False (e.g. a step that writes its own trace).
+    Stages listed in PROFILE_STAGES run under the sampling profiler.
+    """
+    if not INSTRUMENTATION_ENABLED:
+        yield _NULL_STAGE
+        return
+    current = Stage(name, attrs, _current_stage.get(), export)
+    token = _current_stage.set(current)
+    profiler = SamplingProfiler(name).start() if name in PROFILE_STAGES else None
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.seconds = time.perf_counter() - current._start
+        _current_stage.reset(token)
+        if profiler is not None:
+            profiler.stop()
+        _finish(current)
+
+
+def record_stage(name, seconds, error=None, **counts):
+    """Records a stage measured by the caller (e.g. time accumulated over many small steps)."""
+    if not INSTRUMENTATION_ENABLED:
+        return
+    current = Stage(name, parent=_current_stage.get())
+    current.record(**counts)
+    current.seconds = seconds
+    current.error = error
+    _finish(current)
+
+
+def _finish(finished):
+    _registry.observe(finished)
+    if finished.parent is not None:
+        # Children running in worker threads may finish at the same time
+        with _lock:
+            finished.parent.children.append(finished)
+    elif finished.export and INSTRUMENTATION_LANGFUSE:
+        _exporter.submit(finished)
+
+
+def instrumented(name, **attrs):
+    """Decorator running each call of the function as a stage."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name, **attrs):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_stage():
+    """Returns the active stage of the context (a no-op stand-in when there is none)."""
+    return _current_stage.get() or _NULL_STAGE
+
+
+def register_provider(name, function):
+    """Adds a section to the diagnostics (e.g. 'scheduler': get_scheduler_stats)."""
+    with _lock:
+        _providers[name] = function
+
+
+def get_stage_metrics():
+    return _registry.snapshot()
+
+
+def get_diagnostics():
+    """Returns the stage metrics, export stats, recent profiles and the registered provider sections."""
+    with _lock:
+        providers = dict(_providers)
+        profiles = list(_profiles)
+    diagnostics = {'stages': get_stage_metrics(), 'langfuse_export': _exporter.stats(), 'profiles': profiles}
+    for name, function in providers.items():
+        try:
+            diagnostics[name] = function()
+        except Exception as e:
+            diagnostics[name] = {'error': str(e)}
+    return diagnostics
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = _registry.prometheus(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(get_diagnostics(), default=str), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serves /metrics and /metrics.json from a background thread, once per process. Returns the server or None."""
+    global _server
+    if not port:
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+            print(f"Metrics served on http://{host}:{port}/metrics", flush=True)
+    return _server
+
+
+atexit.register(_exporter.flush)
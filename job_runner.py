@@ -0,0 +1,453 @@
+# job_runner.py
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+from db_connector import use_schema
+from genai_data import parse_ddl_to_schema, generate_multi_table_data, GENERATION_CANCELLED
+from database_utils import setup_db_with_data
+
+JOB_STORE_DIR = os.getenv("JOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "jobs"))
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "2"))
+# Finished jobs (and their generated tables) are deleted after this many seconds
+JOB_TTL = float(os.getenv("JOB_TTL", str(24 * 3600)))
+# Seconds between two refreshes of a running job in the app
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+# Seconds between two heartbeats of the jobs a process owns; an active job whose owner
+# missed HEARTBEAT_MISSES of them (or whose process is gone) is flagged as interrupted
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+HEARTBEAT_MISSES = 3
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+# Queued or running when the process that owned it stopped
+INTERRUPTED = 'interrupted'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+RESUMABLE_STATUSES = (FAILED, CANCELLED, INTERRUPTED, SUCCEEDED)
+
+# Status of the tables of a job
+TABLE_PENDING = 'pending'
+TABLE_RUNNING = 'running'
+TABLE_DONE = 'done'
+# Some rows are missing (e.g. a batch kept failing): resuming generates them
+TABLE_INCOMPLETE = 'incomplete'
+TABLE_FAILED = 'failed'
+TABLE_CANCELLED = 'cancelled'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    db_schema TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    params TEXT NOT NULL,
+    error TEXT,
+    load_stats TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT,
+    heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS job_tables (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    table_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    rows_target INTEGER NOT NULL,
+    seconds REAL,
+    error TEXT,
+    path TEXT,
+    PRIMARY KEY (job_id, table_name)
+);
+"""
+
+# Columns added to the jobs table of an existing store
+_ADDED_COLUMNS = {'owner': 'TEXT', 'heartbeat': 'REAL'}
+
+
+def new_owner_id():
+    """Returns the id of the current process as a job owner: host, pid and a token unique to this start."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _process_alive(pid):
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g. running under another user
+        return True
+    return True
+
+
+def owner_alive(owner, heartbeat, now=None, timeout=None):
+    """
+    True while the process owning a job may still be running it: its heartbeat is
+    recent and, for an owner on this host, its process exists.
+    """
+    now = time.time() if now is None else now
+    timeout = JOB_HEARTBEAT_SECONDS * HEARTBEAT_MISSES if timeout is None else timeout
+    if not owner or heartbeat is None or now - heartbeat > timeout:
+        return False
+    parts = owner.rsplit(':', 2)
+    if len(parts) == 3 and parts[0] == socket.gethostname() and parts[1].isdigit():
+        return _process_alive(int(parts[1]))
+    return True
+
+
+class JobStore:
+    """
+    Local SQLite store of the generation jobs: their parameters, status and the
+    progress of each table. The generated tables are saved next to it, one Parquet
+    file per table, so results survive a browser refresh and a job can be resumed.
+    """
+
+    def __init__(self, directory=JOB_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "jobs.sqlite")
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, column_type in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+
+    @contextmanager
+    def _connect(self):
+        # A connection per operation (committed on success): jobs are updated from worker threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _write(self, query, params=()):
+        with self._lock, self._connect() as conn:
+            conn.execute(query, params)
+
+    def create_job(self, db_schema, params, owner=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._write(
+            "INSERT INTO jobs (id, db_schema, status, stage, params, created, updated, owner, heartbeat) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, db_schema, QUEUED, None, json.dumps(params), now, now, owner, now)
+        )
+        return job_id
+
+    def update_job(self, job_id, **fields):
+        for name in ('params', 'load_stats'):
+            if name in fields:
+                fields[name] = json.dumps(fields[name])
+        fields['updated'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._write(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def set_tables(self, job_id, table_names, rows_target):
+        """Registers the tables of a job (kept with their progress when it is resumed)."""
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO job_tables (job_id, table_name, position, status, rows_target) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, name, position, TABLE_PENDING, rows_target) for position, name in enumerate(table_names)]
+            )
+
+    def update_table(self, job_id, table_name, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._write(f"UPDATE job_tables SET {assignments} WHERE job_id = ? AND table_name = ?",
+                    (*fields.values(), job_id, table_name))
+
+    def get_job(self, job_id):
+        """Returns a job as a dict, with its 'tables' in DDL order, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            tables = conn.execute(
+                "SELECT * FROM job_tables WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['load_stats'] = json.loads(job['load_stats']) if job['load_stats'] else {}
+        job['tables'] = [dict(table) for table in tables]
+        return job
+
+    def heartbeat(self, owner):
+        """Records that `owner` is still running its queued and running jobs."""
+        self._write(
+            f"UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+            (time.time(), owner, *ACTIVE_STATUSES)
+        )
+
+    def mark_interrupted(self, owner=None, timeout=None):
+        """
+        Flags the queued or running jobs whose owner is gone (see owner_alive()), so they
+        can be resumed. Jobs of `owner` and of other live processes are left alone.
+        Returns the ids of the interrupted jobs.
+        """
+        statuses = ', '.join('?' * len(ACTIVE_STATUSES))
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id, owner, heartbeat FROM jobs WHERE status IN ({statuses})", ACTIVE_STATUSES
+            ).fetchall()
+            interrupted = [
+                row['id'] for row in rows
+                if row['owner'] != owner and not owner_alive(row['owner'], row['heartbeat'], now, timeout)
+            ]
+            # The status is checked again: the owner may have finished the job meanwhile
+            conn.executemany(
+                f"UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status IN ({statuses})",
+                [(INTERRUPTED, now, job_id, *ACTIVE_STATUSES) for job_id in interrupted]
+            )
+        return interrupted
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def save_table_data(self, job_id, table_name, df):
+        """Saves the rows of a table and returns the path of the file."""
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        base = os.path.join(self.job_dir(job_id), uuid.uuid4().hex)
+        try:
+            df.to_parquet(base + '.parquet', index=False)
+            return base + '.parquet'
+        except (pa.ArrowException, ValueError, TypeError):
+            # Mixed-type object columns Arrow cannot store
+            if os.path.exists(base + '.parquet'):
+                os.remove(base + '.parquet')
+            df.to_pickle(base + '.pkl')
+            return base + '.pkl'
+
+    @staticmethod
+    def load_table_data(path):
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        return pd.read_pickle(path)
+
+    def load_results(self, job_id, table_names=None):
+        """Returns {table_name: DataFrame} of the saved tables of a job."""
+        job = self.get_job(job_id)
+        return {
+            table['table_name']: self.load_table_data(table['path'])
+            for table in (job['tables'] if job else [])
+            if table['path'] and (table_names is None or table['table_name'] in table_names)
+        }
+
+    def delete_expired(self, ttl=JOB_TTL):
+        """Deletes the finished jobs not updated for `ttl` seconds, with their files."""
+        with self._lock, self._connect() as conn:
+            expired = [row['id'] for row in conn.execute(
+                f"SELECT id FROM jobs WHERE updated < ? AND status NOT IN ({', '.join('?' * len(ACTIVE_STATUSES))})",
+                (time.time() - ttl, *ACTIVE_STATUSES)
+            )]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return expired
+
+
+class JobRunner:
+    """
+    Runs generation jobs (parse the DDL, generate every table, load them into
+    PostgreSQL) on a pool of worker threads, off the Streamlit script thread.
+
+    Jobs wait in the executor queue and their state lives in the JobStore, so the app
+    only polls it: each table is saved as soon as it is generated and its progress is
+    recorded while rows stream in. A job can be cancelled, and a failed, cancelled or
+    interrupted one resumed: complete tables are kept and only missing rows generated.
+
+    Several app processes may share a store. Each runner owns the jobs it queues and
+    sends a heartbeat for them every JOB_HEARTBEAT_SECONDS; the active jobs of a
+    process that stopped are flagged as interrupted at start-up and on each heartbeat.
+    """
+
+    def __init__(self, store=None, max_workers=JOB_MAX_WORKERS, heartbeat_seconds=JOB_HEARTBEAT_SECONDS):
+        self.store = store or JobStore()
+        self.owner = new_owner_id()
+        self.store.mark_interrupted(self.owner)
+        self.store.delete_expired()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='job')
+        self._cancel_events = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat_seconds = heartbeat_seconds
+        threading.Thread(target=self._send_heartbeats, name='job-heartbeat', daemon=True).start()
+
+    def _send_heartbeats(self):
+        while not self._stopped.wait(self._heartbeat_seconds):
+            try:
+                self.store.heartbeat(self.owner)
+                self.store.mark_interrupted(self.owner)
+            except sqlite3.Error as e:
+                print(f"Job heartbeat failed: {e}", flush=True)
+
+    def submit(self, db_schema, params):
+        """
+        Queues a job and returns its id. `params` holds the 'ddl' (or parsed 'schemas')
+        and the arguments of generate_multi_table_data: 'num_rows', 'temp', 'model',
+        'extra_prompt', 'max_tokens', 'mode' and 'seed'.
+        """
+        job_id = self.store.create_job(db_schema, params, owner=self.owner)
+        self._start(job_id)
+        return job_id
+
+    def resume(self, job_id, db_schema=None):
+        """
+        Queues a finished job again, loading into `db_schema` when given (the schema of
+        the session resuming it). Returns False if it is unknown or still active.
+        """
+        with self._lock:
+            job = self.store.get_job(job_id)
+            if job is None or job['status'] not in RESUMABLE_STATUSES or job_id in self._cancel_events:
+                return False
+            self.store.update_job(job_id, status=QUEUED, error=None, db_schema=db_schema or job['db_schema'],
+                                  owner=self.owner, heartbeat=time.time())
+        self._start(job_id)
+        return True
+
+    def cancel(self, job_id):
+        """Asks a queued or running job to stop. Returns False if it is not active."""
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def get_job(self, job_id):
+        return self.store.get_job(job_id)
+
+    def _start(self, job_id):
+        with self._lock:
+            self._cancel_events[job_id] = threading.Event()
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        with self._lock:
+            cancel_event = self._cancel_events[job_id]
+        try:
+            job = self.store.get_job(job_id)
+            with use_schema(job['db_schema']):
+                self._run_job(job, cancel_event)
+        except Exception as e:
+            self.store.update_job(job_id, status=FAILED, error=f"Unexpected failure of the job: {e}")
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+
+    def _run_job(self, job, cancel_event):
+        job_id, params, store = job['id'], job['params'], self.store
+        if cancel_event.is_set():
+            store.update_job(job_id, status=CANCELLED, stage=None)
+            return
+
+        store.update_job(job_id, status=RUNNING, stage='parsing')
+        schemas = params.get('schemas') or parse_ddl_to_schema(params['ddl'])
+        if not schemas:
+            store.update_job(job_id, status=FAILED, stage=None,
+                             error="No CREATE TABLE commands were found in the DDL file. Please check the format.")
+            return
+        num_rows = params['num_rows']
+        if 'schemas' not in params:
+            params = dict(params, schemas=schemas)
+            store.update_job(job_id, params=params)
+        store.set_tables(job_id, list(schemas), num_rows)
+
+        # Saved tables (complete or not) are the starting point of a resumed job
+        resume_from = store.load_results(job_id)
+        saved_paths = {t['table_name']: t['path'] for t in store.get_job(job_id)['tables']}
+        store.update_job(job_id, stage='generating')
+
+        def on_progress(table_name, rows_done, preview_df):
+            store.update_table(job_id, table_name, status=TABLE_RUNNING, rows_done=rows_done)
+
+        def on_table_done(table_name, df, seconds):
+            if 'Error' in df.columns:
+                error = df['Error'].iloc[0]
+                status = TABLE_CANCELLED if error == GENERATION_CANCELLED else TABLE_FAILED
+                store.update_table(job_id, table_name, status=status, seconds=round(seconds, 3), error=error)
+                return
+            error = df.attrs.get('generation_error')
+            if error == GENERATION_CANCELLED:
+                status = TABLE_CANCELLED
+            else:
+                status = TABLE_INCOMPLETE if error or len(df) < num_rows else TABLE_DONE
+            path = saved_paths.get(table_name)
+            if df is not resume_from.get(table_name):
+                path = store.save_table_data(job_id, table_name, df)
+                if saved_paths.get(table_name):
+                    os.remove(saved_paths[table_name])
+            store.update_table(job_id, table_name, status=status, rows_done=len(df), seconds=round(seconds, 3),
+                               error=error, path=path)
+
+        generated = generate_multi_table_data(
+            schemas=schemas,
+            num_rows=num_rows,
+            temp=params['temp'],
+            model=params['model'],
+            extra_prompt=params['extra_prompt'],
+            max_tokens=params['max_tokens'],
+            resume_from=resume_from,
+            on_progress=on_progress,
+            on_table_done=on_table_done,
+            mode=params['mode'],
+            seed=params.get('seed'),
+            cancel_event=cancel_event
+        )
+        if cancel_event.is_set():
+            store.update_job(job_id, status=CANCELLED, stage=None)
+            return
+
+        store.update_job(job_id, stage='loading')
+        load_stats = {}
+        setup_result = setup_db_with_data(generated, schemas, load_stats=load_stats)
+        if "Error" in setup_result:
+            store.update_job(job_id, status=FAILED, stage=None, error=setup_result, load_stats=load_stats)
+        else:
+            store.update_job(job_id, status=SUCCEEDED, stage=None, load_stats=load_stats)
+
+    def shutdown(self, wait=False):
+        """Cancels the active jobs and stops the workers."""
+        self._stopped.set()
+        with self._lock:
+            events = list(self._cancel_events.values())
+        for event in events:
+            event.set()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """Returns the process-wide job runner, creating it on first use."""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner()
+    return _runner
@@ -0,0 +1,200 @@
+# json_stream.py
+
+import json
+import threading
+from array import array
+import numpy as np
+import pandas as pd
+
+INT64_MIN = -(2 ** 63)
+INT64_MAX = 2 ** 63 - 1
+
+
+class JsonArrayStreamDecoder:
+    """
+    Incrementally decodes a JSON array fed as text chunks.
+
+    feed() returns the elements that were completed by the new chunk, so each object
+    is available as soon as its closing brace arrives. Text before the opening '['
+    (e.g. a markdown code fence) is ignored. close() raises json.JSONDecodeError if
+    the array was never opened or if unparsable content is left in the buffer.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._started = False
+        self.finished = False
+        self.count = 0
+
+    def feed(self, text):
+        if self.finished or not text:
+            return []
+        self._buffer += text
+
+        if not self._started:
+            start = self._buffer.find('[')
+            if start == -1:
+                return []
+            self._buffer = self._buffer[start + 1:]
+            self._started = True
+
+        items = []
+        pos = 0
+        buffer = self._buffer
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == ']':
+                self.finished = True
+                pos += 1
+                break
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            # A scalar at the end of the buffer may still be incomplete (e.g. "12" -> "123")
+            if not isinstance(item, (dict, list)) and end >= len(buffer):
+                break
+            items.append(item)
+            pos = end
+
+        self._buffer = buffer[pos:]
+        self.count += len(items)
+        return items
+
+    def close(self):
+        if not self._started:
+            raise json.JSONDecodeError("A valid JSON array was not found in the response.", self._buffer, 0)
+        if not self.finished and self._buffer.strip():
+            raise json.JSONDecodeError("The JSON array in the response is incomplete or invalid.", self._buffer, 0)
+
+
+class _TypedColumn:
+    """
+    Column buffer that stores ints and floats in compact arrays and falls back to objects.
+    Nulls of an int column are kept in a mask, so it becomes a nullable Int64 column
+    instead of float64, which cannot hold integers above 2**53 exactly.
+    """
+
+    def __init__(self, length=0):
+        self.kind = 'null'
+        self.values = [None] * length
+        # 1 where an int column holds a null (None until the first one)
+        self.nulls = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def target_kind(self, value):
+        """Returns the kind the column must have to hold `value` (its current kind or a wider one)."""
+        if self.kind == 'object' or value is None:
+            return self.kind
+        if isinstance(value, bool):
+            return 'object'
+        if isinstance(value, int):
+            if self.kind == 'float':
+                try:
+                    float(value)
+                except OverflowError:
+                    return 'object'
+                return 'float'
+            return 'int' if INT64_MIN <= value <= INT64_MAX else 'object'
+        if isinstance(value, float):
+            return 'float'
+        return 'object'
+
+    def append(self, value, kind=None):
+        """Appends `value`, promoting the column first if needed (`kind` as returned by target_kind)."""
+        kind = kind or self.target_kind(value)
+        if kind != self.kind:
+            self._promote(kind)
+        if kind == 'int':
+            if value is None and self.nulls is None:
+                self.nulls = bytearray(len(self.values))
+            if self.nulls is not None:
+                self.nulls.append(value is None)
+            self.values.append(0 if value is None else value)
+        elif kind == 'float':
+            self.values.append(float('nan') if value is None else float(value))
+        else:
+            self.values.append(value)
+
+    def _is_null(self, i):
+        return self.nulls is not None and self.nulls[i]
+
+    def _promote(self, kind):
+        if kind == 'int':
+            # Only a column of nulls is promoted to int
+            self.nulls = bytearray([1]) * len(self.values) if self.values else None
+            self.values = array('q', [0] * len(self.values))
+        elif kind == 'float':
+            self.values = array('d', (
+                float('nan') if v is None or (self.kind == 'int' and self._is_null(i)) else float(v)
+                for i, v in enumerate(self.values)
+            ))
+            self.nulls = None
+        elif self.kind == 'float':
+            self.values = [None if v != v else v for v in self.values]
+        elif self.kind == 'int':
+            self.values = [None if self._is_null(i) else v for i, v in enumerate(self.values)]
+            self.nulls = None
+        else:
+            self.values = list(self.values)
+        self.kind = kind
+
+    def to_numpy(self, limit=None):
+        values = self.values if limit is None else self.values[:limit]
+        if self.kind == 'int':
+            data = np.array(values, dtype=np.int64)
+            if self.nulls is None:
+                return data
+            mask = np.frombuffer(bytes(self.nulls[:len(data)]), dtype=np.uint8).astype(bool)
+            return pd.arrays.IntegerArray(data, mask) if mask.any() else data
+        if self.kind == 'float':
+            return np.array(values, dtype=np.float64)
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+
+
+class ColumnarRowBuffer:
+    """
+    Accumulates JSON rows (dicts) column by column instead of as a list of dicts.
+
+    Integer and float columns are kept in compact typed arrays rather than as boxed
+    Python objects inside one dict per row. Thread-safe, so a preview can be taken
+    while another thread is appending.
+    """
+
+    def __init__(self):
+        self._columns = {}
+        self._length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._length
+
+    def append(self, row):
+        with self._lock:
+            new_columns = {name: _TypedColumn(self._length) for name in row if name not in self._columns}
+            # Every column is checked before any is written, so the columns keep the same length
+            plan = [
+                (column, row.get(name), column.target_kind(row.get(name)))
+                for name, column in {**self._columns, **new_columns}.items()
+            ]
+            self._columns.update(new_columns)
+            for column, value, kind in plan:
+                column.append(value, kind)
+            self._length += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def to_dataframe(self, limit=None):
+        with self._lock:
+            df = pd.DataFrame({name: column.to_numpy(limit) for name, column in self._columns.items()})
+        return df.infer_objects()
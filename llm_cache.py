@@ -0,0 +1,209 @@
+# llm_cache.py
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import dataclasses
+from collections import OrderedDict
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+# Comma-separated call sites that must always reach the model: generate_data, generate_spec, nl_to_sql, nl_to_sql_repair,
+# edit_data, edit_plan
+LLM_CACHE_DISABLED_SITES = {s.strip() for s in os.getenv("LLM_CACHE_DISABLED_SITES", "").split(",") if s.strip()}
+
+
+def _to_plain(value):
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, dict):
+        return {str(k): _to_plain(v) for k, v in value.items()}
+    return value
+
+
+def make_cache_key(model, system_instruction, prompt, generation_config, safety_settings=None):
+    """Returns the SHA-256 content address of a model invocation."""
+    payload = json.dumps(
+        {
+            'model': model,
+            'system_instruction': system_instruction,
+            'prompt': prompt,
+            'generation_config': _to_plain(generation_config),
+            'safety_settings': _to_plain(safety_settings),
+        },
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache of model responses: an in-memory LRU in front of a SQLite file.
+
+    Entries expire after `ttl` seconds. When the file grows beyond `max_bytes`, the
+    least recently used entries are evicted. Hits and misses are counted per call site.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES,
+                 memory_entries=LLM_CACHE_MEMORY_ENTRIES, enabled=LLM_CACHE_ENABLED,
+                 disabled_sites=LLM_CACHE_DISABLED_SITES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.enabled = enabled
+        self.disabled_sites = set(disabled_sites)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = None
+        self._disk_bytes = 0
+        self._counters = {}
+
+    def enabled_for(self, call_site):
+        return self.enabled and call_site not in self.disabled_sites
+
+    def set_site_enabled(self, call_site, enabled):
+        if enabled:
+            self.disabled_sites.discard(call_site)
+        else:
+            self.disabled_sites.add(call_site)
+
+    def get(self, key, call_site=None):
+        """Returns the cached {'text', 'finish_reason'} for `key`, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry['created'] > self.ttl:
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._count(call_site, 'memory_hits')
+                return entry
+
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                self._remember(key, entry)
+                self._count(call_site, 'disk_hits')
+                return entry
+
+            self._count(call_site, 'misses')
+            return None
+
+    def put(self, key, text, finish_reason):
+        entry = {'text': text, 'finish_reason': finish_reason, 'created': time.time()}
+        with self._lock:
+            self._remember(key, entry)
+            self._disk_put(key, entry)
+
+    def stats(self):
+        """Returns the hit/miss counters per call site and the size of each tier."""
+        with self._lock:
+            return {
+                'sites': {site: dict(counts) for site, counts in self._counters.items()},
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM llm_cache")
+                db.commit()
+                self._disk_bytes = 0
+
+    def _count(self, call_site, counter):
+        counts = self._counters.setdefault(call_site or 'default', {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+        counts[counter] += 1
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _connect(self):
+        if self._db is None and self.path:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                db = sqlite3.connect(self.path, check_same_thread=False)
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, text TEXT, finish_reason TEXT, size INTEGER, created REAL, accessed REAL)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+                db.commit()
+                self._disk_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+                self._db = db
+            except sqlite3.Error as e:
+                # The memory tier keeps working without the disk tier
+                print(f"LLM cache disabled on disk: {e}", flush=True)
+                self.path = None
+        return self._db
+
+    def _disk_get(self, key, now):
+        db = self._connect()
+        if db is None:
+            return None
+        row = db.execute("SELECT text, finish_reason, size, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        text, finish_reason, size, created = row
+        if now - created > self.ttl:
+            db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            db.commit()
+            self._disk_bytes -= size
+            return None
+        db.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+        db.commit()
+        return {'text': text, 'finish_reason': finish_reason, 'created': created}
+
+    def _disk_put(self, key, entry):
+        db = self._connect()
+        if db is None:
+            return
+        size = len(entry['text'].encode('utf-8')) + len(key)
+        previous = db.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        db.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, text, finish_reason, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, entry['text'], entry['finish_reason'], size, entry['created'], entry['created'])
+        )
+        self._disk_bytes += size - (previous[0] if previous else 0)
+
+        if self._disk_bytes > self.max_bytes:
+            # Expired entries go first, then the least recently used ones
+            db.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl,))
+            self._disk_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            target = int(self.max_bytes * 0.9)
+            for old_key, old_size in db.execute("SELECT key, size FROM llm_cache ORDER BY accessed").fetchall():
+                if self._disk_bytes <= target:
+                    break
+                db.execute("DELETE FROM llm_cache WHERE key = ?", (old_key,))
+                self._disk_bytes -= old_size
+        db.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Returns the process-wide LLM response cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
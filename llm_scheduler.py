@@ -0,0 +1,261 @@
+# llm_scheduler.py
+
+import os
+import time
+import random
+import threading
+from collections import deque
+
+# Limits shared by every Gemini call of the process (0 disables a limit)
+LLM_RPM = float(os.getenv("LLM_RPM", "1000"))
+LLM_TPM = float(os.getenv("LLM_TPM", "1000000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+# Priority lanes: lower runs first
+INTERACTIVE = 0
+BULK = 1
+LANE_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+CALL_SITE_LANES = {
+    'nl_to_sql': INTERACTIVE,
+    'nl_to_sql_repair': INTERACTIVE,
+    'edit_plan': INTERACTIVE,
+    'generate_data': BULK,
+    'generate_spec': BULK,
+    'edit_data': BULK,
+    'count_tokens': BULK,
+}
+# Seconds after which a waiting bulk request is served like an interactive one, so it is never starved
+LANE_AGING_SECONDS = 30.0
+# HTTP statuses worth retrying: rate limited, or a transient server error
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Wait times kept per lane for the percentiles
+WAIT_SAMPLES = 1000
+
+
+def is_retryable(error):
+    """True for rate limits (429), transient server errors (5xx) and network errors."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    for attribute in ('code', 'status_code'):
+        code = getattr(error, attribute, None)
+        code = code() if callable(code) else code
+        if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+            return True
+    return False
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` tokens per minute, holding at
+    most a minute's worth. The level may go negative when a request turns out larger
+    than estimated; the debt is paid back before the next request is admitted.
+    """
+
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount):
+        """Seconds until `amount` tokens are available (0 if they are now)."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        # A request larger than the bucket only waits for a full bucket
+        needed = min(amount, self.capacity) - self.level
+        return 0.0 if needed <= 0 else needed / self.rate
+
+    def take(self, amount):
+        if self.capacity > 0:
+            self._refill()
+            self.level -= amount
+
+
+class _InFlight:
+    """Result of a request shared with identical requests submitted while it runs."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMScheduler:
+    """
+    Admission control for the model calls of the process.
+
+    Callers run their request in their own thread (so streamed chunks reach them
+    directly) once the scheduler admits it: waiting requests are served by lane
+    (interactive before bulk) then in arrival order, within the request and token per
+    minute budgets and LLM_MAX_CONCURRENCY. Retryable failures (429, 5xx) are retried
+    with exponential backoff and full jitter, going through admission again. Identical
+    requests (same `coalesce_key`) submitted while one is running wait for its result
+    instead of calling the model.
+
+    `clock` and `sleep` can be replaced to test the scheduler with a fake model.
+    """
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM, max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX, clock=time.monotonic, sleep=time.sleep):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._clock = clock
+        self._sleep = sleep
+        self._requests = TokenBucket(rpm, clock)
+        self._tokens = TokenBucket(tpm, clock)
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._sequence = 0
+        self._running = 0
+        self._in_flight = {}
+        self._waits = {lane: deque(maxlen=WAIT_SAMPLES) for lane in LANE_NAMES}
+        self._counters = {'requests': 0, 'calls': 0, 'retries': 0, 'coalesced': 0, 'failures': 0, 'throttled': 0}
+
+    def execute(self, fn, call_site=None, estimated_tokens=0, coalesce_key=None, can_retry=None):
+        """
+        Runs fn() under the scheduler and returns (result, coalesced), `coalesced` being
+        True when the result is the one of an identical in-flight request. `can_retry()`
+        is asked before retrying a failed attempt (e.g. False once part of a stream was
+        delivered to the caller).
+        """
+        lane = CALL_SITE_LANES.get(call_site, BULK)
+        leader = shared = None
+        with self._cond:
+            self._counters['requests'] += 1
+            if coalesce_key is not None:
+                shared = self._in_flight.get(coalesce_key)
+                if shared is None:
+                    leader = self._in_flight[coalesce_key] = _InFlight()
+                else:
+                    self._counters['coalesced'] += 1
+
+        if shared is not None:
+            shared.done.wait()
+            if shared.error is not None:
+                raise shared.error
+            return shared.result, True
+
+        try:
+            result = self._run_with_retries(fn, lane, estimated_tokens, can_retry)
+            if leader is not None:
+                leader.result = result
+            return result, False
+        except BaseException as e:
+            if leader is not None:
+                leader.error = e
+            raise
+        finally:
+            if leader is not None:
+                with self._cond:
+                    self._in_flight.pop(coalesce_key, None)
+                leader.done.set()
+
+    def _run_with_retries(self, fn, lane, estimated_tokens, can_retry):
+        attempt = 0
+        while True:
+            self._acquire(lane, estimated_tokens)
+            try:
+                with self._cond:
+                    self._counters['calls'] += 1
+                return fn()
+            except Exception as e:
+                retry = attempt < self.max_retries and is_retryable(e) and (can_retry is None or can_retry())
+                with self._cond:
+                    self._counters['retries' if retry else 'failures'] += 1
+                if not retry:
+                    raise
+            finally:
+                self._release()
+            # Full jitter: spreads the retries of requests that failed together
+            self._sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+            attempt += 1
+
+    def _acquire(self, lane, estimated_tokens):
+        start = self._clock()
+        with self._cond:
+            self._sequence += 1
+            ticket = (lane, self._sequence, start)
+            self._waiting.append(ticket)
+            throttled = False
+            try:
+                while True:
+                    if self._next_ticket() is ticket and self._running < self.max_concurrency:
+                        delay = max(self._requests.delay(1), self._tokens.delay(estimated_tokens))
+                        if delay <= 0:
+                            break
+                        throttled = True
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait(1.0)
+                self._requests.take(1)
+                self._tokens.take(estimated_tokens)
+                self._running += 1
+                self._waits[lane].append(self._clock() - start)
+                self._counters['throttled'] += int(throttled)
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def _next_ticket(self):
+        now = self._clock()
+        return min(
+            self._waiting,
+            key=lambda t: (INTERACTIVE if now - t[2] >= LANE_AGING_SECONDS else t[0], t[1])
+        ) if self._waiting else None
+
+    def _release(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def report_tokens(self, estimated_tokens, used_tokens):
+        """Corrects the token budget once the real size of a request is known."""
+        with self._cond:
+            self._tokens.take(used_tokens - estimated_tokens)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Returns a snapshot of the scheduler metrics (queue depth, wait times, retries...)."""
+        with self._cond:
+            stats = dict(self._counters)
+            stats['running'] = self._running
+            stats['in_flight_keys'] = len(self._in_flight)
+            stats['queue_depth'] = len(self._waiting)
+            for lane, name in LANE_NAMES.items():
+                waits = sorted(self._waits[lane])
+                stats[f'{name}_queued'] = sum(1 for t in self._waiting if t[0] == lane)
+                stats[f'{name}_wait_ms_p50'] = 1000 * waits[len(waits) // 2] if waits else 0.0
+                stats[f'{name}_wait_ms_p95'] = 1000 * waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+                stats[f'{name}_wait_ms_max'] = 1000 * waits[-1] if waits else 0.0
+            return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Returns the process-wide scheduler, creating it on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler()
+    return _scheduler
+
+
+def get_scheduler_stats():
+    """Returns the metrics of the process-wide scheduler."""
+    return get_scheduler().stats()
@@ -1,31 +1,166 @@
-from dotenv import load_dotenv
+import time
+
+_IMPORT_START = time.perf_counter()
+
 import os
-import google.generativeai as genai
-from langfuse import Langfuse
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from dotenv import load_dotenv
 
+# Cheap, and must happen before other modules read their settings from the environment
 load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=api_key)
-
-# --- INICIALIZACIÓN DE LANGFUSE ---
-LANGFUSE_PUBLIC_KEY = os.getenv("LANGFUSE_PUBLIC_KEY")
-LANGFUSE_SECRET_KEY = os.getenv("LANGFUSE_SECRET_KEY")
-LANGFUSE_HOST = os.getenv("LANGFUSE_HOST")
-
-# --- BLOQUE DE DEPURACIÓN TEMPORAL (CON FLUSH) ---
-print("---[DEBUGGING ENVIRONMENT VARIABLES]---", flush=True)
-print(f"LANGFUSE_PUBLIC_KEY_READ: {LANGFUSE_PUBLIC_KEY}", flush=True)
-print(f"LANGFUSE_SECRET_KEY_READ: {'Value is present' if LANGFUSE_SECRET_KEY else 'Value is MISSING'}", flush=True)
-print(f"LANGFUSE_HOST_READ: {LANGFUSE_HOST}", flush=True)
-print("---------------------------------------", flush=True)
-# ------------------------------------
-
-# Inicializa el cliente solo si las claves están presentes
-langfuse_client = None
-if LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY and LANGFUSE_HOST:
-    langfuse_client = Langfuse(
-        public_key=LANGFUSE_PUBLIC_KEY,
-        secret_key=LANGFUSE_SECRET_KEY,
-        host=LANGFUSE_HOST
-    )
-    print("Langfuse client initialized.", flush=True)
\ No newline at end of file
+
+# Model clients kept by the registry (a client per distinct system instruction)
+LLM_CLIENT_REGISTRY_SIZE = int(os.getenv("LLM_CLIENT_REGISTRY_SIZE", "64"))
+
+_lock = threading.Lock()
+# Held while the SDK or Langfuse is being set up (_lock only guards the timings and registry)
+_setup_lock = threading.Lock()
+_configured = False
+_langfuse_ready = False
+_langfuse_client = None
+_timings = {}
+
+
+@contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - start)
+
+
+def record_timing(name, seconds):
+    """Records a startup timing (only the first measurement of each name is kept)."""
+    with _lock:
+        _timings.setdefault(name, round(1000 * seconds, 1))
+
+
+def get_startup_timings():
+    """Returns the startup timings recorded so far, in milliseconds."""
+    with _lock:
+        return dict(_timings)
+
+
+def configure():
+    """Configures the Gemini SDK, once per process."""
+    global _configured
+    if _configured:
+        return
+    with _setup_lock:
+        if _configured:
+            return
+        with _timed('sdk_configure_ms'):
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        _configured = True
+
+
+def get_langfuse_client():
+    """
+    Returns the Langfuse client, created on first use, or None when the LANGFUSE_*
+    variables are not set.
+    """
+    global _langfuse_client, _langfuse_ready
+    if _langfuse_ready:
+        return _langfuse_client
+    configure()
+    with _setup_lock:
+        if _langfuse_ready:
+            return _langfuse_client
+        public_key = os.getenv("LANGFUSE_PUBLIC_KEY")
+        secret_key = os.getenv("LANGFUSE_SECRET_KEY")
+        host = os.getenv("LANGFUSE_HOST")
+        if public_key and secret_key and host:
+            start = time.perf_counter()
+            from langfuse import Langfuse
+            _langfuse_client = Langfuse(public_key=public_key, secret_key=secret_key, host=host)
+            record_timing('langfuse_init_ms', time.perf_counter() - start)
+            print("Langfuse client initialized.", flush=True)
+        _langfuse_ready = True
+    return _langfuse_client
+
+
+class ClientRegistry:
+    """
+    Thread-safe LRU of Gemini model clients keyed by (model, system instruction), so
+    a client is built once and reused by every call and session. Generation configs
+    and safety settings are passed with each request, so they need no client of their own.
+    """
+
+    def __init__(self, max_size=LLM_CLIENT_REGISTRY_SIZE):
+        self.max_size = max(1, int(max_size))
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model, system_instruction=None):
+        key = (model, system_instruction or None)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+            self.misses += 1
+
+        configure()
+        import google.generativeai as genai
+        with _timed('first_client_ms'):
+            if system_instruction:
+                client = genai.GenerativeModel(model, system_instruction=system_instruction)
+            else:
+                client = genai.GenerativeModel(model)
+
+        with self._lock:
+            client = self._clients.setdefault(key, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return client
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._clients), 'hits': self.hits, 'misses': self.misses}
+
+
+_registry = None
+
+
+def get_client_registry():
+    """
+    Returns the process-wide model client registry. It can be wrapped in
+    st.cache_resource to share it explicitly across Streamlit sessions.
+    """
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                _registry = ClientRegistry()
+    return _registry
+
+
+def get_model(model, system_instruction=None):
+    """Returns the shared client of a model and system instruction."""
+    return get_client_registry().get(model, system_instruction)
+
+
+@lru_cache(maxsize=256)
+def generation_config(**kwargs):
+    """Returns a shared GenerationConfig for the given settings (e.g. temperature=0.0)."""
+    import google.generativeai as genai
+    return genai.types.GenerationConfig(**kwargs)
+
+
+def __getattr__(name):
+    # Kept for callers that read llm_setup.langfuse_client directly
+    if name == 'langfuse_client':
+        return get_langfuse_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+record_timing('llm_setup_import_ms', time.perf_counter() - _IMPORT_START)
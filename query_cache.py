@@ -0,0 +1,129 @@
+# query_cache.py
+
+import io
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+import pandas as pd
+from data_versions import get_table_versions
+from db_connector import get_current_schema
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Larger results are not worth caching (and are not collected while streaming)
+QUERY_CACHE_MAX_ROWS = int(os.getenv("QUERY_CACHE_MAX_ROWS", "20000"))
+
+_SQL_TOKEN_PATTERN = re.compile(r"""('(?:[^']|'')*')|("(?:[^"]|"")*")|(--[^\n]*)|(/\*.*?\*/)|([^'"\-/]+|[\-/])""", re.DOTALL)
+_IDENTIFIER_PATTERN = re.compile(r'"((?:[^"]|"")+)"|\b([a-z_][a-z0-9_$]*)\b')
+
+
+def normalize_sql(sql):
+    """
+    Normalizes a query for use as a cache key: comments are removed, whitespace is
+    collapsed, unquoted text is lowercased and a trailing ';' is dropped.
+    String literals and quoted identifiers are kept as-is.
+    """
+    parts = []
+    pending = []
+    for literal, quoted, line_comment, block_comment, other in _SQL_TOKEN_PATTERN.findall(sql):
+        if literal or quoted:
+            parts.append(re.sub(r'\s+', ' ', "".join(pending).lower()))
+            parts.append(literal or quoted)
+            pending = []
+        elif line_comment or block_comment:
+            pending.append(" ")
+        else:
+            pending.append(other)
+    parts.append(re.sub(r'\s+', ' ', "".join(pending).lower()))
+    return "".join(parts).strip().rstrip(';').strip()
+
+
+def referenced_tables(normalized_sql, known_tables):
+    """Returns the known tables whose name appears as an identifier in the query."""
+    without_literals = re.sub(r"'(?:[^']|'')*'", "''", normalized_sql)
+    names = set()
+    for quoted, bare in _IDENTIFIER_PATTERN.findall(without_literals):
+        names.add((quoted.replace('""', '"') if quoted else bare).lower())
+    return sorted(names & set(known_tables))
+
+
+class QueryResultCache:
+    """
+    LRU cache of query results stored as Parquet bytes within a memory budget.
+
+    Keys combine the normalized SQL with the data version of every table the query
+    mentions, so a result is never served after the app rewrites one of those tables.
+    """
+
+    def __init__(self, max_bytes=QUERY_CACHE_MAX_BYTES, enabled=QUERY_CACHE_ENABLED):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def make_key(self, sql, extra=None):
+        normalized = normalize_sql(sql)
+        versions = get_table_versions()
+        tables = referenced_tables(normalized, versions)
+        # The same query text reads different tables in each session schema
+        payload = "\n".join([normalized, repr(extra), repr(get_current_schema())] + [f"{t}:{versions[t]}" for t in tables])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached DataFrame for `key`, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        return pd.read_parquet(io.BytesIO(data))
+
+    def put(self, key, df):
+        """Stores a result unless it is an error or does not fit in the budget."""
+        if not self.enabled or 'Error' in df.columns or len(df) > QUERY_CACHE_MAX_ROWS:
+            return
+        try:
+            buffer = io.BytesIO()
+            df.to_parquet(buffer, index=False)
+        except Exception:
+            # Columns pyarrow cannot serialize are simply not cached
+            return
+        data = buffer.getvalue()
+        if len(data) > self.max_bytes // 4:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self._hits, 'misses': self._misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_cache = QueryResultCache()
+
+
+def get_query_cache():
+    """Returns the process-wide query result cache."""
+    return _cache
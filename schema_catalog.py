@@ -0,0 +1,195 @@
+# schema_catalog.py
+
+import re
+import time
+import threading
+from db_connector import pooled_connection, get_current_schema
+from data_versions import get_data_version
+
+# Staging tables of an in-progress load (see database_utils._staging_table_name)
+STAGING_TABLE_PATTERN = re.compile(r'__load_[0-9a-f]{8}$')
+_PLAIN_IDENTIFIER = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+TABLES_QUERY = """
+    SELECT t.table_name,
+           CASE WHEN c.reltuples >= 0 THEN c.reltuples::bigint ELSE COALESCE(s.n_live_tup, 0) END,
+           pg_total_relation_size(c.oid)
+    FROM information_schema.tables t
+    JOIN pg_namespace n ON n.nspname = t.table_schema
+    JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.table_name
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE t.table_schema = current_schema() AND t.table_type = 'BASE TABLE'
+    ORDER BY t.table_name
+"""
+COLUMNS_QUERY = """
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY c.relname, a.attnum
+"""
+CONSTRAINTS_QUERY = """
+    SELECT c.relname, con.conname, con.contype,
+           ARRAY(SELECT a.attname::text FROM unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum ORDER BY k.ord),
+           rc.relname,
+           ARRAY(SELECT a.attname::text FROM unnest(con.confkey) WITH ORDINALITY k(attnum, ord)
+                 JOIN pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum ORDER BY k.ord),
+           con.convalidated
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_class rc ON rc.oid = con.confrelid
+    WHERE n.nspname = current_schema() AND con.contype IN ('p', 'u', 'f')
+    ORDER BY c.relname, position(con.contype in 'puf'), con.conname
+"""
+INDEXES_QUERY = """
+    SELECT t.relname, ic.relname, i.indisunique, i.indisprimary, am.amname,
+           ARRAY(SELECT pg_get_indexdef(i.indexrelid, k, true) FROM generate_series(1, i.indnkeyatts) k),
+           pg_get_expr(i.indpred, i.indrelid, true)
+    FROM pg_index i
+    JOIN pg_class ic ON ic.oid = i.indexrelid
+    JOIN pg_class t ON t.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    JOIN pg_am am ON am.oid = ic.relam
+    WHERE n.nspname = current_schema()
+    ORDER BY t.relname, ic.relname
+"""
+
+
+def _quote(identifier):
+    return identifier if _PLAIN_IDENTIFIER.match(identifier) else '"' + identifier.replace('"', '""') + '"'
+
+
+def _column_list(columns):
+    return ", ".join(_quote(c) for c in columns)
+
+
+class SchemaCatalog:
+    """
+    Snapshot of the tables of a PostgreSQL schema, read from information_schema and
+    pg_catalog.
+
+    `tables` maps each table name to its metadata, in the shape of the schemas of
+    ddl_parser.parse_ddl_to_schema (so get_primary_key / get_foreign_keys work on it),
+    with a few extra keys: 'primary_key', 'foreign_keys', 'unique_keys', 'row_estimate'
+    (from the planner statistics) and 'total_bytes'. `ddl` is the CREATE TABLE text
+    given to the LLM.
+    """
+
+    def __init__(self, schema, version, tables, seconds):
+        self.schema = schema
+        self.version = version
+        self.tables = tables
+        self.seconds = seconds
+        self.loaded_at = time.time()
+        self.ddl = self.ddl_for(tables)
+
+    def table_ddl(self, table_name):
+        """Returns the CREATE TABLE statement of a table, with its keys and foreign keys."""
+        table = self.tables[table_name]
+        lines = [f"  {_quote(c['name'])} {c['sql_type']}{'' if c['nullable'] else ' NOT NULL'}" for c in table['columns']]
+        lines += [f"  {constraint}" for constraint in table['constraints']]
+        return f"CREATE TABLE {_quote(table_name)} (\n" + ",\n".join(lines) + "\n);"
+
+    def ddl_for(self, table_names):
+        """Returns the CREATE TABLE statements of the given tables."""
+        return "".join(self.table_ddl(name) + "\n\n" for name in table_names if name in self.tables)
+
+
+def _introspect(conn):
+    tables = {}
+    with conn.cursor() as cur:
+        cur.execute(TABLES_QUERY)
+        for table_name, row_estimate, total_bytes in cur.fetchall():
+            if STAGING_TABLE_PATTERN.search(table_name):
+                continue
+            tables[table_name] = {
+                'table_name': table_name, 'columns': [], 'constraints': [], 'indexes': [],
+                'primary_key': [], 'foreign_keys': [], 'unique_keys': [],
+                'row_estimate': int(row_estimate), 'total_bytes': int(total_bytes)
+            }
+
+        cur.execute(COLUMNS_QUERY)
+        for table_name, column_name, sql_type, not_null in cur.fetchall():
+            if table_name in tables:
+                tables[table_name]['columns'].append({
+                    'name': column_name,
+                    'type': re.sub(r'\(.*?\)', '', sql_type).strip().upper(),
+                    'sql_type': sql_type.upper(),
+                    'nullable': not not_null,
+                    'primary_key': False,
+                    'unique': False
+                })
+
+        cur.execute(CONSTRAINTS_QUERY)
+        for table_name, name, kind, columns, ref_table, ref_columns, validated in cur.fetchall():
+            table = tables.get(table_name)
+            if table is None:
+                continue
+            if kind == 'p':
+                table['primary_key'] = columns
+                table['constraints'].append(f"PRIMARY KEY ({_column_list(columns)})")
+                for column in table['columns']:
+                    column['primary_key'] = column['name'] in columns
+            elif kind == 'u':
+                table['unique_keys'].append(columns)
+                table['constraints'].append(f"UNIQUE ({_column_list(columns)})")
+            else:
+                table['foreign_keys'].append({
+                    'name': name, 'columns': columns, 'ref_table': ref_table,
+                    'ref_columns': ref_columns, 'validated': validated
+                })
+                table['constraints'].append(
+                    f"FOREIGN KEY ({_column_list(columns)}) REFERENCES {_quote(ref_table)} ({_column_list(ref_columns)})"
+                )
+
+        cur.execute(INDEXES_QUERY)
+        for table_name, name, unique, primary, method, columns, where in cur.fetchall():
+            if table_name in tables:
+                tables[table_name]['indexes'].append({
+                    'name': name, 'unique': unique, 'primary': primary, 'method': method,
+                    'columns': ", ".join(columns), 'where': where
+                })
+    conn.commit()
+    return tables
+
+
+_catalogs = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def get_schema_catalog(refresh=False):
+    """
+    Returns the SchemaCatalog of the current session schema.
+
+    The catalog is read once and cached under the data version of the schema, so it is
+    only read again after the app loads or edits a table (or with `refresh`).
+    """
+    schema = get_current_schema()
+    with _lock:
+        schema_lock = _locks.setdefault(schema, threading.Lock())
+
+    with schema_lock:
+        # Read before introspecting: a table changed meanwhile invalidates the result at once
+        version = get_data_version()
+        catalog = _catalogs.get(schema)
+        if catalog is not None and catalog.version == version and not refresh:
+            return catalog
+
+        start = time.perf_counter()
+        with pooled_connection() as conn:
+            tables = _introspect(conn)
+        catalog = SchemaCatalog(schema, version, tables, time.perf_counter() - start)
+        with _lock:
+            _catalogs[schema] = catalog
+        return catalog
+
+
+def forget_catalog(schema):
+    """Drops the catalog cached for a schema that no longer exists."""
+    with _lock:
+        _catalogs.pop(schema, None)
+        _locks.pop(schema, None)
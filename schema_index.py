@@ -0,0 +1,245 @@
+# schema_index.py
+
+import os
+import re
+import math
+import hashlib
+import threading
+from collections import Counter, deque
+from ddl_parser import split_create_tables, parse_ddl_to_schema, get_foreign_keys
+from db_connector import get_current_schema
+
+SCHEMA_INDEX_ENABLED = os.getenv("SCHEMA_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+# Tables selected by relevance (join path tables are added on top of them)
+SCHEMA_INDEX_TOP_K = int(os.getenv("SCHEMA_INDEX_TOP_K", "8"))
+# Schemas with up to this many tables are always sent whole
+SCHEMA_INDEX_MIN_TABLES = int(os.getenv("SCHEMA_INDEX_MIN_TABLES", "12"))
+SCHEMA_INDEX_MAX_PATH = 3
+# Tables scoring below this share of the best score are not selected
+RELATIVE_SCORE_CUTOFF = 0.2
+
+# Field weights, applied by repeating the tokens of each field
+TABLE_NAME_WEIGHT = 3
+COLUMN_NAME_WEIGHT = 1
+NEIGHBOUR_WEIGHT = 1
+
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'for', 'to', 'by', 'with', 'and', 'or', 'is', 'are', 'was', 'were',
+    'what', 'which', 'who', 'whom', 'how', 'many', 'much', 'show', 'list', 'give', 'me', 'all', 'each', 'every',
+    'per', 'from', 'that', 'this', 'these', 'those', 'than', 'there', 'their', 'it', 'its', 'be', 'do', 'does',
+    'did', 'have', 'has', 'top', 'most', 'least', 'more', 'less', 'get', 'find', 'number', 'count', 'total',
+}
+# Acronyms first, so VARCHAR or HTTPStatus are not split into single letters
+_WORD_PATTERN = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+
+
+def _stem(token):
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 4 and token.endswith(('ses', 'xes', 'ches', 'shes')):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Splits identifiers and text into lowercase, roughly stemmed words (snake_case and camelCase aware)."""
+    tokens = []
+    for word in _WORD_PATTERN.findall(text.replace('_', ' ')):
+        word = word.lower()
+        if word not in STOPWORDS:
+            tokens.append(_stem(word))
+    return tokens
+
+
+class SchemaIndex:
+    """
+    BM25 index over the tables of a schema, used to send only the relevant part of a
+    large DDL to the model.
+
+    Each table is a document made of its name, its column names and types, and the
+    names of the tables it is linked to by foreign keys. update() re-tokenizes only the
+    tables whose DDL changed, so the index is maintained incrementally.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._ddl = {}
+        self._hashes = {}
+        self._order = []
+        self._term_freqs = {}
+        self._lengths = {}
+        self._document_freqs = Counter()
+        self._neighbours = {}
+        self._source_hash = None
+
+    def __len__(self):
+        return len(self._ddl)
+
+    def update(self, ddl_string):
+        """Synchronizes the index with the CREATE TABLE statements of `ddl_string`. Returns the changed tables."""
+        source_hash = hashlib.sha256(ddl_string.encode('utf-8')).hexdigest()
+        if source_hash == self._source_hash:
+            return []
+        statements = split_create_tables(ddl_string)
+        schemas = parse_ddl_to_schema("\n".join(statements.values()))
+
+        neighbours = {table: set() for table in statements}
+        for table, schema in schemas.items():
+            for fk in get_foreign_keys(schema):
+                if fk['ref_table'] in neighbours and fk['ref_table'] != table:
+                    neighbours[table].add(fk['ref_table'])
+                    neighbours[fk['ref_table']].add(table)
+
+        changed = []
+        with self._lock:
+            for table in [t for t in self._ddl if t not in statements]:
+                self._remove(table)
+                changed.append(table)
+
+            for table, statement in statements.items():
+                digest = hashlib.sha256(
+                    (statement + "\n" + ",".join(sorted(neighbours[table]))).encode('utf-8')
+                ).hexdigest()
+                if self._hashes.get(table) == digest:
+                    continue
+                self._remove(table)
+                self._add(table, statement, schemas.get(table), neighbours[table], digest)
+                changed.append(table)
+
+            self._order = list(statements)
+            self._neighbours = neighbours
+            self._source_hash = source_hash
+        return changed
+
+    def _add(self, table, statement, schema, neighbours, digest):
+        tokens = tokenize(table) * TABLE_NAME_WEIGHT
+        if schema is not None:
+            for column in schema['columns']:
+                tokens += tokenize(column['name']) * COLUMN_NAME_WEIGHT
+                tokens += tokenize(column['type'])
+        for neighbour in neighbours:
+            tokens += tokenize(neighbour) * NEIGHBOUR_WEIGHT
+
+        term_freqs = Counter(tokens)
+        self._ddl[table] = statement
+        self._hashes[table] = digest
+        self._term_freqs[table] = term_freqs
+        self._lengths[table] = len(tokens)
+        self._document_freqs.update(term_freqs.keys())
+
+    def _remove(self, table):
+        if table not in self._ddl:
+            return
+        self._document_freqs.subtract(self._term_freqs[table].keys())
+        self._document_freqs += Counter()
+        for store in (self._ddl, self._hashes, self._term_freqs, self._lengths):
+            del store[table]
+
+    def search(self, question):
+        """Returns [(table, score)] for the tables matching the question, best first."""
+        query_terms = set(tokenize(question))
+        with self._lock:
+            count = len(self._ddl)
+            if not count or not query_terms:
+                return []
+            average_length = sum(self._lengths.values()) / count
+            scores = []
+            for table, term_freqs in self._term_freqs.items():
+                score = 0.0
+                length_norm = self.k1 * (1 - self.b + self.b * self._lengths[table] / max(1.0, average_length))
+                for term in query_terms:
+                    freq = term_freqs.get(term)
+                    if not freq:
+                        continue
+                    document_freq = self._document_freqs[term]
+                    idf = math.log(1 + (count - document_freq + 0.5) / (document_freq + 0.5))
+                    score += idf * freq * (self.k1 + 1) / (freq + length_norm)
+                if score > 0:
+                    scores.append((table, score))
+        return sorted(scores, key=lambda item: item[1], reverse=True)
+
+    def _join_path(self, start, goal):
+        """Shortest foreign key path between two tables (at most SCHEMA_INDEX_MAX_PATH hops), or None."""
+        previous = {start: None}
+        queue = deque([(start, 0)])
+        while queue:
+            table, depth = queue.popleft()
+            if table == goal:
+                path = []
+                while table is not None:
+                    path.append(table)
+                    table = previous[table]
+                return path[::-1]
+            if depth >= SCHEMA_INDEX_MAX_PATH:
+                continue
+            for neighbour in self._neighbours.get(table, ()):
+                if neighbour not in previous:
+                    previous[neighbour] = table
+                    queue.append((neighbour, depth + 1))
+        return None
+
+    def select_tables(self, question, top_k=SCHEMA_INDEX_TOP_K):
+        """
+        Returns the tables relevant to the question: the `top_k` best BM25 matches plus
+        the tables on the foreign key paths that join them. When nothing matches, the
+        `top_k` most connected tables are returned.
+        """
+        ranked = self.search(question)
+        if ranked:
+            best = ranked[0][1]
+            selected = [table for table, score in ranked[:top_k] if score >= best * RELATIVE_SCORE_CUTOFF]
+        else:
+            with self._lock:
+                selected = sorted(self._order, key=lambda t: len(self._neighbours.get(t, ())), reverse=True)[:top_k]
+
+        with self._lock:
+            tables = set(selected)
+            for i, start in enumerate(selected):
+                for goal in selected[i + 1:]:
+                    path = self._join_path(start, goal)
+                    if path:
+                        tables.update(path)
+            return [table for table in self._order if table in tables]
+
+    def pruned_ddl(self, question, top_k=SCHEMA_INDEX_TOP_K):
+        """Returns the DDL of the tables selected for the question, in their original order."""
+        tables = self.select_tables(question, top_k)
+        with self._lock:
+            return "\n\n".join(self._ddl[table] for table in tables)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_schema_index():
+    """Returns the schema index of the current session schema."""
+    schema = get_current_schema()
+    with _indexes_lock:
+        if schema not in _indexes:
+            _indexes[schema] = SchemaIndex()
+        return _indexes[schema]
+
+
+def prune_schema_ddl(question, ddl_string, top_k=SCHEMA_INDEX_TOP_K):
+    """
+    Returns the part of `ddl_string` relevant to the question. Small schemas (up to
+    SCHEMA_INDEX_MIN_TABLES tables) are returned unchanged.
+    """
+    if not SCHEMA_INDEX_ENABLED:
+        return ddl_string
+    index = get_schema_index()
+    index.update(ddl_string)
+    if len(index) <= max(SCHEMA_INDEX_MIN_TABLES, top_k):
+        return ddl_string
+    return index.pruned_ddl(question, top_k)
+
+
+def forget_schema_index(schema):
+    """Drops the index kept for a schema that no longer exists."""
+    with _indexes_lock:
+        _indexes.pop(schema, None)
@@ -0,0 +1,253 @@
+# session_schemas.py
+
+import os
+import time
+import uuid
+import threading
+import psycopg2
+import psycopg2.errors
+from psycopg2 import sql
+from db_connector import pooled_connection, set_current_schema, set_missing_schema_handler
+from data_versions import forget_schema
+from schema_catalog import forget_catalog
+from schema_index import forget_schema_index
+from data_export import forget_archives
+
+SESSION_SCHEMAS_ENABLED = os.getenv("SESSION_SCHEMAS_ENABLED", "true").lower() in ("1", "true", "yes")
+SESSION_SCHEMA_PREFIX = os.getenv("SESSION_SCHEMA_PREFIX", "sess_")
+# Idle seconds after which a session schema and its tables are dropped
+SESSION_SCHEMA_TTL = float(os.getenv("SESSION_SCHEMA_TTL", str(6 * 3600)))
+SESSION_SCHEMA_MAX_COUNT = int(os.getenv("SESSION_SCHEMA_MAX_COUNT", "100"))
+SESSION_SCHEMA_MAX_BYTES = int(os.getenv("SESSION_SCHEMA_MAX_BYTES", str(10 * 1024 ** 3)))
+SESSION_SCHEMA_GC_INTERVAL = float(os.getenv("SESSION_SCHEMA_GC_INTERVAL", "300"))
+# Minimum seconds between two last-used updates of the same schema
+TOUCH_INTERVAL = 60
+REGISTRY_TABLE = "app_session_schemas"
+# Serializes garbage collection across app processes sharing the database
+GC_LOCK_KEY = 72140514
+
+_lock = threading.Lock()
+_last_touch = {}
+# Schemas recreated after a statement failed in them, not yet reported by activate_session_schema()
+_recreated = set()
+_last_gc = 0.0
+_registry_ready = False
+
+
+class SessionSchemaLimitError(RuntimeError):
+    """Raised when a new session schema would exceed SESSION_SCHEMA_MAX_COUNT."""
+
+
+def new_session_schema():
+    """Returns a fresh, unique schema name for a new user session."""
+    return f"{SESSION_SCHEMA_PREFIX}{uuid.uuid4().hex[:12]}"
+
+
+def _ensure_registry(conn):
+    """Creates the registry of session schemas (once per process) and commits."""
+    global _registry_ready
+    if _registry_ready:
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS public.{} ("
+                "schema_name TEXT PRIMARY KEY, created TIMESTAMPTZ NOT NULL DEFAULT now(), "
+                "last_used TIMESTAMPTZ NOT NULL DEFAULT now())"
+            ).format(sql.Identifier(REGISTRY_TABLE)))
+        conn.commit()
+    except psycopg2.errors.UniqueViolation:
+        # Another process created it at the same time
+        conn.rollback()
+    _registry_ready = True
+
+
+def activate_session_schema(schema):
+    """
+    Makes `schema` the search_path of every pooled connection used by the current
+    session, creating it if needed. Returns True when the schema had to be created
+    (a new session, or one whose schema was garbage-collected after being idle).
+
+    The schema is only checked and its last use recorded once per TOUCH_INTERVAL, so
+    calling this on every Streamlit rerun is cheap. Raises SessionSchemaLimitError when
+    SESSION_SCHEMA_MAX_COUNT schemas are in use.
+    """
+    if not SESSION_SCHEMAS_ENABLED or not schema:
+        return False
+    set_current_schema(schema)
+
+    now = time.monotonic()
+    with _lock:
+        if schema in _recreated:
+            _recreated.discard(schema)
+            return True
+        if now - _last_touch.get(schema, float('-inf')) < TOUCH_INTERVAL:
+            return False
+        _last_touch[schema] = now
+
+    try:
+        created = _touch(schema)
+    except Exception:
+        with _lock:
+            _last_touch.pop(schema, None)
+        raise
+    maybe_collect_garbage()
+    return created
+
+
+def recover_session_schema(schema):
+    """
+    Called when a statement fails because `schema` or one of its tables does not exist,
+    e.g. after another app process garbage-collected the schema within TOUCH_INTERVAL
+    of its last check. The registry is re-checked right away and a dropped schema is
+    recreated, so later writes of the session do not fail; the next
+    activate_session_schema() then returns True. Returns True when it was recreated.
+    """
+    if not SESSION_SCHEMAS_ENABLED or not schema.startswith(SESSION_SCHEMA_PREFIX):
+        return False
+    with _lock:
+        _last_touch[schema] = time.monotonic()
+    try:
+        created = _touch(schema)
+    except Exception:
+        with _lock:
+            _last_touch.pop(schema, None)
+        raise
+
+    if created:
+        _forget(schema)
+        with _lock:
+            _recreated.add(schema)
+    return created
+
+
+set_missing_schema_handler(recover_session_schema)
+
+
+def _forget(schema):
+    """Drops what this process cached about a schema that was dropped."""
+    forget_schema(schema)
+    forget_catalog(schema)
+    forget_schema_index(schema)
+    forget_archives(schema)
+
+
+def _schema_status(schema):
+    """Returns (exists, number of other registered schemas)."""
+    with pooled_connection(schema='public') as conn, conn.cursor() as cur:
+        _ensure_registry(conn)
+        cur.execute("SELECT 1 FROM pg_namespace WHERE nspname = %s", (schema,))
+        exists = cur.fetchone() is not None
+        cur.execute(
+            sql.SQL("SELECT count(*) FROM public.{} WHERE schema_name <> %s").format(sql.Identifier(REGISTRY_TABLE)),
+            (schema,)
+        )
+        others = cur.fetchone()[0]
+        conn.commit()
+    return exists, others
+
+
+def _touch(schema):
+    exists, others = _schema_status(schema)
+    if not exists and others >= SESSION_SCHEMA_MAX_COUNT:
+        collect_garbage()
+        exists, others = _schema_status(schema)
+        if not exists and others >= SESSION_SCHEMA_MAX_COUNT:
+            raise SessionSchemaLimitError(
+                f"The limit of {SESSION_SCHEMA_MAX_COUNT} concurrent sessions has been reached. Please try again later."
+            )
+
+    with pooled_connection(schema='public') as conn, conn.cursor() as cur:
+        # Registered in the same transaction, so garbage collection never sees an unregistered schema
+        cur.execute(
+            sql.SQL(
+                "INSERT INTO public.{} (schema_name) VALUES (%s) "
+                "ON CONFLICT (schema_name) DO UPDATE SET last_used = now()"
+            ).format(sql.Identifier(REGISTRY_TABLE)),
+            (schema,)
+        )
+        if not exists:
+            cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema)))
+        conn.commit()
+    return not exists
+
+
+def schema_sizes():
+    """Returns {schema: bytes} of the tables (with indexes and TOAST) in every session schema."""
+    with pooled_connection(schema='public') as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT n.nspname, COALESCE(SUM(pg_total_relation_size(c.oid)), 0)
+            FROM pg_namespace n
+            LEFT JOIN pg_class c ON c.relnamespace = n.oid AND c.relkind IN ('r', 'm')
+            WHERE n.nspname LIKE %s
+            GROUP BY n.nspname
+            """,
+            (SESSION_SCHEMA_PREFIX.replace('_', r'\_') + '%',)
+        )
+        return {name: int(size) for name, size in cur.fetchall()}
+
+
+def check_storage_budget():
+    """
+    Returns an error message when the session schemas together use more than
+    SESSION_SCHEMA_MAX_BYTES (after dropping the expired ones), or None.
+    """
+    if not SESSION_SCHEMAS_ENABLED:
+        return None
+    total = sum(schema_sizes().values())
+    if total > SESSION_SCHEMA_MAX_BYTES:
+        collect_garbage()
+        total = sum(schema_sizes().values())
+    if total > SESSION_SCHEMA_MAX_BYTES:
+        return (f"The database storage limit for session data ({SESSION_SCHEMA_MAX_BYTES // 1024 ** 2} MB) "
+                "has been reached. Please try again later.")
+    return None
+
+
+def maybe_collect_garbage():
+    """Runs collect_garbage() at most once every SESSION_SCHEMA_GC_INTERVAL seconds per process."""
+    global _last_gc
+    now = time.monotonic()
+    with _lock:
+        if now - _last_gc < SESSION_SCHEMA_GC_INTERVAL:
+            return []
+        _last_gc = now
+    try:
+        return collect_garbage()
+    except (ConnectionError, psycopg2.Error) as e:
+        print(f"Session schema garbage collection failed: {e}", flush=True)
+        return []
+
+
+def collect_garbage(ttl=SESSION_SCHEMA_TTL):
+    """
+    Drops the session schemas (and everything in them) that have not been used for
+    `ttl` seconds. Only one app process collects at a time. Returns the dropped schemas.
+    """
+    dropped = []
+    with pooled_connection(schema='public') as conn, conn.cursor() as cur:
+        _ensure_registry(conn)
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (GC_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return dropped
+        cur.execute(
+            sql.SQL("SELECT schema_name FROM public.{} WHERE last_used < now() - %s * interval '1 second'").format(
+                sql.Identifier(REGISTRY_TABLE)),
+            (ttl,)
+        )
+        for (schema,) in cur.fetchall():
+            cur.execute(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+            cur.execute(sql.SQL("DELETE FROM public.{} WHERE schema_name = %s").format(sql.Identifier(REGISTRY_TABLE)),
+                        (schema,))
+            dropped.append(schema)
+        conn.commit()
+
+    for schema in dropped:
+        _forget(schema)
+        with _lock:
+            _last_touch.pop(schema, None)
+    if dropped:
+        print(f"Dropped {len(dropped)} idle session schema(s): {', '.join(dropped)}", flush=True)
+    return dropped
@@ -0,0 +1,243 @@
+# sql_guard.py
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import psycopg2
+from db_connector import pooled_connection, configure_transaction, get_current_schema, DB_MAX_RESULT_ROWS
+from data_versions import get_data_version
+from instrumentation import instrumented
+
+SQL_GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "true").lower() in ("1", "true", "yes")
+# Budgets checked against the EXPLAIN estimates (PostgreSQL cost units and rows)
+SQL_GUARD_MAX_COST = float(os.getenv("SQL_GUARD_MAX_COST", "5000000"))
+SQL_GUARD_MAX_ROWS = float(os.getenv("SQL_GUARD_MAX_ROWS", "10000000"))
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "30000"))
+# One row more than the pager fetches, so it can still tell that a result was truncated
+SQL_GUARD_AUTO_LIMIT = DB_MAX_RESULT_ROWS + 1
+# Outcomes of guard_query() kept for a query that is checked again shortly (validated
+# after generation, then guarded when it runs) while the data of the schema is unchanged
+GUARD_MEMO_SECONDS = 60.0
+GUARD_MEMO_SIZE = 128
+
+# String literals, quoted identifiers and comments, which may contain any keyword
+_LITERAL_PATTERN = re.compile(
+    r"""(?P<dollar>\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$)"""
+    r"""|(?P<string>[EeBbXxNn]?'(?:[^']|'')*')"""
+    r"""|(?P<identifier>"(?:[^"]|"")*")"""
+    r"""|(?P<line_comment>--[^\n]*)"""
+    r"""|(?P<block_comment>/\*.*?\*/)""",
+    re.DOTALL
+)
+# Statements other than SELECT at the start of the query or of a CTE body ("name AS [NOT] [MATERIALIZED] (");
+# elsewhere these words may be column names, and the READ ONLY transaction catches any other write
+_WRITE_STATEMENTS = re.compile(
+    r'(?:^\(*|\bAS\s*\(|\bAS\s+(?:NOT\s+)?MATERIALIZED\s*\()\s*(INSERT|UPDATE|DELETE|MERGE|CREATE|ALTER|DROP|TRUNCATE|GRANT|REVOKE|COPY|VACUUM|ANALYZE|'
+    r'CLUSTER|REINDEX|REFRESH|CALL|DO|LOCK|SET|RESET|COMMENT|LISTEN|NOTIFY|PREPARE|EXECUTE|DEALLOCATE|DISCARD|'
+    r'CHECKPOINT|LOAD|BEGIN|COMMIT|ROLLBACK|SAVEPOINT)\b',
+    re.IGNORECASE
+)
+_LOCKING_CLAUSE = re.compile(r'\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b', re.IGNORECASE)
+_SELECT_INTO = re.compile(r'\bINTO\b', re.IGNORECASE)
+# Functions that sleep, touch the server or other sessions, or write despite a SELECT
+_BLOCKED_FUNCTIONS = re.compile(
+    r'\b(pg_sleep\w*|pg_read_\w+|pg_ls_\w+|pg_stat_file|pg_terminate_backend|pg_cancel_backend|pg_reload_conf|'
+    r'pg_rotate_logfile|pg_advisory\w*|pg_try_advisory\w*|lo_\w+|dblink\w*|set_config|nextval|setval|'
+    r'txid_current|pg_notify|query_to_xml\w*|table_to_xml\w*|database_to_xml\w*)\s*\(',
+    re.IGNORECASE
+)
+_TOP_LEVEL_LIMIT = re.compile(r'\b(?:LIMIT|FETCH\s+(?:FIRST|NEXT))\b', re.IGNORECASE)
+
+
+class SqlGuardError(ValueError):
+    """Raised when a query is rejected. `reasons` lists every problem found."""
+
+    def __init__(self, reasons):
+        self.reasons = list(reasons)
+        super().__init__("The query was rejected: " + "; ".join(self.reasons))
+
+
+def _mask_literals(sql_query):
+    """Replaces literals and quoted identifiers with placeholders and removes comments."""
+    def replace(match):
+        if match.group('line_comment') or match.group('block_comment'):
+            return ' '
+        if match.group('identifier'):
+            return ' _ident_ '
+        return " '' "
+    return _LITERAL_PATTERN.sub(replace, sql_query)
+
+
+def _mask_keeping_positions(sql_query):
+    """Like _mask_literals, but every literal keeps its length and line comments are kept."""
+    def replace(match):
+        if match.group('line_comment'):
+            return match.group(0)
+        return (' ' if match.group('block_comment') else '_') * len(match.group(0))
+    return _LITERAL_PATTERN.sub(replace, sql_query)
+
+
+def _top_level(masked):
+    """Returns `masked` with everything inside parentheses removed."""
+    depth = 0
+    chars = []
+    for char in masked:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(0, depth - 1)
+        elif depth == 0:
+            chars.append(char)
+    return "".join(chars)
+
+
+def strip_statement(sql_query):
+    """Removes trailing semicolons, comments and whitespace around a single statement."""
+    sql_query = sql_query.strip()
+    # Found on the masked text, so a -- or ; inside a literal is not taken for the end
+    masked = _mask_keeping_positions(sql_query)
+    while True:
+        stripped = re.sub(r'(?:\s*(?:--[^\n]*|;))+\s*$', '', masked)
+        if stripped == masked:
+            return sql_query[:len(masked)].rstrip()
+        masked = stripped
+
+
+def check_read_only(sql_query):
+    """Returns the reasons why the query is not a single read-only SELECT (empty when it is)."""
+    masked = _mask_literals(strip_statement(sql_query)).strip()
+    reasons = []
+    if not masked:
+        return ["the query is empty"]
+    if ';' in masked:
+        reasons.append("only a single statement is allowed")
+    if not re.match(r'^\(*\s*(SELECT|WITH|VALUES|TABLE)\b', masked, re.IGNORECASE):
+        reasons.append("only SELECT queries are allowed")
+
+    keywords = sorted({k.upper() for k in _WRITE_STATEMENTS.findall(masked)})
+    if keywords:
+        reasons.append(f"write or session statements are not allowed ({', '.join(keywords)})")
+    if _LOCKING_CLAUSE.search(masked):
+        reasons.append("row locking clauses (FOR UPDATE/SHARE) are not allowed")
+    if _SELECT_INTO.search(masked):
+        reasons.append("SELECT ... INTO is not allowed")
+    functions = sorted({f.lower() for f in _BLOCKED_FUNCTIONS.findall(masked)})
+    if functions:
+        reasons.append(f"these functions are not allowed: {', '.join(functions)}")
+    return reasons
+
+
+def add_limit(sql_query, limit=SQL_GUARD_AUTO_LIMIT):
+    """Wraps the query in a LIMIT when it has none at the top level."""
+    sql_query = strip_statement(sql_query)
+    if _TOP_LEVEL_LIMIT.search(_top_level(_mask_literals(sql_query))):
+        return sql_query
+    return f"SELECT * FROM (\n{sql_query}\n) AS guarded_query LIMIT {int(limit)}"
+
+
+@instrumented('sql.explain')
+def explain(sql_query, limited=False, statement_timeout_ms=SQL_STATEMENT_TIMEOUT_MS):
+    """
+    Returns the estimated total cost and result rows of the query from EXPLAIN. When
+    `limited` (the query was wrapped by add_limit), the rows are those the query would
+    produce without that LIMIT. Raises psycopg2.Error when the query does
+    not plan, e.g. on a syntax error or an unknown column.
+    """
+    with pooled_connection() as conn, conn.cursor() as cur:
+        configure_transaction(cur, read_only=True, statement_timeout_ms=statement_timeout_ms)
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql_query)
+        plan = cur.fetchone()[0][0]['Plan']
+        conn.rollback()
+
+    rows = plan['Plan Rows']
+    if limited and plan['Node Type'] == 'Limit' and plan.get('Plans'):
+        rows = plan['Plans'][0]['Plan Rows']
+    return {'cost': plan['Total Cost'], 'rows': rows}
+
+
+_memo_lock = threading.Lock()
+# key -> (time, (query, estimates) or SqlGuardError)
+_memo = OrderedDict()
+
+
+def guard_query(sql_query, max_cost=SQL_GUARD_MAX_COST, max_rows=SQL_GUARD_MAX_ROWS,
+                limit=SQL_GUARD_AUTO_LIMIT, statement_timeout_ms=SQL_STATEMENT_TIMEOUT_MS):
+    """
+    Checks a query produced by the LLM before it runs: it must be a single read-only
+    SELECT, and its EXPLAIN estimates must fit the cost and row budgets. Returns
+    (query to execute, estimates), the query having a LIMIT added when it had none.
+    Raises SqlGuardError with the reasons of a rejection.
+
+    The outcome is reused for GUARD_MEMO_SECONDS while the tables of the schema are
+    unchanged, so a query validated by nl_to_sql() is not explained again when it runs.
+    """
+    key = (get_current_schema(), get_data_version(), sql_query, max_cost, max_rows, limit, statement_timeout_ms)
+    now = time.monotonic()
+    with _memo_lock:
+        memo = _memo.get(key)
+        if memo is not None and now - memo[0] < GUARD_MEMO_SECONDS:
+            _memo.move_to_end(key)
+            outcome = memo[1]
+        else:
+            outcome = None
+    if isinstance(outcome, SqlGuardError):
+        raise SqlGuardError(outcome.reasons)
+    if outcome is not None:
+        return outcome
+
+    try:
+        outcome = _guard_query(sql_query, max_cost, max_rows, limit, statement_timeout_ms)
+    except SqlGuardError as e:
+        _remember(key, now, e)
+        raise
+    _remember(key, now, outcome)
+    return outcome
+
+
+def _remember(key, now, outcome):
+    with _memo_lock:
+        _memo[key] = (now, outcome)
+        _memo.move_to_end(key)
+        while len(_memo) > GUARD_MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def _guard_query(sql_query, max_cost, max_rows, limit, statement_timeout_ms):
+    reasons = check_read_only(sql_query)
+    if reasons:
+        raise SqlGuardError(reasons)
+
+    guarded_query = add_limit(sql_query, limit)
+    try:
+        estimates = explain(guarded_query, guarded_query != strip_statement(sql_query), statement_timeout_ms)
+    except psycopg2.Error as e:
+        raise SqlGuardError([f"the query is not valid: {str(e).strip().splitlines()[0]}"]) from e
+
+    if estimates['cost'] > max_cost:
+        reasons.append(f"its estimated cost ({estimates['cost']:,.0f}) exceeds the budget of {max_cost:,.0f}")
+    if estimates['rows'] > max_rows:
+        reasons.append(f"it would produce about {estimates['rows']:,.0f} rows (budget: {max_rows:,.0f}), "
+                       "check for a missing join condition")
+    if reasons:
+        raise SqlGuardError(reasons)
+    return guarded_query, estimates
+
+
+def validate_query(sql_query):
+    """
+    Returns the problems that would stop a query from running, without running it
+    (an empty list when there are none): the guard's rejection reasons, or just the
+    EXPLAIN error when the guard is disabled.
+    """
+    try:
+        if SQL_GUARD_ENABLED:
+            guard_query(sql_query)
+        else:
+            explain(strip_statement(sql_query))
+    except SqlGuardError as e:
+        return e.reasons
+    except psycopg2.Error as e:
+        return [str(e).strip().splitlines()[0]]
+    return []
@@ -0,0 +1,268 @@
+# synthetic_sampler.py
+
+import zlib
+import numpy as np
+import pandas as pd
+
+MAX_VOCABULARY = 500
+MAX_TEXT_WORDS = 50
+
+SPEC_GRAMMAR = """
+Return ONLY a JSON object {"columns": {COLUMN_NAME: SPEC, ...}} with one SPEC per column, where SPEC is one of:
+  {"generator": "sequence", "start": INT, "step": INT}
+  {"generator": "integer", "min": INT, "max": INT, "distribution": "uniform" | "normal" | "lognormal"}
+  {"generator": "float", "min": NUM, "max": NUM, "distribution": "uniform" | "normal" | "lognormal", "decimals": INT}
+  {"generator": "choice", "values": [v1, v2, ...], "weights": [w1, w2, ...]?}
+  {"generator": "boolean", "true_rate": 0..1}
+  {"generator": "date", "start": "YYYY-MM-DD", "end": "YYYY-MM-DD"}
+  {"generator": "timestamp", "start": "YYYY-MM-DDTHH:MM:SS", "end": "YYYY-MM-DDTHH:MM:SS"}
+  {"generator": "text", "words": [w1, w2, ...], "min_words": INT, "max_words": INT}
+  {"generator": "template", "template": "user{n}@example.com", "start": INT}
+  {"generator": "concat", "parts": [SPEC, SPEC, ...], "separator": " "}
+Any SPEC may include "null_rate": 0..1 (only for nullable columns).
+"choice" values must be realistic for the column (up to 100 of them, e.g. real first names or
+product categories), with weights reflecting how common each one is. "template" replaces {n} with a
+unique, increasing number. Primary key columns must use "sequence" or "template" so they are unique.
+Foreign key columns may be omitted: they are filled with the key values of the referenced table.
+"""
+
+INTEGER_TYPES = ('INT', 'SERIAL')
+FLOAT_TYPES = ('NUMERIC', 'DECIMAL', 'FLOAT', 'DOUBLE', 'REAL', 'MONEY')
+GENERATORS = ('sequence', 'integer', 'float', 'choice', 'boolean', 'date', 'timestamp', 'text', 'template', 'concat')
+
+
+def table_seed(seed, table_name):
+    """Derives a stable per-table seed, so each table is reproducible independently of the others."""
+    if seed is None:
+        return None
+    return [int(seed), zlib.crc32(table_name.encode('utf-8'))]
+
+
+def default_column_spec(column):
+    """Type-based spec used for columns the LLM spec omits or gets wrong."""
+    col_type = column['type']
+    if column.get('primary_key'):
+        if any(t in col_type for t in INTEGER_TYPES):
+            return {'generator': 'sequence', 'start': 1, 'step': 1}
+        return {'generator': 'template', 'template': column['name'] + '_{n}', 'start': 1}
+    if any(t in col_type for t in INTEGER_TYPES):
+        return {'generator': 'integer', 'min': 0, 'max': 1000}
+    if any(t in col_type for t in FLOAT_TYPES):
+        return {'generator': 'float', 'min': 0, 'max': 1000, 'decimals': 2}
+    if 'BOOL' in col_type:
+        return {'generator': 'boolean', 'true_rate': 0.5}
+    if 'TIMESTAMP' in col_type or 'DATETIME' in col_type:
+        return {'generator': 'timestamp', 'start': '2020-01-01T00:00:00', 'end': '2025-12-31T23:59:59'}
+    if 'DATE' in col_type:
+        return {'generator': 'date', 'start': '2020-01-01', 'end': '2025-12-31'}
+    return {'generator': 'template', 'template': column['name'] + ' {n}', 'start': 1}
+
+
+def _number(spec, field, default):
+    value = spec.get(field, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"'{field}' must be a number.")
+    return value
+
+
+def _validate_column_spec(spec, column=None):
+    """Checks one column spec and returns a normalized copy. Raises ValueError when invalid."""
+    if not isinstance(spec, dict):
+        raise ValueError("The spec must be an object.")
+    generator = spec.get('generator')
+    if generator not in GENERATORS:
+        raise ValueError(f"Unknown generator '{generator}'.")
+    normalized = {'generator': generator}
+
+    if generator == 'sequence':
+        normalized['start'] = int(_number(spec, 'start', 1))
+        normalized['step'] = int(_number(spec, 'step', 1)) or 1
+    elif generator in ('integer', 'float'):
+        low, high = _number(spec, 'min', 0), _number(spec, 'max', 1000)
+        if low > high:
+            low, high = high, low
+        normalized.update(min=low, max=high, distribution=spec.get('distribution', 'uniform'))
+        if normalized['distribution'] not in ('uniform', 'normal', 'lognormal'):
+            raise ValueError(f"Unknown distribution '{normalized['distribution']}'.")
+        if generator == 'float':
+            normalized['decimals'] = int(_number(spec, 'decimals', 2))
+    elif generator == 'choice':
+        values = spec.get('values')
+        if not isinstance(values, list) or not values or len(values) > MAX_VOCABULARY:
+            raise ValueError(f"'values' must be a list of 1 to {MAX_VOCABULARY} values.")
+        normalized['values'] = values
+        weights = spec.get('weights')
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            if len(weights) != len(values) or (weights < 0).any() or weights.sum() <= 0:
+                raise ValueError("'weights' must be non-negative and match 'values'.")
+            normalized['weights'] = (weights / weights.sum()).tolist()
+    elif generator == 'boolean':
+        normalized['true_rate'] = min(1.0, max(0.0, float(_number(spec, 'true_rate', 0.5))))
+    elif generator in ('date', 'timestamp'):
+        unit = 'D' if generator == 'date' else 's'
+        start = np.datetime64(pd.Timestamp(spec.get('start', '2020-01-01')), unit)
+        end = np.datetime64(pd.Timestamp(spec.get('end', '2025-12-31')), unit)
+        normalized.update(start=min(start, end), end=max(start, end))
+    elif generator == 'text':
+        words = spec.get('words')
+        if not isinstance(words, list) or not words or len(words) > MAX_VOCABULARY:
+            raise ValueError(f"'words' must be a list of 1 to {MAX_VOCABULARY} words.")
+        min_words = max(1, int(_number(spec, 'min_words', 1)))
+        max_words = min(MAX_TEXT_WORDS, max(min_words, int(_number(spec, 'max_words', min_words))))
+        normalized.update(words=[str(w) for w in words], min_words=min_words, max_words=max_words)
+    elif generator == 'template':
+        template = spec.get('template')
+        if not isinstance(template, str) or '{n}' not in template:
+            raise ValueError("'template' must be a string containing {n}.")
+        normalized.update(template=template, start=int(_number(spec, 'start', 1)))
+    elif generator == 'concat':
+        parts = spec.get('parts')
+        if not isinstance(parts, list) or not parts:
+            raise ValueError("'parts' must be a non-empty list of specs.")
+        normalized['parts'] = [_validate_column_spec(part) for part in parts]
+        normalized['separator'] = str(spec.get('separator', ' '))
+
+    null_rate = float(_number(spec, 'null_rate', 0.0))
+    if column is not None and (not column['nullable'] or column.get('primary_key')):
+        null_rate = 0.0
+    normalized['null_rate'] = min(1.0, max(0.0, null_rate))
+    return normalized
+
+
+def validate_table_spec(spec, schema, foreign_key_columns=()):
+    """
+    Normalizes the LLM spec of a table against its parsed schema.
+
+    Returns ({column: spec}, warnings). Columns with a missing or invalid spec fall
+    back to a type-based default, and primary key columns are forced onto a unique
+    generator. Foreign key columns are left out: they are sampled from the parent table.
+    """
+    column_specs = spec.get('columns', {}) if isinstance(spec, dict) else {}
+    if not isinstance(column_specs, dict):
+        column_specs = {}
+    column_specs = {str(name).lower(): value for name, value in column_specs.items()}
+
+    normalized = {}
+    warnings = []
+    for column in schema['columns']:
+        name = column['name']
+        if name in foreign_key_columns:
+            continue
+        try:
+            if name not in column_specs:
+                raise ValueError("no spec was returned")
+            column_spec = _validate_column_spec(column_specs[name], column)
+            if column.get('primary_key') and column_spec['generator'] not in ('sequence', 'template'):
+                raise ValueError("primary keys need a unique generator")
+        except (ValueError, TypeError) as e:
+            warnings.append(f"{name}: {e}; using a default spec.")
+            column_spec = _validate_column_spec(default_column_spec(column), column)
+        normalized[name] = column_spec
+    return normalized, warnings
+
+
+def _bounded(rng, spec, size):
+    low, high = spec['min'], spec['max']
+    if spec['distribution'] == 'normal':
+        values = rng.normal((low + high) / 2, max((high - low) / 6, 1e-9), size)
+    elif spec['distribution'] == 'lognormal':
+        # Right-skewed values (prices, amounts) scaled so most of them fall in [min, max]
+        values = low + rng.lognormal(0.0, 0.75, size) / np.exp(0.75 * 2.5) * (high - low)
+    else:
+        values = rng.uniform(low, high if spec['generator'] == 'float' else high + 1, size)
+    return np.clip(values, low, high)
+
+
+def _sample_values(rng, spec, size):
+    generator = spec['generator']
+    if generator == 'sequence':
+        return spec['start'] + spec['step'] * np.arange(size, dtype=np.int64)
+    if generator == 'integer':
+        return np.floor(_bounded(rng, spec, size)).astype(np.int64)
+    if generator == 'float':
+        return np.round(_bounded(rng, spec, size), spec['decimals'])
+    if generator == 'choice':
+        values = np.empty(len(spec['values']), dtype=object)
+        values[:] = spec['values']
+        return values[rng.choice(len(values), size, p=spec.get('weights'))]
+    if generator == 'boolean':
+        return rng.random(size) < spec['true_rate']
+    if generator in ('date', 'timestamp'):
+        start, end = spec['start'], spec['end']
+        offsets = rng.integers(0, (end - start).astype(np.int64) + 1, size)
+        return start + offsets.astype(f"timedelta64[{'D' if generator == 'date' else 's'}]")
+    if generator == 'text':
+        words = np.array(spec['words'], dtype=object)
+        counts = rng.integers(spec['min_words'], spec['max_words'] + 1, size)
+        picks = words[rng.integers(0, len(words), (size, spec['max_words']))]
+        text = pd.Series(picks[:, 0])
+        for position in range(1, spec['max_words']):
+            text = text + np.where(counts > position, " " + picks[:, position], "")
+        return text.str.capitalize().to_numpy(dtype=object)
+    if generator == 'template':
+        numbers = pd.Series(np.arange(spec['start'], spec['start'] + size, dtype=np.int64)).astype(str)
+        pieces = spec['template'].split('{n}')
+        text = pd.Series([pieces[0]] * size, dtype=object)
+        for piece in pieces[1:]:
+            text = text + numbers + piece
+        return text.to_numpy(dtype=object)
+    if generator == 'concat':
+        text = None
+        for part in spec['parts']:
+            values = pd.Series(_sample_values(rng, part, size)).astype(str)
+            text = values if text is None else text + spec['separator'] + values
+        return text.to_numpy(dtype=object)
+    raise ValueError(f"Unknown generator '{generator}'.")
+
+
+def _apply_nulls(rng, values, null_rate):
+    if null_rate <= 0:
+        return values
+    mask = rng.random(len(values)) < null_rate
+    if not mask.any():
+        return values
+    series = pd.Series(values)
+    if series.dtype == bool or pd.api.types.is_integer_dtype(series):
+        series = series.astype('boolean' if series.dtype == bool else 'Int64')
+    return series.mask(mask).to_numpy()
+
+
+def sample_table(schema, column_specs, num_rows, seed=None, foreign_keys=(), parent_data=None):
+    """
+    Synthesizes `num_rows` rows of a table from its normalized column specs.
+
+    Every column is drawn with one vectorized NumPy call, so millions of rows take
+    seconds. The same seed always produces the same rows. Foreign key columns take
+    values sampled from the referenced columns of `parent_data` ({table: DataFrame});
+    when the parent has no rows they are left NULL.
+    """
+    rng = np.random.default_rng(seed)
+    parent_data = parent_data or {}
+    columns = {}
+
+    for fk in foreign_keys:
+        parent_df = parent_data.get(fk['ref_table'])
+        usable = (
+            parent_df is not None and 'Error' not in parent_df.columns and not parent_df.empty
+            and all(c in parent_df.columns for c in fk['ref_columns'])
+        )
+        if usable:
+            # Composite keys are sampled as whole rows so the referenced tuple exists
+            keys = parent_df[fk['ref_columns']].dropna().drop_duplicates()
+            picks = rng.integers(0, len(keys), num_rows) if len(keys) else None
+        for column, ref_column in zip(fk['columns'], fk['ref_columns']):
+            if usable and picks is not None:
+                columns[column] = keys[ref_column].to_numpy()[picks]
+            else:
+                columns[column] = np.full(num_rows, None, dtype=object)
+
+    by_name = {c['name']: c for c in schema['columns']}
+    for name, spec in column_specs.items():
+        values = _sample_values(rng, spec, num_rows)
+        if by_name.get(name, {}).get('nullable', True):
+            values = _apply_nulls(rng, values, spec['null_rate'])
+        columns[name] = values
+
+    ordered = [c['name'] for c in schema['columns'] if c['name'] in columns]
+    return pd.DataFrame({name: columns[name] for name in ordered})
@@ -0,0 +1,261 @@
+# table_store.py
+
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+import weakref
+from collections.abc import MutableMapping
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# In-memory budgets of the generated tables, per browser session and for the whole process
+TABLE_STORE_SESSION_BYTES = int(os.getenv("TABLE_STORE_SESSION_BYTES", str(256 * 1024 ** 2)))
+TABLE_STORE_PROCESS_BYTES = int(os.getenv("TABLE_STORE_PROCESS_BYTES", str(2 * 1024 ** 3)))
+TABLE_STORE_SPILL_DIR = os.getenv("TABLE_STORE_SPILL_DIR", os.path.join(tempfile.gettempdir(), "table_store"))
+# Rows of a table shown (and edited) at once in the preview
+TABLE_PREVIEW_ROWS = int(os.getenv("TABLE_PREVIEW_ROWS", "1000"))
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+CATEGORY_MIN_ROWS = 100
+SPILL_ROW_GROUP_ROWS = 10000
+
+# One lock for every store: the process budget spills tables across sessions
+_lock = threading.RLock()
+_stores = weakref.WeakSet()
+
+
+def _frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def compact_dataframe(df):
+    """
+    Returns a copy of `df` that takes less memory: Python object columns holding only
+    strings become Arrow-backed strings, or categoricals when few distinct values
+    repeat. The values are unchanged (see expand_dataframe()).
+    """
+    columns = {}
+    for name in df.columns:
+        column = df[name]
+        if column.dtype == object or pd.api.types.is_string_dtype(column.dtype):
+            non_null = column.dropna()
+            if len(non_null) and pd.api.types.infer_dtype(non_null, skipna=True) != 'string':
+                continue
+            if len(column) >= CATEGORY_MIN_ROWS and non_null.nunique() <= CATEGORY_MAX_RATIO * len(column):
+                columns[name] = column.astype('category')
+            elif column.dtype == object:
+                columns[name] = column.astype(pd.ArrowDtype(pa.string()))
+    if not columns:
+        return df
+    compacted = df.copy(deep=False)
+    for name, column in columns.items():
+        compacted[name] = column
+    return compacted
+
+
+def expand_dataframe(df, dtypes):
+    """Restores the original column dtypes of a frame produced by compact_dataframe()."""
+    expanded = df.copy(deep=False)
+    for name, dtype in dtypes.items():
+        if name in expanded.columns and expanded[name].dtype != dtype:
+            expanded[name] = expanded[name].astype(dtype)
+    return expanded
+
+
+class _Entry:
+    def __init__(self, df, dtypes):
+        self.df = df
+        self.dtypes = dtypes
+        self.rows = len(df)
+        self.columns = list(df.columns)
+        self.bytes = _frame_bytes(df)
+        self.path = None
+        self.used = time.monotonic()
+
+
+class TableStore(MutableMapping):
+    """
+    Holds the generated tables of one session, as a {table_name: DataFrame} mapping.
+
+    Tables are kept compacted (see compact_dataframe()) and reading one returns it with
+    its original dtypes. When the session goes over TABLE_STORE_SESSION_BYTES, or all
+    the stores of the process over TABLE_STORE_PROCESS_BYTES, the least recently used
+    tables are written to Parquet files and only read back when accessed. window()
+    serves a slice of rows (e.g. for the preview) without loading a spilled table.
+    The spill files are deleted with the store.
+    """
+
+    # Compared by identity: comparing contents would load every table
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+    def __init__(self, tables=None, session_bytes=TABLE_STORE_SESSION_BYTES):
+        self.session_bytes = session_bytes
+        self.version = 0
+        self._entries = {}
+        self._spill_dir = os.path.join(TABLE_STORE_SPILL_DIR, uuid.uuid4().hex)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+        with _lock:
+            _stores.add(self)
+        for name, df in (tables or {}).items():
+            self[name] = df
+
+    def __getitem__(self, name):
+        with _lock:
+            entry = self._entries[name]
+            entry.used = time.monotonic()
+            if entry.df is None:
+                entry.df = self._read_spilled(entry)
+                entry.path = self._remove_file(entry.path)
+                _enforce_budgets(keep=entry)
+            return expand_dataframe(entry.df, entry.dtypes)
+
+    def __setitem__(self, name, df):
+        compacted = compact_dataframe(df)
+        with _lock:
+            old = self._entries.get(name)
+            if old is not None:
+                self._remove_file(old.path)
+            entry = self._entries[name] = _Entry(compacted, df.dtypes.to_dict())
+            self.version += 1
+            _enforce_budgets(keep=entry)
+
+    def __delitem__(self, name):
+        with _lock:
+            entry = self._entries.pop(name)
+            self._remove_file(entry.path)
+            self.version += 1
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def row_count(self, name):
+        return self._entries[name].rows
+
+    def window(self, name, start=0, rows=TABLE_PREVIEW_ROWS):
+        """Returns rows [start, start + rows) of a table with its original dtypes (index starting at `start`)."""
+        with _lock:
+            entry = self._entries[name]
+            start = max(0, min(int(start), entry.rows))
+            stop = min(entry.rows, start + int(rows))
+            if entry.df is not None:
+                window_df = entry.df.iloc[start:stop]
+            elif entry.path.endswith('.parquet'):
+                window_df = self._read_parquet_window(entry.path, start, stop)
+            else:
+                window_df = self._read_spilled(entry).iloc[start:stop]
+        window_df = expand_dataframe(window_df, entry.dtypes)
+        window_df.index = pd.RangeIndex(start, start + len(window_df))
+        return window_df
+
+    def replace_window(self, name, start, window_df, rows=TABLE_PREVIEW_ROWS):
+        """
+        Returns the whole table with the `rows` rows starting at `start` replaced by
+        `window_df` (an edited window(), which may have more or fewer rows). The store
+        is not changed; assign the result to keep it.
+        """
+        df = self[name]
+        start = max(0, min(int(start), len(df)))
+        stop = min(len(df), start + int(rows))
+        return pd.concat([df.iloc[:start], window_df, df.iloc[stop:]], ignore_index=True)
+
+    def stats(self):
+        """Returns {table_name: {'rows', 'bytes', 'spilled'}} for the tables of the store."""
+        with _lock:
+            return {name: {'rows': e.rows, 'bytes': e.bytes, 'spilled': e.df is None} for name, e in self._entries.items()}
+
+    def memory_bytes(self):
+        with _lock:
+            return sum(e.bytes for e in self._entries.values() if e.df is not None)
+
+    def spill(self, name):
+        """Writes a table to disk and drops it from memory."""
+        with _lock:
+            entry = self._entries[name]
+            if entry.df is None:
+                return
+            os.makedirs(self._spill_dir, exist_ok=True)
+            base = os.path.join(self._spill_dir, uuid.uuid4().hex)
+            try:
+                entry.df.to_parquet(base + '.parquet', index=False, row_group_size=SPILL_ROW_GROUP_ROWS)
+                entry.path = base + '.parquet'
+            except (pa.ArrowException, ValueError, TypeError):
+                # Mixed-type object columns Arrow cannot store
+                self._remove_file(base + '.parquet')
+                entry.df.to_pickle(base + '.pkl')
+                entry.path = base + '.pkl'
+            entry.df = None
+
+    def _read_spilled(self, entry):
+        if entry.path.endswith('.parquet'):
+            return pd.read_parquet(entry.path)
+        return pd.read_pickle(entry.path)
+
+    @staticmethod
+    def _read_parquet_window(path, start, stop):
+        parquet_file = pq.ParquetFile(path)
+        groups, offset, first_offset = [], 0, None
+        for i in range(parquet_file.num_row_groups):
+            group_rows = parquet_file.metadata.row_group(i).num_rows
+            if offset + group_rows > start and offset < stop:
+                groups.append(i)
+                first_offset = offset if first_offset is None else first_offset
+            offset += group_rows
+        if not groups:
+            return parquet_file.schema_arrow.empty_table().to_pandas()
+        table = parquet_file.read_row_groups(groups)
+        return table.slice(start - first_offset, stop - start).to_pandas()
+
+    @staticmethod
+    def _remove_file(path):
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return None
+
+    def close(self):
+        """Deletes the spill files of the store."""
+        self._finalizer()
+
+
+def _enforce_budgets(keep=None):
+    """Spills least recently used tables until the session and process budgets are met. Holds _lock."""
+    stores = list(_stores)
+    for store in stores:
+        in_memory = sorted((e.used, name) for name, e in store._entries.items() if e.df is not None and e is not keep)
+        while in_memory and store.memory_bytes() > store.session_bytes:
+            store.spill(in_memory.pop(0)[1])
+
+    total = sum(store.memory_bytes() for store in stores)
+    if total <= TABLE_STORE_PROCESS_BYTES:
+        return
+    candidates = sorted(
+        (e.used, id(store), name, store)
+        for store in stores for name, e in store._entries.items() if e.df is not None and e is not keep
+    )
+    for _, _, name, store in candidates:
+        if total <= TABLE_STORE_PROCESS_BYTES:
+            break
+        total -= store._entries[name].bytes
+        store.spill(name)
+
+
+def get_process_usage():
+    """Returns the memory used by the generated tables of every session, and how many are spilled."""
+    with _lock:
+        stores = list(_stores)
+        return {
+            'sessions': len(stores),
+            'memory_bytes': sum(store.memory_bytes() for store in stores),
+            'spilled_tables': sum(1 for store in stores for e in store._entries.values() if e.df is None),
+            'budget_bytes': TABLE_STORE_PROCESS_BYTES,
+        }
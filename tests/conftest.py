@@ -0,0 +1,26 @@
+import uuid
+import psycopg2
+import pytest
+from psycopg2 import sql
+from db_connector import get_db_connection, execute_query, use_schema
+
+
+@pytest.fixture(scope='session')
+def postgres():
+    """Skips the test when the PostgreSQL database of the DB_* variables is not reachable."""
+    try:
+        get_db_connection().close()
+    except (ConnectionError, psycopg2.Error) as e:
+        pytest.skip(f"PostgreSQL is not available: {e}")
+
+
+@pytest.fixture
+def db_schema(postgres):
+    """Runs the test in a new PostgreSQL schema, dropped afterwards."""
+    schema = f"test_{uuid.uuid4().hex[:8]}"
+    execute_query(sql.SQL("CREATE SCHEMA {}").format(sql.Identifier(schema)))
+    try:
+        with use_schema(schema):
+            yield schema
+    finally:
+        execute_query(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
@@ -0,0 +1,132 @@
+import pandas as pd
+import pytest
+from database_utils import apply_table_changes, compute_table_changes, run_sql_query, setup_db_with_data
+from ddl_parser import parse_ddl_to_schema
+
+DDL = """
+CREATE TABLE customers (
+  id INTEGER PRIMARY KEY,
+  name VARCHAR(20) NOT NULL,
+  balance NUMERIC(10,2)
+);
+CREATE TABLE orders (
+  id INTEGER PRIMARY KEY,
+  customer_id INTEGER REFERENCES customers (id)
+);
+"""
+
+
+def test_compute_table_changes():
+    old = pd.DataFrame({'id': [1, 2, 3], 'name': ['a', 'b', None]})
+    new = pd.DataFrame({'id': [1, 3, 4], 'name': ['a', None, 'd']})
+    inserted, updated, deleted = compute_table_changes(old, new, ['id'])
+    assert inserted['id'].tolist() == [4]
+    assert updated.empty
+    assert deleted['id'].tolist() == [2]
+
+    new.loc[0, 'name'] = 'changed'
+    _, updated, _ = compute_table_changes(old, new, ['id'])
+    assert updated.to_dict('records') == [{'id': 1, 'name': 'changed'}]
+
+
+def test_compute_table_changes_composite_key():
+    old = pd.DataFrame({'a': [1, 1], 'b': [1, 2], 'v': [10, 20]})
+    new = pd.DataFrame({'a': [1, 1], 'b': [1, 2], 'v': [10, 21]})
+    _, updated, _ = compute_table_changes(old, new, ['a', 'b'])
+    assert updated[['a', 'b', 'v']].values.tolist() == [[1, 2, 21]]
+
+
+@pytest.mark.parametrize('old, new', [
+    (pd.DataFrame({'id': [1, 1]}), pd.DataFrame({'id': [1]})),
+    (pd.DataFrame({'id': [1]}), pd.DataFrame({'id': [None]})),
+])
+def test_compute_table_changes_rejects_bad_keys(old, new):
+    with pytest.raises(ValueError):
+        compute_table_changes(old, new, ['id'])
+
+
+def _column_types(table_name):
+    result = run_sql_query(
+        f"SELECT column_name, data_type, is_nullable FROM information_schema.columns "
+        f"WHERE table_schema = current_schema() AND table_name = '{table_name}' ORDER BY ordinal_position"
+    )
+    return {row['column_name']: (row['data_type'], row['is_nullable']) for _, row in result.iterrows()}
+
+
+def _constraints(table_name):
+    result = run_sql_query(
+        f"SELECT contype FROM pg_constraint WHERE conrelid = to_regclass('{table_name}') ORDER BY contype"
+    )
+    return result['contype'].tolist()
+
+
+def test_edit_with_new_column_keeps_types_and_keys(db_schema):
+    schemas = parse_ddl_to_schema(DDL)
+    customers = pd.DataFrame({'id': [1, 2], 'name': ['Ann', 'Bob'], 'balance': [1.5, 2.25]})
+    orders = pd.DataFrame({'id': [10], 'customer_id': [1]})
+    assert "Error" not in setup_db_with_data({'customers': customers, 'orders': orders}, schemas)
+
+    # A new column cannot be applied as a delta: the table is reloaded
+    edited = customers.assign(vip=[True, False])
+    result = apply_table_changes('customers', customers, edited, schemas=schemas)
+    assert "Error" not in result
+
+    columns = _column_types('customers')
+    assert columns['id'] == ('integer', 'NO')
+    assert columns['name'] == ('character varying', 'NO')
+    assert columns['balance'][0] == 'numeric'
+    assert 'vip' in columns
+    assert 'p' in _constraints('customers')
+    # The foreign key of the referencing table survives the swap
+    assert 'f' in _constraints('orders')
+    assert run_sql_query("SELECT count(*) AS n FROM customers")['n'][0] == 2
+
+
+def test_missing_required_values_relax_only_that_column(db_schema):
+    schemas = parse_ddl_to_schema(DDL)
+    customers = pd.DataFrame({'id': [1, 2], 'name': ['Ann', None]})
+    orders = pd.DataFrame({'id': [10, 11], 'customer_id': [1, 2]})
+    load_stats = {}
+    result = setup_db_with_data({'customers': customers, 'orders': orders}, schemas, load_stats=load_stats)
+
+    assert "Error" not in result and "customers.name" in result
+    assert load_stats['customers']['relaxed_not_null'] == ['name']
+    assert load_stats['orders']['relaxed_not_null'] == []
+    columns = _column_types('customers')
+    assert columns['id'] == ('integer', 'NO')
+    assert columns['name'] == ('character varying', 'YES')
+    assert run_sql_query("SELECT count(*) AS n FROM orders")['n'][0] == 2
+
+
+def test_text_values_roundtrip_through_copy(db_schema):
+    values = ['\\N', '', 'tab\there', 'line\nbreak\r\n', 'back\\slash', '"quoted", comma', None]
+    assert "Error" not in setup_db_with_data({'notes': pd.DataFrame({'id': range(len(values)), 'body': values})})
+    result = run_sql_query("SELECT body, body IS NULL AS missing FROM notes ORDER BY id")
+    assert result['body'].tolist()[:-1] == values[:-1]
+    assert result['missing'].tolist() == [False] * 6 + [True]
+
+
+def test_long_names_keep_their_keys_and_indexes(db_schema):
+    parent, child = 'p' * 60, 'c' * 63
+    index_name = 'i' * 63
+    schemas = parse_ddl_to_schema(f"""
+    CREATE TABLE {parent} (id INTEGER PRIMARY KEY, code VARCHAR(10) UNIQUE);
+    CREATE TABLE {child} (id INTEGER PRIMARY KEY, {parent}_id INTEGER REFERENCES {parent} (id));
+    CREATE INDEX {index_name} ON {child} (id, {parent}_id);
+    """)
+    tables = {
+        parent: pd.DataFrame({'id': [1, 2], 'code': ['a', 'b']}),
+        child: pd.DataFrame({'id': [1], f'{parent}_id': [2]}),
+    }
+    # Loaded twice, so the second load replaces tables that already have these names
+    for _ in range(2):
+        result = setup_db_with_data(tables, schemas)
+        assert "Error" not in result and "could not" not in result
+
+    names = run_sql_query(
+        f"SELECT relname AS name FROM pg_class WHERE relnamespace = '{db_schema}'::regnamespace "
+        f"UNION ALL SELECT conname FROM pg_constraint WHERE connamespace = '{db_schema}'::regnamespace"
+    )['name'].tolist()
+    assert not [name for name in names if '__load_' in name]
+    assert index_name in names
+    assert sorted(_constraints(parent)) == ['p', 'u'] and sorted(_constraints(child)) == ['f', 'p']
@@ -0,0 +1,106 @@
+import pytest
+from psycopg2 import extensions
+from db_connector import ConnectionPool, QueryPager, execute_query
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def connect():
+        created.append(FakeConnection())
+        return created[-1]
+
+    options = dict(min_size=0, max_size=2, timeout=0.1, max_idle=300, check_after=300, connect=connect)
+    options.update(kwargs)
+    return ConnectionPool(**options), created
+
+
+def test_connections_are_reused():
+    pool, created = make_pool()
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second and len(created) == 1
+    assert pool.stats()['checkouts'] == 2
+
+
+def test_checkout_times_out_when_the_pool_is_exhausted():
+    pool, _ = make_pool(max_size=1)
+    conn = pool.getconn()
+    with pytest.raises(ConnectionError):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_open_transactions_are_rolled_back_on_return():
+    pool, _ = make_pool()
+    conn = pool.getconn()
+    conn.status = extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1 and pool.stats()['idle'] == 1
+
+
+def test_closed_connections_are_replaced():
+    pool, created = make_pool()
+    conn = pool.getconn()
+    conn.closed = 1
+    pool.putconn(conn)
+    assert pool.stats()['discarded'] == 1
+    assert pool.getconn() is not conn and len(created) == 2
+
+
+def test_idle_connections_above_min_size_expire():
+    pool, created = make_pool(min_size=1, max_idle=0)
+    first, second = pool.getconn(), pool.getconn()
+    pool.putconn(first)
+    pool.putconn(second)
+    pool.getconn()
+    assert sum(conn.closed for conn in created) == 1
+
+
+def test_invalid_sizes_are_refused():
+    with pytest.raises(ValueError):
+        ConnectionPool(min_size=3, max_size=2, connect=FakeConnection)
+
+
+def test_execute_query_round_trip(db_schema):
+    execute_query("CREATE TABLE items (id INT PRIMARY KEY, name TEXT)")
+    execute_query("INSERT INTO items VALUES (1, 'a'), (2, 'b')")
+    df = execute_query("SELECT * FROM items ORDER BY id", fetch_results=True)
+    assert list(df['name']) == ['a', 'b']
+    assert 'Error' in execute_query("SELECT missing FROM items", fetch_results=True).columns
+
+
+def test_pager_pages_and_truncates(db_schema):
+    execute_query("CREATE TABLE numbers AS SELECT g AS n FROM generate_series(1, 25) g")
+    pager = QueryPager("SELECT * FROM numbers ORDER BY n;", page_size=10, max_rows=20)
+    pages = [len(page) for page in pager]
+    assert pages == [10, 10] and pager.truncated and pager.exhausted
+
+
+def test_pager_materializes_at_most_one_row_past_the_cap(db_schema):
+    # Unguarded and without a LIMIT: the held cursor still holds max_rows + 1 rows
+    pager = QueryPager("SELECT g FROM generate_series(1, 1000000) g", page_size=5, max_rows=5)
+    first = pager.next_page()
+    assert len(first) == 5 and pager.truncated
@@ -0,0 +1,67 @@
+from ddl_parser import (build_table_dependencies, get_foreign_keys, get_primary_key, get_unique_keys,
+                        parse_ddl_to_schema, split_create_tables, split_top_level)
+
+DDL = """
+CREATE TABLE IF NOT EXISTS `shop`.`Customers` (
+  `id` INT UNSIGNED NOT NULL AUTO_INCREMENT,
+  email VARCHAR(255) NOT NULL UNIQUE,
+  balance DECIMAL(10, 2) DEFAULT 0,
+  PRIMARY KEY (`id`),
+  KEY idx_email (email)
+) ENGINE=InnoDB;
+
+CREATE TABLE order_items (
+  order_id INTEGER REFERENCES orders,
+  product_id INTEGER,
+  note TEXT,
+  PRIMARY KEY (order_id, product_id),
+  CONSTRAINT fk_product FOREIGN KEY (product_id) REFERENCES products (id),
+  UNIQUE (order_id, note)
+);
+
+CREATE INDEX items_note ON order_items USING gin (note) WHERE note IS NOT NULL;
+"""
+
+
+def test_split_top_level_ignores_nested_separators():
+    assert split_top_level("a NUMERIC(10,2), b VARCHAR(5) DEFAULT 'x,y', c") == [
+        "a NUMERIC(10,2)", "b VARCHAR(5) DEFAULT 'x,y'", "c"
+    ]
+
+
+def test_parse_columns_and_keys():
+    schemas = parse_ddl_to_schema(DDL)
+    assert list(schemas) == ['customers', 'order_items']
+
+    customers = schemas['customers']
+    columns = {c['name']: c for c in customers['columns']}
+    assert list(columns) == ['id', 'email', 'balance']
+    assert columns['id']['sql_type'] == 'INT UNSIGNED' and not columns['id']['nullable']
+    assert columns['email']['type'] == 'VARCHAR' and columns['email']['unique']
+    assert columns['balance']['sql_type'] == 'DECIMAL(10, 2)' and columns['balance']['nullable']
+    assert get_primary_key(customers) == ['id']
+    assert get_unique_keys(customers) == [['email']]
+    assert customers['indexes'] == [
+        {'name': 'idx_email', 'unique': False, 'method': None, 'columns': 'email', 'where': None}
+    ]
+
+
+def test_parse_foreign_keys_and_indexes():
+    items = parse_ddl_to_schema(DDL)['order_items']
+    assert get_primary_key(items) == ['order_id', 'product_id']
+    assert get_unique_keys(items) == [['order_id', 'note']]
+    assert get_foreign_keys(items) == [
+        {'columns': ['order_id'], 'ref_table': 'orders', 'ref_columns': ['order_id']},
+        {'columns': ['product_id'], 'ref_table': 'products', 'ref_columns': ['id']},
+    ]
+    assert items['indexes'] == [
+        {'name': 'items_note', 'unique': False, 'method': 'gin', 'columns': 'note', 'where': 'note IS NOT NULL'}
+    ]
+
+
+def test_dependencies_ignore_unknown_and_self_references():
+    schemas = parse_ddl_to_schema(DDL + """
+    CREATE TABLE orders (id INT PRIMARY KEY, parent_id INT REFERENCES orders (id));
+    """)
+    assert build_table_dependencies(schemas) == {'customers': set(), 'order_items': {'orders'}, 'orders': set()}
+    assert list(split_create_tables(DDL)) == ['customers', 'order_items']
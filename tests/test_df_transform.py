@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+from df_transform import apply_plan, evaluate_expression, validate_plan
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'name': ['a', 'b', 'c'], 'price': [10.0, 20.0, 30.0], 'qty': [1, 2, 3]})
+
+
+def test_update_with_where(df):
+    plan = {'operations': [{'op': 'update', 'column': 'price', 'value': 'price * 1.1', 'where': "name != 'a'"}]}
+    result = apply_plan(df, plan)
+    assert list(result['price'].round(2)) == [10.0, 22.0, 33.0]
+
+
+def test_small_powers_are_allowed(df):
+    assert list(evaluate_expression(df, 'qty ** 2')) == [1, 4, 9]
+    assert evaluate_expression(df, '2 ** 10') == 1024
+
+
+@pytest.mark.parametrize("expression", [
+    "10 ** 10 ** 10",
+    "price ** qty",
+    "2 ** 100",
+    "(2 ** 60) * (2 ** 60)",
+    "'x' * 10 ** 10",
+    "[0] * 100",
+])
+def test_unbounded_arithmetic_is_rejected(df, expression):
+    with pytest.raises(ValueError):
+        validate_plan({'operations': [{'op': 'add_column', 'column': 'x', 'value': expression}]}, df)
+
+
+def test_text_columns_are_not_repeated(df):
+    with pytest.raises(ValueError):
+        evaluate_expression(df, 'name * 1000')
+
+
+def test_added_columns_can_be_multiplied(df):
+    plan = {'operations': [
+        {'op': 'add_column', 'column': 'total', 'value': 'price * qty'},
+        {'op': 'update', 'column': 'total', 'value': 'total * 2'},
+    ]}
+    assert list(apply_plan(df, plan)['total']) == [20.0, 80.0, 180.0]
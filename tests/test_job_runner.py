@@ -0,0 +1,113 @@
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import pandas as pd
+import pytest
+import job_runner
+from job_runner import (FAILED, INTERRUPTED, QUEUED, RUNNING, SUCCEEDED, TABLE_DONE, TABLE_INCOMPLETE, JobRunner,
+                        JobStore, new_owner_id)
+
+PARAMS = {'ddl': "CREATE TABLE items (id INT PRIMARY KEY, name TEXT);", 'num_rows': 4, 'temp': 0.0, 'model': 'fake',
+          'extra_prompt': '', 'max_tokens': 100, 'mode': 'llm', 'seed': 1}
+
+
+def dead_owner():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}:deadbeef"
+
+
+def wait_for_status(store, job_id, statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while (job := store.get_job(job_id))['status'] not in statuses:
+        assert time.monotonic() < deadline, f"job is still {job['status']}"
+        time.sleep(0.02)
+    return job
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path))
+
+
+def test_only_jobs_whose_owner_is_gone_are_interrupted(store):
+    live = store.create_job('s', PARAMS, owner=new_owner_id())
+    other_host = store.create_job('s', PARAMS, owner='other-host:1:cafe')
+    dead = store.create_job('s', PARAMS, owner=dead_owner())
+    stale = store.create_job('s', PARAMS, owner='other-host:2:cafe')
+    store.update_job(stale, status=RUNNING, heartbeat=time.time() - 3600)
+    legacy = store.create_job('s', PARAMS)
+    finished = store.create_job('s', PARAMS, owner=dead_owner())
+    store.update_job(finished, status=SUCCEEDED)
+
+    assert sorted(store.mark_interrupted('me')) == sorted([dead, stale, legacy])
+    for job_id, status in ((live, QUEUED), (other_host, QUEUED), (dead, INTERRUPTED), (stale, INTERRUPTED),
+                           (legacy, INTERRUPTED), (finished, SUCCEEDED)):
+        assert store.get_job(job_id)['status'] == status
+
+
+def test_a_new_runner_keeps_the_jobs_of_live_processes(store):
+    running = store.create_job('s', PARAMS, owner='other-host:1:cafe')
+    store.update_job(running, status=RUNNING)
+    orphan = store.create_job('s', PARAMS, owner=dead_owner())
+
+    runner = JobRunner(store, heartbeat_seconds=0.05)
+    try:
+        assert store.get_job(running)['status'] == RUNNING
+        assert store.get_job(orphan)['status'] == INTERRUPTED
+        # Without heartbeats the other process is eventually considered gone
+        store.update_job(running, heartbeat=time.time() - 3600)
+        wait_for_status(store, running, [INTERRUPTED])
+    finally:
+        runner.shutdown()
+
+
+def test_store_created_before_owners_is_upgraded(tmp_path):
+    with sqlite3.connect(tmp_path / "jobs.sqlite") as conn:
+        conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, db_schema TEXT, status TEXT NOT NULL, stage TEXT, "
+                     "params TEXT NOT NULL, error TEXT, load_stats TEXT, created REAL NOT NULL, updated REAL NOT NULL)")
+        conn.execute("INSERT INTO jobs VALUES ('old', 's', 'running', NULL, '{}', NULL, NULL, 0, 0)")
+    store = JobStore(str(tmp_path))
+    assert store.mark_interrupted('me') == ['old']
+
+
+def test_resume_generates_only_the_missing_rows(store, monkeypatch):
+    calls = []
+
+    def fake_generate(schemas, num_rows, resume_from, on_table_done, **kwargs):
+        calls.append({name: len(df) for name, df in resume_from.items()})
+        previous = resume_from.get('items')
+        start = 0 if previous is None else len(previous)
+        # The first run stops after two rows
+        stop = num_rows if calls[1:] else 2
+        new_rows = pd.DataFrame({'id': range(start, stop), 'name': [f"item {i}" for i in range(start, stop)]})
+        df = new_rows if previous is None else pd.concat([previous, new_rows], ignore_index=True)
+        if len(df) < num_rows:
+            df.attrs['generation_error'] = "the model stopped"
+        on_table_done('items', df, 0.1)
+        return {'items': df}
+
+    loads = []
+    monkeypatch.setattr(job_runner, 'generate_multi_table_data', fake_generate)
+    monkeypatch.setattr(job_runner, 'setup_db_with_data',
+                        lambda tables, schemas, load_stats: loads.append(len(tables['items'])) or "ok")
+
+    runner = JobRunner(store)
+    try:
+        job_id = runner.submit('s', PARAMS)
+        job = wait_for_status(store, job_id, [SUCCEEDED, FAILED])
+        assert job['tables'][0]['status'] == TABLE_INCOMPLETE and job['tables'][0]['rows_done'] == 2
+        assert job['owner'] == runner.owner
+
+        assert runner.resume(job_id, db_schema='other')
+        job = wait_for_status(store, job_id, [SUCCEEDED, FAILED])
+        assert job['status'] == SUCCEEDED and job['db_schema'] == 'other'
+        assert job['tables'][0]['status'] == TABLE_DONE and job['tables'][0]['rows_done'] == 4
+        assert calls == [{}, {'items': 2}]
+        assert loads == [2, 4]
+        assert store.load_results(job_id)['items']['id'].tolist() == [0, 1, 2, 3]
+        assert not runner.resume('unknown')
+    finally:
+        runner.shutdown(wait=True)
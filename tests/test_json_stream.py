@@ -0,0 +1,72 @@
+import numpy as np
+from json_stream import ColumnarRowBuffer, JsonArrayStreamDecoder
+
+
+def test_decoder_yields_rows_across_chunks():
+    decoder = JsonArrayStreamDecoder()
+    rows = decoder.feed('```json\n[{"a": 1}, {"a"') + decoder.feed(': 2}]')
+    decoder.close()
+    assert rows == [{'a': 1}, {'a': 2}]
+
+
+def test_int_column_then_null():
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'a': 1, 'b': 'x'}, {'a': None, 'b': 'y'}])
+    df = buffer.to_dataframe()
+    assert str(df['a'].dtype) == 'Int64'
+    assert df['a'].iloc[0] == 1 and df['a'].isna().iloc[1]
+    assert list(df['b']) == ['x', 'y']
+
+
+def test_int_column_then_missing_key():
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'a': 1, 'b': 2}, {'b': 3}])
+    df = buffer.to_dataframe()
+    assert len(df) == 2 and df['a'].isna().iloc[1]
+    assert list(df['b']) == [2, 3]
+
+
+def test_int_column_then_float():
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'a': 1}, {'a': 2.5}])
+    assert list(buffer.to_dataframe()['a']) == [1.0, 2.5]
+
+
+def test_int_column_then_str():
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'a': 1}, {'a': 'two'}, {'a': None}])
+    assert list(buffer.to_dataframe()['a']) == [1, 'two', None]
+
+
+def test_columns_keep_the_same_length():
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'a': 1.5}, {'a': 10 ** 400, 'b': 1}, {'b': None}])
+    assert {name: len(column) for name, column in buffer._columns.items()} == {'a': 3, 'b': 3}
+    assert buffer._columns['a'].values[1] == 10 ** 400
+
+
+def test_big_integers_keep_their_precision_next_to_nulls():
+    big = 2 ** 53 + 1
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'id': None}, {'id': big}, {'id': None}, {'id': big + 2}])
+    column = buffer.to_dataframe()['id']
+    assert str(column.dtype) == 'Int64'
+    assert column.isna().tolist() == [True, False, True, False]
+    assert column.iloc[1] == big and column.iloc[3] == big + 2
+
+
+def test_nullable_int_column_then_float_and_str():
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'a': 1}, {'a': None}, {'a': 2.5}])
+    values = buffer.to_dataframe()['a'].tolist()
+    assert values[0] == 1.0 and np.isnan(values[1]) and values[2] == 2.5
+
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'a': 1}, {'a': None}, {'a': 'x'}])
+    assert buffer.to_dataframe()['a'].tolist() == [1, None, 'x']
+
+
+def test_preview_of_a_nullable_int_column():
+    buffer = ColumnarRowBuffer()
+    buffer.extend([{'a': 1}, {'a': 2}, {'a': None}])
+    assert buffer.to_dataframe(limit=2)['a'].tolist() == [1, 2]
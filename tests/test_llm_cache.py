@@ -0,0 +1,63 @@
+import time
+from llm_cache import LLMCache, make_cache_key
+
+
+def make_cache(tmp_path, **kwargs):
+    options = dict(path=str(tmp_path / "llm_cache.sqlite3"), ttl=3600, max_bytes=1024 * 1024, memory_entries=2,
+                   enabled=True, disabled_sites=())
+    options.update(kwargs)
+    return LLMCache(**options)
+
+
+def test_key_depends_on_every_input():
+    key = make_cache_key('m', 'system', 'prompt', {'temperature': 0.5})
+    assert key == make_cache_key('m', 'system', 'prompt', {'temperature': 0.5})
+    assert key != make_cache_key('m', 'system', 'prompt', {'temperature': 0.6})
+    assert key != make_cache_key('m', None, 'prompt', {'temperature': 0.5})
+    assert key != make_cache_key('other', 'system', 'prompt', {'temperature': 0.5})
+
+
+def test_memory_then_disk_hits(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get('k', 'nl_to_sql') is None
+    cache.put('k', 'SELECT 1', 'STOP')
+    assert cache.get('k', 'nl_to_sql')['text'] == 'SELECT 1'
+
+    # A new process only has the disk tier
+    reopened = make_cache(tmp_path)
+    assert reopened.get('k', 'nl_to_sql')['finish_reason'] == 'STOP'
+    assert reopened.stats()['sites']['nl_to_sql'] == {'memory_hits': 0, 'disk_hits': 1, 'misses': 0}
+    assert cache.stats()['sites']['nl_to_sql'] == {'memory_hits': 1, 'disk_hits': 0, 'misses': 1}
+
+
+def test_memory_tier_is_bounded(tmp_path):
+    cache = make_cache(tmp_path, memory_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, key, 'STOP')
+    assert cache.stats()['memory_entries'] == 2
+    assert cache.get('a')['text'] == 'a'
+    assert cache.stats()['sites']['default']['disk_hits'] == 1
+
+
+def test_entries_expire(tmp_path):
+    cache = make_cache(tmp_path, ttl=0.05)
+    cache.put('k', 'text', 'STOP')
+    time.sleep(0.1)
+    assert cache.get('k') is None
+    assert make_cache(tmp_path, ttl=0.05).get('k') is None
+
+
+def test_least_recently_used_entries_are_evicted_from_disk(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=300, memory_entries=0)
+    for i in range(5):
+        cache.put(f"key{i}", "x" * 100, 'STOP')
+    assert cache.stats()['disk_bytes'] <= 300
+    assert cache.get('key4') is not None and cache.get('key0') is None
+
+
+def test_disabled_sites(tmp_path):
+    cache = make_cache(tmp_path, disabled_sites={'generate_data'})
+    assert not cache.enabled_for('generate_data') and cache.enabled_for('nl_to_sql')
+    cache.set_site_enabled('generate_data', True)
+    assert cache.enabled_for('generate_data')
+    assert not make_cache(tmp_path, enabled=False).enabled_for('nl_to_sql')
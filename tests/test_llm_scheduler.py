@@ -0,0 +1,163 @@
+import threading
+import time
+import pytest
+from llm_scheduler import LANE_AGING_SECONDS, LLMScheduler, TokenBucket, is_retryable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def run_in_thread(scheduler, fn, **kwargs):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(scheduler.execute(fn, **kwargs)), daemon=True)
+    thread.start()
+    return thread, results
+
+
+def test_token_bucket_refills_and_carries_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+    assert bucket.delay(60) == 0
+    bucket.take(90)
+    assert bucket.delay(1) == pytest.approx(31)
+    clock.advance(31)
+    assert bucket.delay(1) == 0
+    # More than the bucket holds only waits for a full bucket
+    assert bucket.delay(1000) == pytest.approx(59)
+    assert TokenBucket(0, clock).delay(10 ** 9) == 0
+
+
+def test_requests_wait_for_the_token_budget():
+    clock = FakeClock()
+    scheduler = LLMScheduler(rpm=0, tpm=60, clock=clock)
+    assert scheduler.execute(lambda: 'first', estimated_tokens=60) == ('first', False)
+
+    thread, results = run_in_thread(scheduler, lambda: 'second', estimated_tokens=30)
+    wait_until(lambda: scheduler.stats()['queue_depth'] == 1)
+    clock.advance(29)
+    scheduler.report_tokens(0, 0)
+    time.sleep(0.05)
+    assert not results
+
+    clock.advance(1)
+    scheduler.report_tokens(0, 0)
+    thread.join(2)
+    assert results == [('second', False)]
+    assert scheduler.stats()['throttled'] == 1
+
+
+def _queue_behind_a_running_call(scheduler, clock, bulk_age):
+    release = threading.Event()
+    order = []
+    running, _ = run_in_thread(scheduler, release.wait, call_site='generate_data')
+    wait_until(lambda: scheduler.stats()['running'] == 1)
+
+    bulk, _ = run_in_thread(scheduler, lambda: order.append('bulk'), call_site='generate_data')
+    wait_until(lambda: scheduler.stats()['queue_depth'] == 1)
+    clock.advance(bulk_age)
+    interactive, _ = run_in_thread(scheduler, lambda: order.append('interactive'), call_site='nl_to_sql')
+    wait_until(lambda: scheduler.stats()['queue_depth'] == 2)
+
+    release.set()
+    for thread in (running, bulk, interactive):
+        thread.join(2)
+    return order
+
+
+def test_interactive_lane_goes_first():
+    clock = FakeClock()
+    scheduler = LLMScheduler(rpm=0, tpm=0, max_concurrency=1, clock=clock)
+    assert _queue_behind_a_running_call(scheduler, clock, bulk_age=1) == ['interactive', 'bulk']
+
+
+def test_old_bulk_requests_are_not_starved():
+    clock = FakeClock()
+    scheduler = LLMScheduler(rpm=0, tpm=0, max_concurrency=1, clock=clock)
+    assert _queue_behind_a_running_call(scheduler, clock, bulk_age=LANE_AGING_SECONDS) == ['bulk', 'interactive']
+
+
+def test_identical_requests_are_coalesced():
+    scheduler = LLMScheduler(rpm=0, tpm=0, clock=FakeClock())
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        release.wait()
+        return 'answer'
+
+    leader, leader_results = run_in_thread(scheduler, call, coalesce_key='same prompt')
+    wait_until(lambda: calls)
+    follower, follower_results = run_in_thread(scheduler, call, coalesce_key='same prompt')
+    wait_until(lambda: scheduler.stats()['coalesced'] == 1)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+
+    assert leader_results == [('answer', False)]
+    assert follower_results == [('answer', True)]
+    assert len(calls) == 1
+    assert scheduler.execute(lambda: 'again', coalesce_key='same prompt') == ('again', False)
+
+
+def test_retryable_errors_are_retried_with_backoff():
+    sleeps = []
+    scheduler = LLMScheduler(rpm=0, tpm=0, max_retries=3, backoff_base=1.0, clock=FakeClock(), sleep=sleeps.append)
+    errors = [ApiError(429), ApiError(503)]
+
+    def flaky():
+        if errors:
+            raise errors.pop(0)
+        return 'ok'
+
+    assert scheduler.execute(flaky) == ('ok', False)
+    assert len(sleeps) == 2 and 0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2
+    stats = scheduler.stats()
+    assert (stats['calls'], stats['retries'], stats['failures']) == (3, 2, 0)
+
+
+@pytest.mark.parametrize("error, can_retry", [
+    (ApiError(400), None),
+    (ApiError(429), lambda: False),
+])
+def test_other_failures_are_not_retried(error, can_retry):
+    scheduler = LLMScheduler(rpm=0, tpm=0, clock=FakeClock(), sleep=lambda s: None)
+
+    def failing():
+        raise error
+
+    with pytest.raises(ApiError):
+        scheduler.execute(failing, can_retry=can_retry)
+    assert (scheduler.stats()['calls'], scheduler.stats()['failures']) == (1, 1)
+
+
+def test_is_retryable():
+    class Status(Exception):
+        def code(self):
+            return 503
+
+    assert is_retryable(ConnectionError()) and is_retryable(TimeoutError())
+    assert is_retryable(Status())
+    assert is_retryable(ApiError(500)) and not is_retryable(ApiError(404))
+    assert not is_retryable(ValueError())
@@ -0,0 +1,52 @@
+import pandas as pd
+from data_versions import bump_table_version
+from db_connector import use_schema
+from query_cache import QueryResultCache, normalize_sql, referenced_tables
+
+
+def test_normalize_sql_keeps_literals():
+    assert normalize_sql("SELECT  *\nFROM Items -- all\nWHERE name = 'A  b';") == "select * from items where name = 'A  b'"
+    assert normalize_sql('SELECT "Name" /* x */ FROM t') == 'select "Name" from t'
+
+
+def test_referenced_tables():
+    query = normalize_sql("SELECT * FROM orders JOIN \"Items\" ON true WHERE note = 'customers'")
+    assert referenced_tables(query, ['orders', 'items', 'customers']) == ['items', 'orders']
+
+
+def test_results_are_keyed_by_table_versions():
+    cache = QueryResultCache(max_bytes=1024 * 1024, enabled=True)
+    with use_schema('query_cache_test'):
+        bump_table_version('cached_items')
+        key = cache.make_key("SELECT * FROM cached_items")
+        assert key == cache.make_key("select *  from cached_items;")
+        cache.put(key, pd.DataFrame({'id': [1, 2]}))
+        assert cache.get(key)['id'].tolist() == [1, 2]
+
+        bump_table_version('cached_items')
+        new_key = cache.make_key("SELECT * FROM cached_items")
+        assert new_key != key
+        # Tables the query does not read do not change its key
+        bump_table_version('other_table')
+        assert cache.make_key("SELECT * FROM cached_items") == new_key
+
+    # The same text in another session schema is another query
+    with use_schema('query_cache_other'):
+        assert cache.make_key("SELECT * FROM cached_items") != key
+
+
+def test_errors_are_not_cached_and_the_budget_is_kept():
+    cache = QueryResultCache(max_bytes=40000, enabled=True)
+    cache.put('error', pd.DataFrame({'Error': ['boom']}))
+    assert cache.get('error') is None
+    for i in range(20):
+        cache.put(f"k{i}", pd.DataFrame({'v': range(200)}))
+    stats = cache.stats()
+    assert stats['bytes'] <= 40000 and stats['entries'] < 20
+    assert cache.get('k19') is not None and cache.get('k0') is None
+
+
+def test_disabled_cache():
+    cache = QueryResultCache(enabled=False)
+    cache.put('k', pd.DataFrame({'v': [1]}))
+    assert cache.get('k') is None
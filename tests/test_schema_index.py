@@ -0,0 +1,52 @@
+from db_connector import use_schema
+from schema_index import SchemaIndex, prune_schema_ddl, tokenize
+
+FILLER = "\n".join(f"CREATE TABLE audit_log_{i} (id INT PRIMARY KEY, payload TEXT);" for i in range(12))
+DDL = """
+CREATE TABLE customers (id INT PRIMARY KEY, full_name VARCHAR(100), city VARCHAR(50));
+CREATE TABLE orders (id INT PRIMARY KEY, customer_id INT REFERENCES customers (id), placed_at DATE);
+CREATE TABLE order_items (id INT PRIMARY KEY, order_id INT REFERENCES orders (id), product_id INT REFERENCES products (id));
+CREATE TABLE products (id INT PRIMARY KEY, productName VARCHAR(100), unit_price NUMERIC(10,2));
+""" + FILLER
+
+
+def test_tokenize_splits_and_stems_identifiers():
+    assert tokenize("orderItems unit_prices HTTPHeaders VARCHAR") == [
+        'order', 'item', 'unit', 'price', 'http', 'header', 'varchar'
+    ]
+    assert tokenize("how many of the categories") == ['category']
+
+
+def test_search_ranks_table_names_first():
+    index = SchemaIndex()
+    index.update(DDL)
+    assert index.search("product prices")[0][0] == 'products'
+    assert index.search("unknown words") == []
+
+
+def test_selected_tables_include_the_join_path():
+    index = SchemaIndex()
+    index.update(DDL)
+    # customers and products only connect through orders and order_items
+    assert index.select_tables("customer city and product name", top_k=2) == [
+        'customers', 'orders', 'order_items', 'products'
+    ]
+
+
+def test_update_is_incremental():
+    index = SchemaIndex()
+    assert len(index.update(DDL)) == 16
+    assert index.update(DDL) == []
+    changed = index.update(DDL.replace("city VARCHAR(50)", "city VARCHAR(50), country VARCHAR(50)"))
+    assert changed == ['customers']
+    assert index.update(DDL.replace(FILLER, "")) == [f"audit_log_{i}" for i in range(12)] + ['customers']
+    assert len(index) == 4
+
+
+def test_prune_keeps_small_schemas_whole():
+    with use_schema('schema_index_test'):
+        small = DDL.replace(FILLER, "")
+        assert prune_schema_ddl("customer city", small) == small
+        pruned = prune_schema_ddl("customer city", DDL, top_k=1)
+        assert "CREATE TABLE customers" in pruned
+        assert "audit_log" not in pruned and "products" not in pruned
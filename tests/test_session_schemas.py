@@ -0,0 +1,64 @@
+import pytest
+from psycopg2 import sql
+from db_connector import execute_query, pooled_connection, use_schema
+from session_schemas import REGISTRY_TABLE, activate_session_schema, new_session_schema
+
+
+def _search_path(schema=None):
+    with pooled_connection(schema) as conn, conn.cursor() as cur:
+        cur.execute("SHOW search_path")
+        return cur.fetchone()[0]
+
+
+def _drop(schema):
+    execute_query(sql.SQL("DROP SCHEMA IF EXISTS {} CASCADE").format(sql.Identifier(schema)))
+    execute_query(sql.SQL("DELETE FROM public.{} WHERE schema_name = {}").format(
+        sql.Identifier(REGISTRY_TABLE), sql.Literal(schema)))
+
+
+def _exists(schema):
+    result = execute_query(sql.SQL("SELECT count(*) AS n FROM pg_namespace WHERE nspname = {}").format(
+        sql.Literal(schema)), fetch_results=True)
+    return result['n'][0] == 1
+
+
+@pytest.fixture
+def session_schema(postgres):
+    schema = new_session_schema()
+    try:
+        with use_schema(None):
+            yield schema
+    finally:
+        with use_schema(None):
+            _drop(schema)
+
+
+def test_search_path_follows_the_current_schema(db_schema):
+    assert _search_path() == db_schema
+    with use_schema(None):
+        assert _search_path() == '"$user", public'
+    assert _search_path('public') == 'public'
+    assert _search_path() == db_schema
+
+
+def test_schema_is_created_once_per_touch_interval(session_schema):
+    assert activate_session_schema(session_schema) is True
+    assert _exists(session_schema)
+    assert activate_session_schema(session_schema) is False
+    assert _search_path() == session_schema
+
+
+def test_schema_dropped_by_another_process_is_recreated(session_schema):
+    assert activate_session_schema(session_schema) is True
+    # Garbage-collected elsewhere while this process still has it cached as touched
+    with use_schema(None):
+        _drop(session_schema)
+
+    result = execute_query("CREATE TABLE items (id INTEGER)")
+    assert 'Error' in result.columns
+    assert _exists(session_schema)
+    assert execute_query("CREATE TABLE items (id INTEGER)").empty
+
+    # The session is told once that its tables are gone
+    assert activate_session_schema(session_schema) is True
+    assert activate_session_schema(session_schema) is False
@@ -0,0 +1,44 @@
+import pytest
+from sql_guard import check_read_only, add_limit, strip_statement
+
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT coalesce(comment, '') FROM reviews",
+    "SELECT * FROM jobs WHERE (load > 3)",
+    "SELECT upper(set) FROM t",
+    "SELECT id FROM t WHERE (lock OR analyze) AND (do = 1) AND (call IS NULL)",
+    "WITH recent AS (SELECT * FROM orders) SELECT count(*) FROM recent",
+    "SELECT 'DELETE FROM t' AS text",
+    "SELECT $$;$$",
+    "SELECT $body$ DROP TABLE t; $body$ AS text",
+])
+def test_read_only_queries_pass(sql_query):
+    assert check_read_only(sql_query) == []
+
+
+@pytest.mark.parametrize("sql_query", [
+    "DELETE FROM t",
+    "WITH gone AS (DELETE FROM t RETURNING *) SELECT * FROM gone",
+    "WITH gone AS MATERIALIZED (UPDATE t SET a = 1 RETURNING *) SELECT * FROM gone",
+    "SELECT 1; DROP TABLE t",
+    "SELECT * FROM t FOR UPDATE",
+    "SELECT * INTO copy FROM t",
+    "SELECT pg_sleep(10)",
+])
+def test_writes_are_rejected(sql_query):
+    assert check_read_only(sql_query)
+
+
+def test_add_limit_keeps_an_existing_limit():
+    assert add_limit("SELECT * FROM t LIMIT 5;") == "SELECT * FROM t LIMIT 5"
+    assert add_limit("SELECT * FROM t", limit=10).endswith("LIMIT 10")
+
+
+@pytest.mark.parametrize("sql_query, expected", [
+    ("SELECT * FROM t WHERE note = 'a--b'", "SELECT * FROM t WHERE note = 'a--b'"),
+    ("SELECT ';' AS s ; -- done\n;", "SELECT ';' AS s"),
+    ('SELECT "a;b" FROM t -- it\'s here', 'SELECT "a;b" FROM t'),
+    ("SELECT $$ -- $$ AS s;", "SELECT $$ -- $$ AS s"),
+])
+def test_strip_statement_ignores_literals(sql_query, expected):
+    assert strip_statement(sql_query) == expected
@@ -0,0 +1,64 @@
+import pandas as pd
+from ddl_parser import get_foreign_keys, parse_ddl_to_schema
+from synthetic_sampler import sample_table, table_seed, validate_table_spec
+
+SCHEMAS = parse_ddl_to_schema("""
+CREATE TABLE customers (
+  id INTEGER PRIMARY KEY,
+  email VARCHAR(100) NOT NULL,
+  tier VARCHAR(10),
+  score NUMERIC(5,2)
+);
+CREATE TABLE orders (
+  id INTEGER PRIMARY KEY,
+  customer_id INTEGER REFERENCES customers (id),
+  placed DATE
+);
+""")
+
+
+def test_invalid_specs_fall_back_to_defaults():
+    spec = {'columns': {
+        'ID': {'generator': 'choice', 'values': [1, 2]},
+        'email': {'generator': 'template', 'template': 'user{n}@example.com', 'null_rate': 0.5},
+        'tier': {'generator': 'nope'},
+    }}
+    specs, warnings = validate_table_spec(spec, SCHEMAS['customers'])
+    assert specs['id']['generator'] == 'sequence'
+    assert specs['email'] == {'generator': 'template', 'template': 'user{n}@example.com', 'start': 1, 'null_rate': 0.0}
+    assert specs['tier']['generator'] == 'template'
+    assert specs['score']['generator'] == 'float'
+    assert [w.split(':')[0] for w in warnings] == ['id', 'tier', 'score']
+
+
+def test_sampling_is_reproducible_per_table():
+    specs, _ = validate_table_spec({'columns': {
+        'tier': {'generator': 'choice', 'values': ['gold', 'silver'], 'weights': [1, 3], 'null_rate': 0.2},
+        'score': {'generator': 'float', 'min': 10, 'max': 0, 'distribution': 'normal'},
+    }}, SCHEMAS['customers'])
+    first = sample_table(SCHEMAS['customers'], specs, 500, seed=table_seed(7, 'customers'))
+    second = sample_table(SCHEMAS['customers'], specs, 500, seed=table_seed(7, 'customers'))
+    pd.testing.assert_frame_equal(first, second)
+
+    assert list(first.columns) == ['id', 'email', 'tier', 'score']
+    assert first['id'].is_unique and first['email'].is_unique
+    assert set(first['tier'].dropna()) <= {'gold', 'silver'}
+    assert 0 < first['tier'].isna().sum() < 500
+    assert first['score'].between(0, 10).all()
+    assert table_seed(7, 'customers') != table_seed(7, 'orders')
+    assert table_seed(None, 'customers') is None
+
+
+def test_foreign_keys_sample_parent_keys():
+    foreign_keys = get_foreign_keys(SCHEMAS['orders'])
+    specs, _ = validate_table_spec({'columns': {}}, SCHEMAS['orders'], ['customer_id'])
+    assert 'customer_id' not in specs
+
+    parents = pd.DataFrame({'id': [3, 5, 8]})
+    orders = sample_table(SCHEMAS['orders'], specs, 200, seed=1, foreign_keys=foreign_keys,
+                          parent_data={'customers': parents})
+    assert set(orders['customer_id']) <= {3, 5, 8}
+    assert orders['placed'].notna().all()
+
+    orphans = sample_table(SCHEMAS['orders'], specs, 5, seed=1, foreign_keys=foreign_keys, parent_data={})
+    assert orphans['customer_id'].isna().all()
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import table_store
+from table_store import TableStore, compact_dataframe, expand_dataframe
+
+
+@pytest.fixture(autouse=True)
+def spill_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(table_store, 'TABLE_STORE_SPILL_DIR', str(tmp_path))
+    monkeypatch.setattr(table_store, 'SPILL_ROW_GROUP_ROWS', 100)
+    return tmp_path
+
+
+def make_table(rows=1000, offset=0):
+    return pd.DataFrame({
+        'id': np.arange(offset, offset + rows),
+        'status': np.where(np.arange(rows) % 3, 'open', 'closed').astype(object),
+        'email': pd.Series([f"user{i}@example.com" for i in range(offset, offset + rows)], dtype=object),
+        'amount': np.arange(rows) * 0.5,
+    })
+
+
+def test_compaction_keeps_values_and_dtypes():
+    df = make_table()
+    df['mixed'] = pd.Series([1 if i % 2 else 'one' for i in range(len(df))], dtype=object)
+    compacted = compact_dataframe(df)
+    assert isinstance(compacted['status'].dtype, pd.CategoricalDtype)
+    assert isinstance(compacted['email'].dtype, pd.ArrowDtype)
+    assert compacted['mixed'].dtype == object
+    assert compacted.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
+    pd.testing.assert_frame_equal(expand_dataframe(compacted, df.dtypes.to_dict()), df)
+
+
+def test_least_recently_used_tables_spill_over_budget(spill_dir):
+    budget = compact_dataframe(make_table()).memory_usage(index=True, deep=True).sum() * 1.5
+    store = TableStore(session_bytes=budget)
+    store['first'] = make_table()
+    store['second'] = make_table(offset=1000)
+    assert store.stats()['first']['spilled'] and not store.stats()['second']['spilled']
+    assert len(os.listdir(store._spill_dir)) == 1
+
+    # Reading a spilled table loads it back and spills the other one instead
+    pd.testing.assert_frame_equal(store['first'], make_table())
+    assert not store.stats()['first']['spilled'] and store.stats()['second']['spilled']
+    assert len(os.listdir(store._spill_dir)) == 1
+    assert store.memory_bytes() <= budget
+
+    store.close()
+    assert not os.path.exists(store._spill_dir)
+
+
+def test_window_of_a_spilled_table_reads_only_its_rows():
+    store = TableStore({'orders': make_table()})
+    store.spill('orders')
+    window = store.window('orders', start=250, rows=120)
+    assert list(window.index) == list(range(250, 370))
+    pd.testing.assert_frame_equal(window, make_table().iloc[250:370])
+    assert store.stats()['orders']['spilled']
+    assert store.window('orders', start=5000).empty
+
+    edited = store.window('orders', start=990, rows=20).iloc[:5]
+    assert len(store.replace_window('orders', 990, edited, rows=20)) == 995
+
+
+def test_mixed_columns_spill_with_pickle():
+    df = pd.DataFrame({'value': [1, 'two', 3.0, None]})
+    store = TableStore({'mixed': df})
+    store.spill('mixed')
+    assert store._entries['mixed'].path.endswith('.pkl')
+    pd.testing.assert_frame_equal(store['mixed'], df)
+    pd.testing.assert_frame_equal(store.window('mixed', 1, 2), df.iloc[1:3])